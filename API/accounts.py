@@ -0,0 +1,321 @@
+import asyncio
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from urllib.parse import quote
+
+from google.oauth2.credentials import Credentials
+
+from event_store import EventStore
+from gcal_service import GoogleCalendarService, SCOPES, load_credentials
+from transport import token_session
+
+DEFAULT_USER = "default" # The single user of a local install, whose credentials are in token.json
+REFRESH_MARGIN = 300 # Seconds before expiry to refresh a token; more than google-auth's own 3m45s, so requests never find it stale
+
+class CredentialStore:
+    """Calendar credentials per user, and the user each conversation thread acts for
+
+    Credentials are kept as one authorized-user JSON file per user in `directory`, rewritten whenever they are
+    refreshed. The default user keeps the single-user `token.json` and interactive login flow. A run acts for the
+    `user_id` in its config, or else `default_user`; set that to None on a multi-tenant server so runs without a user
+    are refused, rather than acting for the default user.
+
+    A thread is linked to the first user to run it, and runs for any other user are refused. Links are kept in
+    `threads.sqlite` in `directory`, so they survive restarts, the `max_threads` most recently linked at most; the
+    `cached_threads` most recently used are also kept in memory."""
+
+    def __init__(self, directory: str = "tokens", default_path: str = "token.json", default_user: str = DEFAULT_USER,
+                 max_threads: int = 100_000, cached_threads: int = 10_000):
+        self.directory = directory # None keeps credentials and thread links in memory only
+        self.default_path = default_path
+        self.default_user = default_user
+        self.max_threads = max_threads
+        self.cached_threads = cached_threads
+        self._creds: dict[str, Credentials] = {}
+        self._threads: OrderedDict[str, str] = OrderedDict() # Thread ID -> user, least recently used first
+        self._links: sqlite3.Connection = None # Opened on first use, so nothing is read or created at import
+        self._used: dict[str, float] = {} # User -> last time their credentials were handed out
+        self._lock = threading.Lock()
+        self._threads_lock = threading.Lock()
+
+    def user(self, config: dict = None) -> str:
+        """The user a run acts for: the `user_id` in its config, or `default_user` if there's none. Links the thread to
+        that user if it isn't linked yet, raises PermissionError if it's linked to someone else, or there's no user"""
+
+        configurable = (config or {}).get("configurable", {})
+        user, thread_id = self.requester(configurable.get("user_id")), configurable.get("thread_id")
+        linked = self.owner(thread_id) if thread_id else None
+        if linked and user != linked:
+            raise PermissionError(f"Thread {thread_id} belongs to another user")
+        if user is None:
+            raise PermissionError(f"No user to run thread {thread_id} for")
+        if thread_id and not linked:
+            self.link(thread_id, user)
+        return user
+
+    def requester(self, user_id: str | None) -> str | None:
+        """The user a run with `user_id` in its config acts for, None if there's none: `default_user` without one, and
+        `DEFAULT_USER` (whose credentials are in token.json) only when it's `default_user`"""
+
+        if not user_id:
+            return self.default_user
+        return None if user_id == DEFAULT_USER and self.default_user != DEFAULT_USER else user_id
+
+    def cached_user(self, config: dict = None) -> str | None:
+        """`user`, if it can be told from memory alone, without linking the thread or reading the links database;
+        None otherwise (and where `user` would raise)"""
+
+        configurable = (config or {}).get("configurable", {})
+        user, thread_id = self.requester(configurable.get("user_id")), configurable.get("thread_id")
+        if not thread_id:
+            return user
+        with self._threads_lock:
+            linked = self._threads.get(thread_id)
+        return user if linked and linked == user else None # Unless it has to be linked, or may be linked on disk
+
+    def owner(self, thread_id: str) -> str | None:
+        """The user a thread is linked to, None if it isn't"""
+
+        with self._threads_lock:
+            user = self._threads.get(thread_id)
+            if user is None and self.links(create=False) is not None:
+                row = self._links.execute("SELECT user FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+                user = row and row[0]
+            if user is not None:
+                self._cache(thread_id, user)
+            return user
+
+    def link(self, thread_id: str, user: str):
+        """Makes runs on a thread act for a user"""
+
+        with self._threads_lock:
+            self._cache(thread_id, user)
+            if self.links() is None:
+                return
+            with self._links:
+                self._links.execute("INSERT OR REPLACE INTO threads VALUES (?, ?, ?)", (thread_id, user, time.time()))
+                self._links.execute(
+                    "DELETE FROM threads WHERE thread_id IN (SELECT thread_id FROM threads ORDER BY linked_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_threads,)
+                )
+
+    def links(self, create: bool = True) -> sqlite3.Connection | None:
+        """The thread links database, None if links are kept in memory only, or if it doesn't exist yet and `create`
+        isn't set. Call holding `_threads_lock`"""
+
+        if self._links is None and self.directory:
+            path = os.path.join(self.directory, "threads.sqlite")
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            self._links = sqlite3.connect(path, check_same_thread=False)
+            self._links.execute("CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, user TEXT NOT NULL, linked_at REAL NOT NULL)")
+            self._links.execute("CREATE INDEX IF NOT EXISTS threads_linked_at ON threads (linked_at)")
+        return self._links
+
+    def _cache(self, thread_id: str, user: str):
+        self._threads[thread_id] = user
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > (self.cached_threads if self.directory else self.max_threads): # The rest are on disk
+            self._threads.popitem(last=False)
+
+    def put(self, user: str, creds: Credentials):
+        """Stores a user's credentials, e.g. at the end of their authorization flow"""
+
+        with self._lock:
+            self._creds[user] = creds
+        self.save(user)
+
+    def get(self, user: str, active: bool = True) -> Credentials:
+        """A user's credentials, loaded from disk on first use. Marks the user active unless `active` is False"""
+
+        with self._lock:
+            creds = self._creds.get(user)
+        if creds is None:
+            creds = self.load(user) # Reads a file, or for the default user may run the login flow, so not under the lock
+        with self._lock:
+            creds = self._creds.setdefault(user, creds) # Another thread may have loaded them meanwhile
+            if active:
+                self._used[user] = time.monotonic()
+            return creds
+
+    def forget(self, user: str):
+        """Drops a user's credentials from memory, e.g. once their clients are evicted, unless that's the only place
+        they're kept (see `path`); they're loaded again on next use"""
+
+        if self.path(user) is None:
+            return
+        with self._lock:
+            self._creds.pop(user, None)
+            self._used.pop(user, None)
+
+    def load(self, user: str) -> Credentials:
+        if user == DEFAULT_USER:
+            return load_credentials(token_path=self.default_path)
+        path = self.path(user)
+        if path is None or not os.path.exists(path):
+            raise PermissionError(f"No Calendar credentials for user {user}")
+        return Credentials.from_authorized_user_file(path, SCOPES)
+
+    def save(self, user: str):
+        path = self.path(user)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+            file.write(self._creds[user].to_json())
+        os.replace(temp_path, path)
+
+    def path(self, user: str) -> str | None:
+        if user == DEFAULT_USER:
+            return self.default_path
+        return os.path.join(self.directory, quote(user, safe="@.-_") + ".json") if self.directory else None
+
+    def due(self, margin: float, active_within: float) -> list[str]:
+        """Users active in the last `active_within` seconds whose access token expires within `margin` seconds"""
+
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) # google-auth keeps expiry as naive UTC
+        cutoff = time.monotonic() - active_within
+        with self._lock:
+            return [
+                user for user, creds in self._creds.items()
+                if creds.refresh_token and creds.expiry and self._used.get(user, 0.0) >= cutoff
+                and (creds.expiry - now).total_seconds() < margin
+            ]
+
+class Clients(NamedTuple):
+    """A user's Calendar client and event store"""
+    user: str
+    service: GoogleCalendarService
+    store: EventStore
+
+class ServicePool:
+    """One authorized Calendar client and event store per user, the least recently used evicted (with their credentials,
+    see `CredentialStore.forget`) past `max_clients`
+
+    Each client keeps its HTTP connection open between calls, and its store keeps the user's calendar synced. A
+    background thread, started on first use, refreshes the access tokens of users active in the last `active_within`
+    seconds `refresh_margin` seconds before they expire, so requests don't wait on a token refresh."""
+
+    def __init__(self, credentials: CredentialStore, max_clients: int = 256, refresh_margin: float = REFRESH_MARGIN,
+                 refresh_interval: float = 30.0, refresh_workers: int = 8, active_within: float = 86400.0, api_endpoint: str = None,
+                 snapshot_dir: str = "event_stores"):
+        self.credentials = credentials
+        self.max_clients = max_clients
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval # None turns the background refresh off, leaving it to each request
+        self.refresh_workers = refresh_workers
+        self.active_within = active_within
+        self.api_endpoint = api_endpoint # Overrides the Calendar API base URL, e.g. for a local fake server
+        self.snapshot_dir = snapshot_dir # Event store snapshots of users other than the default, None to keep every store in memory only
+        self.stats = Counter() # Clients created and evicted, tokens refreshed ahead of expiry and refreshes that failed
+        self._clients: OrderedDict[str, Clients] = OrderedDict() # Least recently used first
+        self._lock = threading.Lock()
+        self._refresher: threading.Thread = None
+        self._stopped = threading.Event()
+
+    def get(self, config: dict = None) -> Clients:
+        """The Calendar client and event store for the user a run acts for"""
+
+        user = self.credentials.user(config)
+        with self._lock:
+            if self._refresher is None and self.refresh_interval is not None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+                self._refresher.start()
+            clients = self._clients.get(user)
+            if clients is not None:
+                self._clients.move_to_end(user)
+        creds = self.credentials.get(user) # Marks the user active, for the refresher; loaded outside the pool's lock
+        if clients is not None:
+            return clients
+
+        service = GoogleCalendarService(creds=creds, api_endpoint=self.api_endpoint, token_path=None)
+        store = EventStore(service, snapshot_path=self.snapshot_path(user))
+        with self._lock:
+            clients = self._clients.get(user)
+            if clients is not None: # Built by another request meanwhile
+                self._clients.move_to_end(user)
+                return clients
+            clients = self._clients[user] = Clients(user, service, store)
+            self.stats["created"] += 1
+            evicted = []
+            while len(self._clients) > self.max_clients:
+                evicted.append(self._clients.popitem(last=False)[0])
+                self.stats["evicted"] += 1
+        for user in evicted: # Their credentials too, so neither grows with every user ever seen
+            self.credentials.forget(user)
+        return clients
+
+    async def aget(self, config: dict = None) -> Clients:
+        """`get` for the event loop: the user is resolved, their credentials loaded and their Calendar service built
+        (which can each read files, refresh the token or run the login flow) in a worker thread, unless already done"""
+
+        user = self.credentials.cached_user(config)
+        with self._lock:
+            clients = self._clients.get(user) if user else None
+            ready = clients is not None and clients.service._service is not None
+            if ready:
+                self._clients.move_to_end(user)
+        if ready:
+            self.credentials.get(user) # Already loaded, this only marks the user active
+            return clients
+        return await asyncio.to_thread(self.built, config)
+
+    def built(self, config: dict = None) -> Clients:
+        """`get`, with the Calendar service authenticated and built"""
+
+        clients = self.get(config)
+        clients.service.service
+        return clients
+
+    def snapshot_path(self, user: str) -> str | None:
+        if not self.snapshot_dir:
+            return None
+        if user == DEFAULT_USER:
+            return "event_store.json" # Where the single-user store has always kept it
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        return os.path.join(self.snapshot_dir, quote(user, safe="@.-_") + ".json")
+
+    def refresh_due(self) -> int:
+        """Refreshes the tokens about to expire, a few at a time, returns how many were refreshed"""
+
+        due = self.credentials.due(self.refresh_margin, self.active_within)
+        if not due:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.refresh_workers, thread_name_prefix="token-refresh") as executor:
+            refreshed = sum(executor.map(self.refresh, due))
+        return refreshed
+
+    def refresh(self, user: str) -> bool:
+        """Refreshes a user's access token, returns whether it succeeded"""
+
+        from google.auth.transport.requests import Request
+
+        try:
+            self.credentials.get(user, active=False).refresh(Request(token_session()))
+            self.credentials.save(user)
+        except Exception as error:
+            with self._lock:
+                self.stats["refresh failed"] += 1
+            print(f"Token refresh failed for {user}: {error}")
+            return False
+        with self._lock:
+            self.stats["refreshed"] += 1
+        return True
+
+    def stop(self):
+        """Stops the background refresh"""
+        self._stopped.set()
+        if self._refresher is not None:
+            self._refresher.join()
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            self.refresh_due()
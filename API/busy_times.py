@@ -0,0 +1,315 @@
+import datetime
+from collections import defaultdict
+from functools import partial
+
+import numpy as np
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+RRULE_DAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+DAY = 86400
+EPOCH = datetime.date(1970, 1, 1)
+
+def build_report(events: list[dict], timezone: datetime.tzinfo, now: datetime.datetime = None, days: int = 10,
+                 max_lines: int = 50, max_label: int = 60, max_labels: int = 3) -> str:
+    """Renders events as the Contextualizer's "Busy Times" report, without an LLM call
+
+    Overlapping timed events are merged into one busy block, one-off events that repeat on the same weekdays at the
+    same time (e.g. expanded instances) are folded into an "every Tue/Thu" line, and recurring series are described
+    from their RRULE. Times are in `timezone`. The report is capped at `max_lines` busy times, with a closing line
+    saying how many were left out, each block at `max_labels` event titles and each title at `max_label` characters."""
+
+    now = (now or datetime.datetime.now(timezone)).astimezone(timezone)
+    window_start, window_end = now.timestamp(), (now + datetime.timedelta(days=days)).timestamp()
+
+    starts, ends, label_ids, labels, all_day, series = [], [], [], {}, [], []
+    for event in events:
+        if not isinstance(event, dict) or event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+            continue # Free time isn't busy time
+        start = event.get("start", {})
+        if event.get("recurrence"):
+            series.append(event)
+        elif "dateTime" in start:
+            starts.append(_timestamp(start["dateTime"]))
+            ends.append(_timestamp(event["end"]["dateTime"]))
+            label_ids.append(labels.setdefault(event.get("summary") or "Busy", len(labels)))
+        elif "date" in start:
+            all_day.append((datetime.date.fromisoformat(start["date"]), _end_date(event), event.get("summary") or "Busy"))
+    all_day = [day for day in all_day if day[1] > now.date() and day[0] < (now + datetime.timedelta(days=days)).date()]
+
+    labels = [_label(label, max_label) for label in labels] # Dicts keep insertion order, so index = label ID
+    lines = [] # (sort key, function rendering the line); only lines that make the cut get rendered
+    starts, ends, label_ids = np.array(starts), np.array(ends), np.array(label_ids, dtype=np.int64)
+    within = (ends > window_start) & (starts < window_end)
+    if within.any():
+        timed = Timed(starts[within], ends[within], label_ids[within], timezone)
+        folded, patterns = timed.fold_patterns(labels)
+        lines += patterns
+        lines += timed.merge(~folded, labels, max_labels)
+    lines += _all_day_lines(all_day, max_label)
+    lines += [line for event in series if (line := _series_line(event, timezone, window_start, window_end, max_label))]
+    lines.sort(key=lambda line: line[0])
+
+    header = f"Busy Times, next {days} days ({timezone} timezone):\n\n"
+    if not lines:
+        return header + "* No busy times"
+    body = [render() for _, render in lines[:max_lines]]
+    if len(lines) > max_lines:
+        body.append(f"* ...and {len(lines) - max_lines} more busy times, through {_date(lines[-1][0], timezone)}")
+    return header + "\n".join(body)
+
+# Timed events
+
+class Timed:
+    """Timed events as arrays of epoch seconds, with their local (wall clock) equivalents in the report's timezone"""
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, label_ids: np.ndarray, timezone):
+        self.starts, self.ends, self.label_ids, self.timezone = starts, np.maximum(ends, starts), label_ids, timezone
+        self.local_starts, self.local_ends = _local(self.starts, timezone), _local(self.ends, timezone)
+
+    def merge(self, mask: np.ndarray, labels: list[str], max_labels: int) -> list[tuple]:
+        """Merges overlapping events (those selected by `mask`) into busy blocks, returns their report lines"""
+
+        selected = np.flatnonzero(mask)
+        if not len(selected):
+            return []
+        order = selected[np.lexsort((self.ends[selected], self.starts[selected]))]
+        starts, ends = self.starts[order], self.ends[order]
+
+        # A block starts wherever an event begins after everything before it has ended
+        reach = np.maximum.accumulate(ends)
+        local_reach = np.maximum.accumulate(self.local_ends[order])
+        first = np.empty(len(starts), dtype=bool)
+        first[0] = True
+        first[1:] = starts[1:] >= reach[:-1]
+        block_starts = np.flatnonzero(first)
+        block_ends = np.append(block_starts[1:], len(starts))
+
+        return [
+            (start, partial(self._block_line, local_start, local_end, order[lo:hi], labels, max_labels))
+            for start, local_start, local_end, lo, hi in zip(
+                starts[block_starts].tolist(), self.local_starts[order][block_starts].tolist(), local_reach[block_ends - 1].tolist(),
+                block_starts.tolist(), block_ends.tolist()
+            )
+        ]
+
+    def _block_line(self, local_start: float, local_end: float, members: np.ndarray, labels: list[str], max_labels: int) -> str:
+        names = list(dict.fromkeys(labels[i] for i in self.label_ids[members].tolist())) # Unique, in start order
+        more = f"; +{len(names) - max_labels} more" if len(names) > max_labels else ""
+        return f"* **{_span(local_start, local_end)}** ({'; '.join(names[:max_labels])}{more})"
+
+    def fold_patterns(self, labels: list[str]) -> tuple[np.ndarray, list[tuple]]:
+        """Folds events with the same title and local times on every occurrence of some weekdays into one line
+
+        Returns (mask of folded events, pattern lines). Only complete patterns are folded: every matching weekday
+        between the first and last occurrence must have the event, and at least one weekday must repeat."""
+
+        folded = np.zeros(len(self.starts), dtype=bool)
+        day = (self.local_starts // DAY).astype(np.int64)
+        same_day = np.flatnonzero(day == (self.local_ends - 1) // DAY)
+        if len(same_day) < 3:
+            return folded, []
+
+        # Group by (title, local start time, local end time), ordered by day within each group
+        start_time, end_time = self.local_starts[same_day] - day[same_day] * DAY, self.local_ends[same_day] - day[same_day] * DAY
+        order = np.lexsort((day[same_day], end_time, start_time, self.label_ids[same_day]))
+        keys = np.stack((self.label_ids[same_day], start_time, end_time), axis=1)[order]
+        bounds = np.concatenate(([0], np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1, [len(keys)]))
+        candidates = np.flatnonzero(np.diff(bounds) >= 3)
+
+        lines = []
+        for group in candidates.tolist():
+            members = same_day[order[bounds[group]:bounds[group + 1]]]
+            days = np.unique(day[members])
+            weekdays = np.unique((days + 3) % 7) # The epoch was a Thursday
+            if len(days) < 3 or len(days) <= len(weekdays):
+                continue
+            expected = np.arange(days[0], days[-1] + 1)
+            if not np.array_equal(days, expected[np.isin((expected + 3) % 7, weekdays)]):
+                continue
+
+            folded[members] = True
+            first = int(members[0])
+            lines.append((float(self.starts[first]), partial(
+                self._pattern_line, first, weekdays.tolist(), int(days[0]), int(days[-1]), labels[self.label_ids[first]]
+            )))
+        return folded, lines
+
+    def _pattern_line(self, first: int, weekdays: list[int], first_day: int, last_day: int, label: str) -> str:
+        start = datetime.datetime.fromtimestamp(float(self.starts[first]), self.timezone)
+        end = datetime.datetime.fromtimestamp(float(self.ends[first]), self.timezone)
+        first_date, last_date = EPOCH + datetime.timedelta(days=first_day), EPOCH + datetime.timedelta(days=last_day)
+        return f"* **{_clock(start)}-{_clock(end)}, {_weekdays(weekdays)}, {first_date} to {last_date}** ({label})"
+
+def _local(timestamps: np.ndarray, timezone) -> np.ndarray:
+    """Epoch seconds shifted by the timezone's UTC offset at each instant, so whole days line up with local midnights"""
+
+    # Within a few weeks the offset changes at most once, so an unchanged offset between the ends means it is constant
+    low, high = float(timestamps.min()), float(timestamps.max())
+    offset = lambda timestamp: datetime.datetime.fromtimestamp(timestamp, timezone).utcoffset().total_seconds()
+    if high - low < 28 * DAY and offset(low) == offset(high):
+        return timestamps + offset(low)
+
+    # Otherwise offsets are looked up once per distinct hour, since they only change on the hour
+    hours, inverse = np.unique(timestamps // 3600, return_inverse=True)
+    offsets = np.array([offset(hour * 3600) for hour in hours.tolist()])
+    return timestamps + offsets[inverse]
+
+# All-day events
+
+def _all_day_lines(all_day: list[tuple], max_label: int) -> list[tuple]:
+    """One line per all-day event, with back-to-back days of the same title joined into one range"""
+
+    lines = []
+    by_label = defaultdict(list)
+    for start, end, label in all_day:
+        by_label[label].append((start, end))
+
+    for label, spans in by_label.items():
+        spans.sort()
+        merged = [list(spans[0])]
+        for start, end in spans[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        for start, end in merged:
+            last = end - datetime.timedelta(days=1) # All-day end dates are exclusive
+            when = f"all day, {start}" if last <= start else f"all day, {start} to {last}"
+            key = datetime.datetime.combine(start, datetime.time()).timestamp()
+            lines.append((key, partial(str, f"* **{when}** ({_label(label, max_label)})")))
+    return lines
+
+# Recurring series
+
+def _series_line(event: dict, timezone, window_start: float, window_end: float, max_label: int) -> tuple | None:
+    """Describes a recurring series from its RRULE, or None if it has ended before the window"""
+
+    rule = next((line[6:] for line in event["recurrence"] if line.startswith("RRULE:")), None)
+    if rule is None:
+        return None
+    parts = dict(part.split("=", 1) for part in rule.split(";") if "=" in part)
+
+    all_day = "date" in event.get("start", {})
+    if all_day:
+        start = datetime.datetime.combine(datetime.date.fromisoformat(event["start"]["date"]), datetime.time(), timezone)
+        end = None
+    else:
+        start = datetime.datetime.fromtimestamp(_timestamp(event["start"]["dateTime"]), timezone)
+        end = datetime.datetime.fromtimestamp(_timestamp(event["end"]["dateTime"]), timezone)
+
+    until = _rrule_until(parts.get("UNTIL"), timezone)
+    if until is not None and until.timestamp() < window_start:
+        return None
+    if start.timestamp() >= window_end:
+        return None
+
+    interval = int(parts.get("INTERVAL", 1))
+    frequency = parts.get("FREQ", "")
+    if frequency == "DAILY":
+        pattern = "every day" if interval == 1 else f"every {interval} days"
+    elif frequency == "WEEKLY":
+        weekdays = sorted({RRULE_DAYS[day[-2:]] for day in parts["BYDAY"].split(",")}) if "BYDAY" in parts else [start.weekday()]
+        pattern = _weekdays(weekdays) if interval == 1 else f"every {interval} weeks on {'/'.join(WEEKDAYS[d] for d in weekdays)}"
+    elif frequency == "MONTHLY":
+        pattern = "every month" if interval == 1 else f"every {interval} months"
+        pattern += f" ({parts['BYDAY']})" if "BYDAY" in parts else f" on day {start.day}"
+    elif frequency == "YEARLY":
+        pattern = f"every year on {start:%b} {start.day}" if interval == 1 else f"every {interval} years on {start:%b} {start.day}"
+    else:
+        pattern = "recurring"
+
+    when = "all day" if all_day else f"{_clock(start)}-{_clock(end)}"
+    if start.timestamp() > window_start:
+        pattern += f", starting {start.date()}"
+    if until is not None:
+        pattern += f", until {until.date()}"
+    return (max(start.timestamp(), window_start), partial(str, f"* **{when}, {pattern}** ({_label(event.get('summary') or 'Busy', max_label)})"))
+
+def _rrule_until(value: str, timezone) -> datetime.datetime | None:
+    if not value:
+        return None
+    if len(value) == 8: # Date only
+        return datetime.datetime.strptime(value, "%Y%m%d").replace(tzinfo=timezone)
+    return datetime.datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S").replace(tzinfo=datetime.timezone.utc)
+
+# Formatting helpers
+
+def _label(summary: str, max_label: int) -> str:
+    label = " ".join(summary.split())
+    return label if len(label) <= max_label else label[:max_label - 3] + "..."
+
+def _weekdays(weekdays: list[int]) -> str:
+    if len(weekdays) == 7:
+        return "every day"
+    if weekdays == [0, 1, 2, 3, 4]:
+        return "every weekday"
+    return "every " + "/".join(WEEKDAYS[day] for day in weekdays)
+
+def _span(local_start: float, local_end: float) -> str:
+    """Renders a block from local epoch seconds; formatting plain numbers is several times faster than going through datetimes"""
+
+    start_day, start_time = divmod(int(local_start), DAY)
+    end_day, end_time = divmod(int(local_end), DAY)
+    if start_day == end_day or (end_day == start_day + 1 and end_time == 0):
+        return f"{_hhmm(start_time)}-{_hhmm(end_time)}, {EPOCH + datetime.timedelta(days=start_day)}"
+    return f"{_hhmm(start_time)}, {EPOCH + datetime.timedelta(days=start_day)} - {_hhmm(end_time)}, {EPOCH + datetime.timedelta(days=end_day)}"
+
+def _hhmm(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}"
+
+def _clock(moment: datetime.datetime) -> str:
+    return f"{moment.hour:02d}:{moment.minute:02d}"
+
+def _date(timestamp: float, timezone) -> datetime.date:
+    return datetime.datetime.fromtimestamp(timestamp, timezone).date()
+
+def _timestamp(value: str) -> float:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def _end_date(event: dict) -> datetime.date:
+    start = datetime.date.fromisoformat(event["start"]["date"])
+    end = event.get("end", {}).get("date")
+    return datetime.date.fromisoformat(end) if end else start + datetime.timedelta(days=1)
+
+# TESTING
+
+def main():
+    """Times the builder on calendars of 10 to 10,000 events, and prints a sample report"""
+
+    import json
+    import statistics
+    import time
+    import tzlocal
+    from fake_calendar import make_events
+
+    timezone = tzlocal.get_localzone()
+    now = datetime.datetime.now(timezone).replace(minute=0, second=0, microsecond=0)
+
+    # A small calendar with overlaps, weekly instances, an all-day trip and a recurring series
+    monday = now - datetime.timedelta(days=now.weekday())
+    at = lambda day, hour: (monday + datetime.timedelta(days=day)).replace(hour=hour).isoformat()
+    sample = [
+        {"summary": "Standup", "start": {"dateTime": at(d, 9)}, "end": {"dateTime": at(d, 10)}} for d in (0, 2, 7, 9)
+    ] + [
+        {"summary": "Lunch with Sam", "start": {"dateTime": at(1, 12)}, "end": {"dateTime": at(1, 13)}},
+        {"summary": "Design review", "start": {"dateTime": at(1, 12)}, "end": {"dateTime": at(1, 14)}},
+        {"summary": "Conference", "start": {"date": str((monday + datetime.timedelta(days=3)).date())}, "end": {"date": str((monday + datetime.timedelta(days=5)).date())}},
+        {"summary": "Office Hours", "start": {"dateTime": at(1, 14)}, "end": {"dateTime": at(1, 16)}, "recurrence": ["RRULE:FREQ=WEEKLY;BYDAY=TU,TH"]},
+    ]
+    print(build_report(sample, timezone, now=monday), "\n")
+
+    print(f"{'events':>7} {'JSON chars':>11} {'report chars':>13} {'build time':>11}")
+    for n in (10, 100, 1000, 10000):
+        events = make_events(n, days=max(10, n // 10), start=now) # About 10 events a day, filtered to the 10-day window
+        timings = []
+        for _ in range(max(3, 2000 // n)):
+            began = time.perf_counter()
+            report = build_report(events, timezone, now=now)
+            timings.append(time.perf_counter() - began)
+        median = statistics.median(timings)
+        took = f"{median * 1e6:.0f} us" if median < 1e-3 else f"{median * 1e3:.1f} ms"
+        print(f"{n:>7} {len(json.dumps(events, indent=3)):>11} {len(report):>13} {took:>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+import asyncio
+import atexit
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import Any, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.serde.types import TASKS, ChannelProtocol
+
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    checkpoint BLOB NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    value BLOB NOT NULL,
+    task_path TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at);
+"""
+
+COMPRESS_THRESHOLD = 512 # Bytes; smaller payloads aren't worth the zlib header
+
+class SqliteSaver(BaseCheckpointSaver[str]):
+    """Durable LangGraph checkpointer backed by SQLite in WAL mode
+
+    Drop-in replacement for MemorySaver that keeps the server's memory bounded however many threads exist:
+    - Writes are buffered and flushed in one transaction every `batch_size` operations or `flush_interval` seconds.
+      Reads see buffered writes too, merged with what's on disk, so they never force a flush.
+    - Checkpoints are stored as the serializer's msgpack payload, zlib-compressed when large.
+    - Only the newest `keep_last` checkpoints per thread and namespace are kept (2 keeps each checkpoint's parent,
+      whose pending sends LangGraph reads back), along with subgraph checkpoints still newer than their thread's latest.
+    - Threads untouched for `max_age` seconds, or beyond the `max_threads` most recently updated, are deleted."""
+
+    def __init__(
+        self,
+        path: str = "checkpoints.db",
+        *,
+        batch_size: int = 64,
+        flush_interval: float = 0.5,
+        keep_last: int = 2,
+        max_age: Optional[float] = None,
+        max_threads: Optional[int] = None,
+        retention_interval: float = 60.0,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_last = max(keep_last, 1)
+        self.max_age = max_age
+        self.max_threads = max_threads
+        self.retention_interval = retention_interval
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+        # Buffered rows, keyed like their primary keys, and the batch being flushed, still read from until it's committed
+        self._checkpoints: dict[tuple, tuple] = {}
+        self._writes: dict[tuple, tuple] = {}
+        self._flushing: tuple[dict, dict] = ({}, {})
+        self._lock = threading.Lock() # Held only to change or copy the buffers, so the event loop never waits on SQLite
+        self._db_lock = threading.RLock() # Held for each use of the connection, transactions included
+        self._last_retention = 0.0
+
+        # Flush in the background too, so buffered writes are durable within `flush_interval` even when idle
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self) -> "SqliteSaver":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self):
+        """Flushes any buffered writes and closes the database"""
+
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join()
+        with self._db_lock:
+            self.flush()
+            self.conn.close()
+
+    # Serialization
+
+    def _dumps(self, obj: Any) -> bytes:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) > COMPRESS_THRESHOLD:
+            return type_.encode() + b"+z\0" + zlib.compress(data, 1)
+        return type_.encode() + b"\0" + data
+
+    def _loads(self, blob: bytes) -> Any:
+        type_, _, data = blob.partition(b"\0")
+        if type_.endswith(b"+z"):
+            return self.serde.loads_typed((type_[:-2].decode(), zlib.decompress(data)))
+        return self.serde.loads_typed((type_.decode(), data))
+
+    # Writes
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Buffers a checkpoint, returns the config pointing at it"""
+
+        config = self._buffer(config, checkpoint, metadata)
+        self._maybe_flush()
+        return config
+
+    def _buffer(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> RunnableConfig:
+        c = checkpoint.copy()
+        c.pop("pending_sends", None)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        with self._lock:
+            self._checkpoints[(thread_id, checkpoint_ns, checkpoint["id"])] = (
+                config["configurable"].get("checkpoint_id"), # parent
+                self._dumps(c),
+                self._dumps(metadata),
+            )
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Buffers a task's pending writes against a checkpoint"""
+
+        self._buffer_writes(config, writes, task_id, task_path)
+        self._maybe_flush()
+
+    def _buffer_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        with self._lock:
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                key = (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+                if idx >= 0 and key in self._writes: # Regular writes are written once, special ones (errors, interrupts) replace
+                    continue
+                self._writes[key] = (channel, self._dumps(value), task_path)
+
+    def _maybe_flush(self):
+        if self._full():
+            self.flush()
+
+    def _full(self) -> bool:
+        return len(self._checkpoints) + len(self._writes) >= self.batch_size
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered checkpoints and writes in one transaction, pruning what they supersede"""
+
+        with self._db_lock:
+            with self._lock:
+                if not self._checkpoints and not self._writes:
+                    return
+                checkpoints, self._checkpoints = self._checkpoints, {}
+                writes, self._writes = self._writes, {}
+
+                # Checkpoints superseded within the batch never need to reach disk
+                by_namespace = defaultdict(list)
+                for thread_id, checkpoint_ns, checkpoint_id in checkpoints:
+                    by_namespace[(thread_id, checkpoint_ns)].append(checkpoint_id)
+                superseded = set()
+                for (thread_id, checkpoint_ns), ids in by_namespace.items():
+                    for checkpoint_id in sorted(ids)[:-self.keep_last]:
+                        superseded.add((thread_id, checkpoint_ns, checkpoint_id))
+                        del checkpoints[(thread_id, checkpoint_ns, checkpoint_id)]
+                writes = {k: v for k, v in writes.items() if k[:3] not in superseded}
+                self._flushing = (checkpoints, writes)
+
+            touched = {key[0] for key in checkpoints} | {key[0] for key in writes}
+            now = time.time()
+
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                    [(*key, *row) for key, row in checkpoints.items()],
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(*key, *row) for key, row in writes.items() if key[4] >= 0],
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(*key, *row) for key, row in writes.items() if key[4] < 0],
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO threads VALUES (?, ?)", [(thread_id, now) for thread_id in touched]
+                )
+                for thread_id, checkpoint_ns in by_namespace:
+                    self._prune(thread_id, checkpoint_ns)
+            with self._lock:
+                self._flushing = ({}, {})
+
+            if self.max_age is not None or self.max_threads is not None:
+                if now - self._last_retention >= self.retention_interval:
+                    self._last_retention = now
+                    self.apply_retention()
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        """Deletes superseded checkpoints in one namespace of a thread, finished subgraphs, and their writes"""
+
+        self.conn.execute(
+            """DELETE FROM checkpoints WHERE thread_id = ?1 AND checkpoint_ns = ?2 AND checkpoint_id < (
+                SELECT checkpoint_id FROM checkpoints WHERE thread_id = ?1 AND checkpoint_ns = ?2
+                ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?3
+            )""",
+            (thread_id, checkpoint_ns, self.keep_last - 1),
+        )
+        if checkpoint_ns == "":
+            # Subgraph checkpoints older than the parent's latest belong to subgraph runs that have completed
+            self.conn.execute(
+                """DELETE FROM checkpoints WHERE thread_id = ?1 AND checkpoint_ns != '' AND checkpoint_id < (
+                    SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?1 AND checkpoint_ns = ''
+                )""",
+                (thread_id,),
+            )
+        self.conn.execute(
+            """DELETE FROM writes WHERE thread_id = ? AND NOT EXISTS (
+                SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id
+                AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id
+            )""",
+            (thread_id,),
+        )
+
+    def apply_retention(self):
+        """Deletes threads past the retention policy's `max_age` or `max_threads`"""
+
+        expired = set()
+        with self._db_lock:
+            if self.max_age is not None:
+                expired.update(row[0] for row in self.conn.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.max_age,)
+                ))
+            if self.max_threads is not None:
+                expired.update(row[0] for row in self.conn.execute(
+                    "SELECT thread_id FROM threads ORDER BY updated_at DESC LIMIT -1 OFFSET ?", (self.max_threads,)
+                ))
+            self.delete_threads(expired)
+
+    def delete_threads(self, thread_ids):
+        """Deletes every checkpoint and write for the given threads"""
+
+        rows = [(thread_id,) for thread_id in thread_ids]
+        if not rows:
+            return
+        with self._lock:
+            deleted = {thread_id for (thread_id,) in rows}
+            self._checkpoints = {k: v for k, v in self._checkpoints.items() if k[0] not in deleted}
+            self._writes = {k: v for k, v in self._writes.items() if k[0] not in deleted}
+        with self._db_lock, self.conn:
+            self.conn.execute("BEGIN")
+            for table in ("checkpoints", "writes", "threads"):
+                self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", rows)
+
+    # Reads
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Gets the checkpoint named by the config's `checkpoint_id`, or the thread's latest if there isn't one"""
+
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+
+        checkpoints, writes = self._buffered(thread_id, checkpoint_ns) # Before reading the database, so no write is missed
+        with self._db_lock:
+            if checkpoint_id:
+                buffered = checkpoints.get((thread_id, checkpoint_ns, checkpoint_id))
+                row = (checkpoint_id, *buffered) if buffered else self.conn.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, checkpoint, metadata FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, checkpoint, metadata FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+                if checkpoints and (latest := max(checkpoints)) and (row is None or latest[2] > row[0]):
+                    row = (latest[2], *checkpoints[latest])
+            return self._tuple(thread_id, checkpoint_ns, row, writes) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """Lists checkpoints newest first, optionally narrowed by thread, namespace, metadata and `before`"""
+
+        clauses, params, wanted = [], [], {}
+        if config is not None:
+            clauses.append("thread_id = ?")
+            params.append(wanted.setdefault("thread_id", config["configurable"]["thread_id"]))
+            if "checkpoint_ns" in config["configurable"]:
+                clauses.append("checkpoint_ns = ?")
+                params.append(wanted.setdefault("checkpoint_ns", config["configurable"]["checkpoint_ns"]))
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        else:
+            checkpoint_id = None
+        before_id = get_checkpoint_id(before) if before is not None else None
+        if before_id:
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+
+        # Tuples are read under the lock and yielded after it's released, so a caller that stops early holds up no one
+        checkpoints, writes = self._buffered(**wanted)
+        tuples = []
+        with self._db_lock:
+            rows = {
+                tuple(row[:3]): row[3:] for row in self.conn.execute(
+                    "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint, metadata FROM checkpoints"
+                    + (" WHERE " + " AND ".join(clauses) if clauses else ""),
+                    params,
+                )
+            }
+            rows.update(
+                (key, row) for key, row in checkpoints.items()
+                if (not checkpoint_id or key[2] == checkpoint_id) and (not before_id or key[2] < before_id)
+            )
+
+            for (thread_id, checkpoint_ns, checkpoint_id), row in sorted(rows.items(), key=lambda item: item[0][2], reverse=True):
+                if limit is not None and len(tuples) >= limit:
+                    break
+                if filter and not all(self._loads(row[2]).get(k) == v for k, v in filter.items()):
+                    continue
+                tuples.append(self._tuple(thread_id, checkpoint_ns, (checkpoint_id, *row), writes))
+
+        yield from tuples
+
+    def _buffered(self, thread_id: str = None, checkpoint_ns: str = None) -> tuple[dict, dict]:
+        """Copies of the buffered checkpoints and writes, those being flushed included, of one thread and namespace if given"""
+
+        matches = lambda key: (thread_id is None or key[0] == thread_id) and (checkpoint_ns is None or key[1] == checkpoint_ns)
+        checkpoints, writes = {}, {}
+        with self._lock:
+            for batch_checkpoints, batch_writes in (self._flushing, (self._checkpoints, self._writes)):
+                checkpoints.update((key, row) for key, row in batch_checkpoints.items() if matches(key))
+                for key, row in batch_writes.items():
+                    if matches(key) and (key[4] < 0 or key not in writes): # As `flush` writes them
+                        writes[key] = row
+        return checkpoints, writes
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: tuple, buffered_writes: dict) -> CheckpointTuple:
+        """A checkpoint's tuple, with its pending writes and sends from the database and `buffered_writes`. Call holding `_db_lock`"""
+
+        checkpoint_id, parent_checkpoint_id, checkpoint, metadata = row
+
+        writes = {
+            (task_id, idx): (channel, value) for task_id, idx, channel, value in self.conn.execute(
+                "SELECT task_id, idx, channel, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            )
+        }
+        sends = {
+            (task_id, idx): (task_path, value) for task_id, idx, task_path, value in self.conn.execute(
+                "SELECT task_id, idx, task_path, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? AND channel = ?",
+                (thread_id, checkpoint_ns, parent_checkpoint_id, TASKS),
+            )
+        } if parent_checkpoint_id else {}
+        for (*key, task_id, idx), (channel, value, task_path) in buffered_writes.items():
+            if key == [thread_id, checkpoint_ns, checkpoint_id] and (idx < 0 or (task_id, idx) not in writes):
+                writes[(task_id, idx)] = (channel, value)
+            elif parent_checkpoint_id and key == [thread_id, checkpoint_ns, parent_checkpoint_id] and channel == TASKS \
+                    and (idx < 0 or (task_id, idx) not in sends):
+                sends[(task_id, idx)] = (task_path, value)
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **self._loads(checkpoint),
+                "pending_sends": [self._loads(value) for *_, value in sorted((task_path, *key, value) for key, (task_path, value) in sends.items())],
+            },
+            metadata=self._loads(metadata),
+            pending_writes=[(task_id, channel, self._loads(value)) for (task_id, _), (channel, value) in sorted(writes.items())],
+            parent_config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_checkpoint_id,
+                }
+            }
+            if parent_checkpoint_id
+            else None,
+        )
+
+    # Async interface. Reads query SQLite, so they run on a worker thread; writes are buffered on the event loop (which
+    # only ever takes the buffers' short lock), and a full batch is flushed on a worker thread
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        config = self._buffer(config, checkpoint, metadata)
+        if self._full():
+            await asyncio.to_thread(self.flush)
+        return config
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self._buffer_writes(config, writes, task_id, task_path)
+        if self._full():
+            await asyncio.to_thread(self.flush)
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+# TESTING
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * 4096 / 2**20
+
+def _bench_saver(kind: str, threads: int, results):
+    """Writes a few turns' worth of checkpoints to `threads` threads, then reads each back"""
+
+    import os
+    import statistics
+    import tempfile
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langgraph.checkpoint.base import empty_checkpoint
+    from langgraph.checkpoint.base.id import uuid6
+    from langgraph.checkpoint.memory import MemorySaver
+
+    directory = tempfile.mkdtemp()
+    baseline = _rss_mb()
+    saver = MemorySaver() if kind == "MemorySaver" else SqliteSaver(os.path.join(directory, "checkpoints.db"))
+
+    messages = []
+    for i in range(3):
+        messages += [HumanMessage(content="Move my meeting with John to 3pm " * 4), AIMessage(content="Busy Times: lunch 12:00-13:00 " * 8)]
+
+    puts, gets = [], []
+    for t in range(threads):
+        config = {"configurable": {"thread_id": str(t), "checkpoint_ns": ""}}
+        for step in range(4): # One turn is several graph steps
+            checkpoint = empty_checkpoint()
+            checkpoint["id"] = str(uuid6())
+            checkpoint["channel_values"] = {"messages": messages, "context": "Busy Times " * 40, "helper_agent": "none"}
+            began = time.perf_counter()
+            config = saver.put(config, checkpoint, {"source": "loop", "step": step, "writes": None, "parents": {}}, {})
+            saver.put_writes(config, [("messages", messages[-1])], "task")
+            puts.append(time.perf_counter() - began)
+
+    for t in range(threads):
+        began = time.perf_counter()
+        saver.get_tuple({"configurable": {"thread_id": str(t), "checkpoint_ns": ""}})
+        gets.append(time.perf_counter() - began)
+
+    results.put((kind, statistics.median(puts) * 1e6, statistics.median(gets) * 1e6, _rss_mb() - baseline))
+
+def _check_loop_stall():
+    """Writes from the event loop while a flush holds the database for 0.5 s: they're buffered without waiting for it, and
+    reads see them without flushing"""
+
+    import os
+    import tempfile
+    from langgraph.checkpoint.base import empty_checkpoint
+    from langgraph.checkpoint.base.id import uuid6
+
+    saver = SqliteSaver(os.path.join(tempfile.mkdtemp(), "checkpoints.db"), flush_interval=3600)
+    config = {"configurable": {"thread_id": "t", "checkpoint_ns": ""}}
+    checkpoint = {**empty_checkpoint(), "id": str(uuid6())}
+
+    async def put() -> tuple[float, RunnableConfig]:
+        began = time.perf_counter()
+        written = await saver.aput(config, checkpoint, {"source": "loop", "step": 0, "writes": None, "parents": {}}, {})
+        await saver.aput_writes(written, [("messages", "hi")], "task")
+        return time.perf_counter() - began, written
+
+    def flushing():
+        with saver._db_lock:
+            time.sleep(0.5)
+
+    holder = threading.Thread(target=flushing)
+    holder.start()
+    time.sleep(0.05)
+    took, written = asyncio.run(put())
+    holder.join()
+    assert took < 0.05, took
+    read = saver.get_tuple(written)
+    assert read.checkpoint["id"] == checkpoint["id"] and read.pending_writes == [("task", "messages", "hi")], read
+    assert saver._checkpoints, "The read flushed the buffer"
+    saver.close()
+    print(f"Writes from the event loop during a 0.5 s flush: {took * 1000:.1f} ms; reads see them unflushed")
+
+def main():
+    """Compares checkpoint write/read latency and RSS growth of SqliteSaver against MemorySaver at 10k threads"""
+
+    _check_loop_stall()
+
+    import multiprocessing
+
+    results = multiprocessing.Queue()
+    print(f"{'saver':>12} {'p50 put+writes us':>18} {'p50 get us':>11} {'RSS growth MB':>14}")
+    for kind in ("MemorySaver", "SqliteSaver"):
+        process = multiprocessing.Process(target=_bench_saver, args=(kind, 10_000, results)) # Fresh process for a clean RSS reading
+        process.start()
+        kind, put, get, rss = results.get()
+        process.join()
+        print(f"{kind:>12} {put:>18.1f} {get:>11.1f} {rss:>14.1f}")
+
+if __name__ == "__main__":
+    main()
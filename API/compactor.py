@@ -0,0 +1,152 @@
+from datatypes import State, SUMMARY_ID, add, node
+from prompts import PromptedModel
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage, RemoveMessage
+
+class Compactor:
+   """Compactor; Folds older turns of the conversation into a rolling summary so every agent's prompt stays bounded
+
+   Runs at the end of each turn but only compacts once the verbatim history grows past `max_turns` turns or `max_tokens`
+   tokens. It then keeps at most the last `keep_turns` turns, and no more than half of `max_tokens`, as they are, and folds
+   everything older (including bulky tool results) into a summary of at most `summary_tokens` tokens. Compacting well
+   below the trigger means it happens once every few turns, not on every call. The summary is kept as the first message in state.
+
+   Unlike the agents, this is added to the main graph as a plain node (see `node`) rather than as a subgraph, because
+   message removals made inside a subgraph don't carry over into the parent graph's state."""
+
+   def __init__(self, llm, keep_turns: int = 4, max_turns: int = 8, max_tokens: int = 8000, summary_tokens: int = 400):
+      # Set attributes
+      self.node = node(self.compact)
+      self.llm = llm
+      self.keep_turns = keep_turns
+      self.max_turns = max_turns
+      self.max_tokens = max_tokens
+      self.summary_tokens = summary_tokens
+      self.summary_model = PromptedModel(llm, self.instructions, self.get_budget)
+
+   def compact(self, state: State):
+      """Main node for compactor; Summarizes older turns if the history has outgrown its budget"""
+
+      fold = self.get_fold(state["messages"])
+      if fold is None:
+         return {} # Nothing to do until the history grows past the threshold
+
+      summary, folded = fold
+      message = yield self.summary_model.call(self.get_summary_prompt(summary, folded))
+      return self.get_update(folded, message.content)
+
+   def get_fold(self, messages: list):
+      """Splits the history into (previous summary, messages to fold), or None if it is still within budget"""
+
+      summary = messages[0].content if messages and messages[0].id == SUMMARY_ID else ""
+      history = messages[1:] if summary else messages
+
+      # Turns start at each user message; cutting there keeps tool calls together with their results
+      turns = [i for i, message in enumerate(history) if isinstance(message, HumanMessage)]
+      if len(turns) <= self.max_turns and approximate_tokens(history) <= self.max_tokens:
+         return None
+
+      if not turns:
+         return None
+
+      # Keep as many recent turns as fit under the low-water mark, but always the latest one
+      cut = turns[-1]
+      for start in reversed(turns[-self.keep_turns:-1]):
+         if approximate_tokens(history[start:]) > self.max_tokens // 2:
+            break
+         cut = start
+      return (summary, history[:cut]) if cut > 0 else None
+
+   def get_update(self, folded: list, summary: str):
+      """State update that removes the folded messages and puts the new summary first"""
+
+      summary = summary[:self.summary_tokens * CHARS_PER_TOKEN] # Hard cap, in case the model overshoots its budget
+      return {"messages": [RemoveMessage(id=message.id) for message in folded] + [
+         HumanMessage(id=SUMMARY_ID, content=f"Summary of the earlier conversation:\n{summary}")
+      ]}
+
+   def get_summary_prompt(self, summary: str, folded: list) -> list:
+      """Messages to fold into the running summary, with tool output trimmed so the call itself stays cheap"""
+
+      lines = []
+      for message in folded:
+         if isinstance(message, ToolMessage):
+            lines.append(f"Tool result ({message.name}): {str(message.content)[:TOOL_RESULT_CHARS]}")
+         elif isinstance(message, AIMessage) and message.tool_calls:
+            lines.append("Agent called " + ", ".join(f"{call['name']}({str(call['args'])[:TOOL_RESULT_CHARS]})" for call in message.tool_calls))
+         elif isinstance(message, AIMessage):
+            lines.append(f"Indigo: {message.content}")
+         else:
+            lines.append(f"User: {message.content}")
+
+      return [
+         HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n" + "\n".join(lines))
+      ]
+
+   # Instructions for the compact node, followed on each call by the summary's length budget (see `PromptedModel`)
+   get_budget = lambda self: f"         Keep the summary under {self.summary_tokens * CHARS_PER_TOKEN} characters.\n"
+
+   instructions = """
+         You are the Compactor agent for a time management AI figure called Indigo.
+         You maintain a running summary of a conversation between the user and Indigo, so that older messages can be dropped. You will be given the current summary and the messages that are being dropped, and you will output the updated summary.
+
+         Keep what later turns may refer back to: the user's goals and preferences, decisions made, questions still open, and events that were created, edited or deleted (with their titles, times and IDs). Leave out pleasantries and raw event listings.
+"""
+
+CHARS_PER_TOKEN = 4 # Rough average for English text
+TOOL_RESULT_CHARS = 200
+
+def approximate_tokens(messages: list) -> int:
+   """Approximate token count of a list of messages, including tool call arguments"""
+
+   chars = 0
+   for message in messages:
+      chars += len(str(message.content))
+      chars += sum(len(str(call["args"])) for call in getattr(message, "tool_calls", None) or [])
+   return chars // CHARS_PER_TOKEN
+
+# TESTING
+
+def main():
+   """Reports per-call prompt token counts on a synthetic 100-turn conversation, with and without compaction"""
+
+   import json
+   from fake_llm import FakeChatModel
+   from fake_calendar import make_events
+
+   llm = FakeChatModel()
+   compactor = Compactor(llm)
+   instructions = SystemMessage(content="x" * 4000) # Stand-in for a node's ~1k token system prompt
+   listing = json.dumps(make_events(20, days=1), indent=3) # A typical `list_events` result
+
+   def turn(i):
+      return [
+         HumanMessage(content=f"Move my meeting number {i} to the afternoon, and tell me what else I have that day"),
+         AIMessage(content="", tool_calls=[{"name": "list_events", "args": {"timeMin": "2025-02-09T00:00:00Z"}, "id": f"call{i}"}]),
+         ToolMessage(content=listing, name="list_events", tool_call_id=f"call{i}"),
+         AIMessage(content=f"Moved meeting {i} to 3pm. You also have lunch at noon and the gym at 6pm."),
+      ]
+
+   # Without compaction, each call sends the whole history
+   before, after, summary_calls, summary_tokens = [], [], 0, 0
+   full, compacted = [], []
+   for i in range(100):
+      full += turn(i)
+      before.append(approximate_tokens([instructions] + full))
+
+      compacted = add(compacted, turn(i))
+      fold = compactor.get_fold(compacted)
+      update = compactor.node.invoke({"messages": compacted})
+      if update:
+         summary_calls += 1
+         summary_tokens += approximate_tokens(compactor.summary_model.messages(compactor.get_summary_prompt(*fold)))
+         compacted = add(compacted, update["messages"])
+      after.append(approximate_tokens([instructions] + compacted))
+
+   print(f"{'turn':>5} {'tokens/call before':>19} {'tokens/call after':>18}")
+   for i in (1, 10, 25, 50, 100):
+      print(f"{i:>5} {before[i - 1]:>19} {after[i - 1]:>18}")
+   print(f"Total prompt tokens over 100 turns: {sum(before)} before, {sum(after)} after, plus {summary_tokens} in {summary_calls} summary calls")
+
+if __name__ == "__main__":
+   main()
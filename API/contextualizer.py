@@ -1,48 +1,129 @@
-from datatypes import State, TimeData, Agent
-from tools import print_state, list_events
-
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from datatypes import State, TimeData, ListQuery, Agent, Call, node, drive, adrive
+from tools import print_state, list_all, alist_all, prune_events, pool, reports, speculation
+from speculation import thread_of
+from report_cache import ReportCache
+from busy_times import build_report
+from event_table import encode_events, REPORT_COLUMNS
+from prompts import PromptedModel
+
+import asyncio
+import datetime
+import functools
+import time
+from concurrent.futures import Future
+
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph
 
 class Contextualizer(Agent):
-   """Event initializer agent; Takes user input detailing event(s), adds them to Google Calendar"""
+   """Contextualizer agent; Reports the user's busy times over the next 10 days for the other agents to work from
+
+   Reports are built deterministically from the event listing (see `busy_times`), with the LLM summarizer kept as
+   a fallback for listings that can't be parsed, or for every report if `llm_reports` is set. They are cached by
+   user, window and calendar version, so a new thread on an unchanged calendar gets its report without a Calendar
+   call. Windows start on the hour (`bucket` seconds) so that threads started close together share one. Concurrent
+   requests for the same report generate it once. A report can be started early with `speculate`, for the node
+   to pick up once it runs."""
 
-   def __init__(self, llm):
+   def __init__(self, llm, reports: ReportCache = reports, bucket: int = 3600, llm_reports: bool = False):
       # Initialize graph builder
       builder = StateGraph(State)
          
-      # Add nodes
-      builder.add_node("get", self.get_events)
-      builder.add_node("summarize", self.summarize)
-
-      # Add edges to define flow
-      builder.set_entry_point("get") # Generate function call to add event
-      builder.add_edge("get", "summarize") # Executes function call
+      # Add node
+      builder.add_node("report", node(self.report))
+      builder.set_entry_point("report")
 
       # Set attributes
       self.graph = builder.compile()
       self.llm = llm
-
-   def get_events(self, state: State):
-      """Node for contextualizer agent to craft function calls to add events"""
-
-      # Invoke initialize node with `add_event` tool and system instructions attached to state messages
-      events = list_events.run({"timeMin":TimeData.formatted_time(), "timeMax":TimeData.formatted_time(delta_days=10), "timeZone":str(TimeData.formatted_timezone())})
-      
-      return {"context": events} # return new 'messages' from invokation of llm on current 'messages' stored in state. Then our add_messages function automically appends
-   
-   def summarize(self, state: State):
-      """Node for event initializer agent to craft function calls to add events"""
-
-      # Invoke summarize node with system instructions attached to context message
-      message = self.llm.invoke(
-         [SystemMessage(content=self.get_instructions()), HumanMessage(content=state["context"])]
-      )
-      return {"context": message.content} # return new 'messages' from invokation of llm on current 'messages' stored in state. Then our add_messages function automically appends
+      self.summary_model = PromptedModel(llm, self.instructions, TimeData.formatted_context)
+      self.reports = reports
+      self.bucket = bucket
+      self.llm_reports = llm_reports
+
+   def report(self, state: State, config: RunnableConfig):
+      """Main node for contextualizer; Serves the busy-times report from cache, generating it on a miss"""
+
+      speculated = speculation.take((thread_of(config), "report"))
+      if speculated:
+         try:
+            report, version = yield Call(Future.result, asyncio.wrap_future, speculated)
+         except Exception:
+            version = None # Built again below
+         # A write earlier in the turn (e.g. the initializer's, on a first turn the router sent straight to it) makes it stale
+         if version is not None and version == (yield Call(self.store_version, self.astore_version, config)):
+            return {"context": report}
+      report, version = yield from self.build(config)
+      return {"context": report}
+
+   def build(self, config: RunnableConfig):
+      """Steps of a node body (see `node`) that get the report for the current window, from cache or generated, and the
+      calendar version it's built from (None if that can't be checked)"""
+
+      # The version check may sync the store, so the async graph runs it on the event loop's executor
+      key, window = yield Call(self.get_key, functools.partial(asyncio.to_thread, self.get_key), config)
+      if key is None:
+         return (yield from self.get_report(window, config)), None
+      generate = lambda: self.get_report(window, config)
+      return (yield Call(
+         lambda: self.reports.get(key, lambda: drive(generate())), lambda: self.reports.aget(key, lambda: adrive(generate()))
+      )), key[-1]
+
+   def speculate(self, config: RunnableConfig):
+      """Starts building the report in the background, so the turn's first agents run while the calendar is fetched"""
+
+      if thread_of(config) is not None:
+         speculation.start((thread_of(config), "report"), lambda: drive(self.build(config)))
+
+   @staticmethod
+   def store_version(config: RunnableConfig) -> int:
+      return pool.get(config).store.version
+
+   @staticmethod
+   async def astore_version(config: RunnableConfig) -> int:
+      return (await pool.aget(config)).store.version
+
+   def get_key(self, config: RunnableConfig) -> tuple:
+      """Cache key and list query for the current report window. The key is None if the calendar version can't be checked"""
+
+      now = time.time()
+      start = datetime.datetime.fromtimestamp(now - now % self.bucket).astimezone()
+      window = {"timeMin": start.isoformat(), "timeMax": (start + datetime.timedelta(days=10)).isoformat(), "timeZone": str(TimeData.formatted_timezone())}
+
+      try:
+         user, service, store = pool.get(config)
+         store.sync() # Delta pull only if the last sync is stale, so external changes also change the version
+      except Exception:
+         return None, window # Let the report go ahead uncached, as it did before caching
+      return (user, store.calendar_id, window["timeMin"], window["timeZone"], store.version), window
+
+   def get_report(self, window: dict, config: RunnableConfig):
+      """Steps of a node body (see `node`) that build the busy-times report for a window from its events, or have the LLM
+      summarize them if they can't be parsed"""
+
+      try: # Every event in the window, however many; a `list_events` listing stops at the listing budget
+         events = prune_events((yield Call(self.list_window, self.alist_window, window, config)))
+      except Exception as e:
+         events, listing = None, e # Reported by the summarizer, as `list_events` errors were
+      if events is None or self.llm_reports:
+         # Invoke llm with system instructions attached to the event listing (a compact table, or the error)
+         message = yield self.summary_model.call([HumanMessage(content=str(listing if events is None else encode_events(events, REPORT_COLUMNS)[0]))])
+         return message.content
+      # Building a report for a large calendar takes milliseconds, so the async graph runs it on the event loop's executor
+      now = datetime.datetime.fromisoformat(window["timeMin"])
+      return (yield Call(build_report, functools.partial(asyncio.to_thread, build_report), events, TimeData.formatted_timezone(), now=now))
+
+   @staticmethod
+   def list_window(window: dict, config: RunnableConfig) -> list:
+      return list_all(ListQuery(**window).model_dump(exclude={"format"}), pool.get(config))
+
+   @staticmethod
+   async def alist_window(window: dict, config: RunnableConfig) -> list:
+      return await alist_all(ListQuery(**window).model_dump(exclude={"format"}), await pool.aget(config))
    
-
-   # Functions to generate time-aware instructions for the initialize node
-   get_instructions = lambda self: f"""
+   # Instructions for the summarizer; the current time is appended on each call (see `PromptedModel`)
+   instructions = """
          You are the Contextualizer agent for a time management AI figure called Indigo. 
          You will format the event data you are given into a simple, concise, LLM-understandable report. The purpose of this report is to help other agents make context-aware decisions, so the format should be conducive to LLM understanding. This means you should optimally balance detail with brevity in reporting the user's schedule. Make sure that LLMs will understand it to a point where they won't schedule anything overlapping or overbook the user.
          
@@ -54,7 +135,6 @@ class Contextualizer(Agent):
             * **14:00-16:00, every Tuesday and Thursday, starting <office_hours_date>** (Office Hours)
          "
 
-         For context, right now the time is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone.
       """
 
 # TESTING
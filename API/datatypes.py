@@ -2,11 +2,12 @@ from typing import Annotated, List, Literal
 from typing_extensions import TypedDict
 
 import datetime
+import functools
 import tzlocal
 
 from pydantic import BaseModel, Field, computed_field
 from langgraph.graph.message import add_messages
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableLambda
 from langchain_core.messages import ToolMessage
 
 # Define classes for use in tools and graph
@@ -69,6 +70,12 @@ class EventBody(BaseModel):
          "timeZone": self.timeZone,
       }
 
+class EventBatch(BaseModel):
+   """Events to insert at once
+   Used as args schema for add_events tool"""
+
+   events: List[EventBody] = Field(..., description="The events to add, each with the same fields as a single `add_event` call")
+
 class ListQuery(BaseModel):
    """Query params for Events: list API call
    Used as args schema for list_events tool"""
@@ -81,6 +88,32 @@ class ListQuery(BaseModel):
    timeZone: str = Field(None, description="Time zone used in the response. Include for our use case. The default is the time zone of the calendar.")
    singleEvents: bool = Field(None, description="Whether to expand recurring events into instances and only return single one-off events and instances of recurring events, but not the underlying recurring events themselves. Set 'True' when specifying maxResults.")
    orderBy: str = Field(None, description="The order of the events returned in the result. By default the events are sorted by start time in ascending order. Optional. Possible values are: 'startTime', 'updated'.")
+   format: Literal["json", "compact"] = Field("json", description="How to return the events: 'json' for the full event objects, 'compact' for a table with one line per event and short references (e1, e2, ...) in place of event IDs, holding as many events as fit in the listing budget. Optional.")
+
+class SlotQuery(BaseModel):
+   """Query params for finding free time slots
+   Used as args schema for find_free_slots tool"""
+
+   startDate: str = Field(..., description="First day to search, in YYYY-MM-DD format", example="2025-02-10")
+   endDate: str = Field(None, description="Last day to search (inclusive), in YYYY-MM-DD format. Optional, defaults to startDate.", example="2025-02-14")
+   duration: int = Field(60, description="Length of the slot to find, in minutes. Optional, defaults to 60.")
+   workingHours: List[str] = Field(["07:00-22:00"], description="Windows of each day to search within, as 'HH:MM-HH:MM' in 24-hour time. Optional, defaults to ['07:00-22:00']. Ex: ['09:00-12:00', '13:00-17:00'] to leave out lunch.")
+   weekdays: List[Literal["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]] = Field(None, description="Days of the week to search. Optional, defaults to every day. Ex: ['Mon', 'Tue', 'Wed', 'Thu', 'Fri'] for weekdays only.")
+   buffer: int = Field(0, description="Minutes to keep free before and after existing events. Optional, defaults to 0.")
+   granularity: int = Field(15, description="Slots start on multiples of this many minutes past the hour. Optional, defaults to 15.")
+   timeZone: str = Field(None, description="IANA time zone the dates and hours are in, e.g. America/New_York. Optional, defaults to the user's time zone.")
+   maxResults: int = Field(50, description="Maximum number of free windows to return, earliest first. Optional, defaults to 50.")
+
+class GroupSlotQuery(SlotQuery):
+   """Query params for finding meeting times for several people
+   Used as args schema for find_group_slots tool"""
+
+   attendees: List[str] = Field(..., description="Email addresses (calendar IDs) of the people who must attend. The user is always included.")
+   optionalAttendees: List[str] = Field(None, description="Email addresses of people who should attend if possible. Slots where more of them are free rank higher. Optional.")
+   workingHours: List[str] = Field(["09:00-17:00"], description="Windows of each day to search within, as 'HH:MM-HH:MM' in 24-hour time. Optional, defaults to ['09:00-17:00'].")
+   preferredHours: List[str] = Field(None, description="Windows of the day to prefer among the working hours, as 'HH:MM-HH:MM'. Optional. Ex: ['10:00-12:00'] for late mornings.")
+   duration: int = Field(30, description="Length of the meeting, in minutes. Optional, defaults to 30.")
+   maxResults: int = Field(5, description="Number of meeting times to suggest, best first. Optional, defaults to 5.")
 
 class SelectOutput(BaseModel):
    """Output structure for Event Lookup agent"""
@@ -88,25 +121,31 @@ class SelectOutput(BaseModel):
    selection: List[str] = Field(..., description="List of event IDs selected from the candidate events")
 
 
+SUMMARY_ID = "conversation_summary" # ID of the rolling summary message the Compactor keeps at the head of the conversation
+
 def add(left, right):
-   """Add messages together, removing duplicate Tool Messages in accordance with Gemini function call norms"""
-   
-   first_tool = None
+   """Add messages together, merging Tool Messages into the first one in accordance with Gemini function call norms
+
+   Builds the merged list in one pass without modifying `left`, `right` or the messages in them; the merged Tool
+   Message is a copy of the first one, with the contents, names and call IDs of all of them joined by ", "."""
 
    if isinstance(right, list):
-      i = 0
-      while i < len(right): # Loop through the right side
-         if isinstance(right[i], ToolMessage): # Collapse all tool messages into the first one that appears
-            if first_tool is None:
-               first_tool = i
-            else:
-               right[first_tool].content += ", " + right[i].content
-               right[first_tool].name += ", " + right[i].name
-               right[first_tool].tool_call_id += ", " + right[i].tool_call_id
-               right.pop(i)
-               i -= 1
-         i += 1
-   return add_messages(left, right)
+      tool_messages = [message for message in right if isinstance(message, ToolMessage)]
+      if len(tool_messages) > 1: # Collapse all tool messages into the first one that appears
+         first_tool = tool_messages[0]
+         merged = first_tool.model_copy(update={
+            "content": ", ".join(message.content for message in tool_messages),
+            "name": ", ".join(message.name for message in tool_messages),
+            "tool_call_id": ", ".join(message.tool_call_id for message in tool_messages),
+         })
+         right = [merged if message is first_tool else message for message in right if message is first_tool or not isinstance(message, ToolMessage)]
+
+   messages = add_messages(left, right)
+
+   # A new conversation summary is appended like any message, but belongs at the head of the conversation
+   if len(messages) > 1 and messages[-1].id == SUMMARY_ID:
+      messages.insert(0, messages.pop())
+   return messages
    
 
 class State(TypedDict):
@@ -121,6 +160,7 @@ class TimeData:
 
    formatted_time = lambda delta_days=0: (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=delta_days)).astimezone().isoformat()
    formatted_timezone = lambda: tzlocal.get_localzone()
+   formatted_context = lambda: f"For context, right now the time is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone."
 
 class Agent(Runnable):
    """Base class for agents, extends LangChain Runnable and routes method calls to internal graph object
@@ -131,3 +171,60 @@ class Agent(Runnable):
    invoke = lambda self, *args, **kwargs: self.graph.invoke(*args, **kwargs)
 
    stream = lambda self, *args, **kwargs: self.graph.stream(*args, **kwargs)
+
+   # Async counterparts, so agents nested as nodes run natively async instead of in a worker thread
+   ainvoke = lambda self, *args, **kwargs: self.graph.ainvoke(*args, **kwargs)
+
+   astream = lambda self, *args, **kwargs: self.graph.astream(*args, **kwargs)
+
+class Call:
+   """A blocking call made by a node body, with its async counterpart: `result = yield Call(sync, asynchronous, *args)`"""
+
+   def __init__(self, sync, asynchronous, *args, **kwargs):
+      self.sync = sync
+      self.asynchronous = asynchronous
+      self.args = args
+      self.kwargs = kwargs
+
+def node(body) -> RunnableLambda:
+   """Graph node with one body for the sync and the async graph. The body is a generator function that yields a `Call`
+   for each blocking call it makes and gets back its result (or its exception); `invoke` makes the sync calls, and
+   `ainvoke` awaits the async ones. Bodies can share steps with `yield from`"""
+
+   @functools.wraps(body)
+   def run(*args, **kwargs):
+      return drive(body(*args, **kwargs))
+
+   @functools.wraps(body)
+   async def arun(*args, **kwargs):
+      return await adrive(body(*args, **kwargs))
+
+   return RunnableLambda(run, afunc=arun)
+
+def drive(steps):
+   """Runs a node body's steps (see `node`) with the sync calls, returns its result"""
+
+   result, error = None, None
+   while True:
+      try:
+         call = steps.throw(error) if error else steps.send(result)
+      except StopIteration as stop:
+         return stop.value
+      try:
+         result, error = call.sync(*call.args, **call.kwargs), None
+      except Exception as e:
+         result, error = None, e
+
+async def adrive(steps):
+   """Runs a node body's steps (see `node`) awaiting the async calls, returns its result"""
+
+   result, error = None, None
+   while True:
+      try:
+         call = steps.throw(error) if error else steps.send(result)
+      except StopIteration as stop:
+         return stop.value
+      try:
+         result, error = await call.asynchronous(*call.args, **call.kwargs), None
+      except Exception as e:
+         result, error = None, e
@@ -1,8 +1,8 @@
-from datatypes import State, TimeData, Agent
+from datatypes import State, TimeData, Agent, node
 from tools import update_event, delete_event, list_events, print_state, print_stream
 from event_lookup import EventLookup
+from prompts import PromptedModel
 
-from langchain_core.messages import SystemMessage
 from langgraph.graph import StateGraph
 
 class EventEditor(Agent):
@@ -14,7 +14,7 @@ class EventEditor(Agent):
 
       # Add nodes
       builder.add_node("lookup", event_lookup)
-      builder.add_node("edit", self.edit)
+      builder.add_node("edit", node(self.edit))
       builder.add_node("tool", tool_node)
 
       # Add edges to define flow
@@ -25,27 +25,25 @@ class EventEditor(Agent):
       # Set attributes
       self.graph = builder.compile()
       self.llm = llm
+      self.edit_model = PromptedModel(llm, self.instructions, TimeData.formatted_context, tools=[ update_event, delete_event ], tool_choice="any")
 
    def edit(self, state: State):
       """Main node for event_editor"""
 
       # Invoke edit node with `update_event` and `delete_event` tools and system instructions attached to state messages
-      output = self.llm.bind_tools([ update_event, delete_event ], tool_choice="any").invoke(
-         [SystemMessage(content=self.get_instructions())] + state["messages"]
-      )
+      output = yield self.edit_model.call(state["messages"])
 
       return {"messages": output}
    
-   # Functions to generate time-aware instructions for the edit node
-   get_instructions = lambda self: f"""
+   # Instructions for the edit node; the current time is appended on each call (see `PromptedModel`)
+   instructions = """
          You are an agent responsible for editing given events based on a user prompt. You will be given an array of events from the lookup agent in the most recent message, which tries to identify the events specified in the user's prompt.
-         For EACH event make the proper call to `update_event`/`delete_event`. `delete_event` is simple, just pass in the event id, but for `update_event` pass the FULL JSON, but with the proper updates to the properties. Be sure to preserve the duration of the events unless specified. 
+         For EACH event make the proper call to `update_event`/`delete_event`. `delete_event` is simple, just pass in the event id, but for `update_event` pass the FULL JSON, but with the proper updates to the properties. Be sure to preserve the duration of the events unless specified. To remove a property (e.g. the recurrence, to make an event a one-off, or the location), leave it out of the JSON.
          
          If the array of events is empty, pass no args to `update_event`/`delete_event`.
          Ex: User: 'Edit my gym session tomorrow to be recurring on weekdays', Lookup: [] -> update_event()
          Ex: User: 'Delete my haircut this afternoon', Lookup: [] -> delete_event()
 
-         For context it is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone.
       """
 
 # TESTING
@@ -1,7 +1,7 @@
-from datatypes import State, TimeData, Agent
-from tools import add_event, print_state
+from datatypes import State, TimeData, Agent, node
+from tools import add_event, add_events, find_free_slots, find_group_slots, print_state
+from prompts import PromptedModel
 
-from langchain_core.messages import SystemMessage
 from langgraph.graph import StateGraph
 
 class EventInitializer(Agent):
@@ -13,7 +13,7 @@ class EventInitializer(Agent):
          
       # Add nodes
       builder.add_node("tool", tool_node)
-      builder.add_node("init", self.initialize)
+      builder.add_node("init", node(self.initialize))
 
       # Add edges to define flow
       builder.set_entry_point("init") # Generate function call to add event
@@ -22,25 +22,29 @@ class EventInitializer(Agent):
       # Set attributes
       self.graph = builder.compile()
       self.llm = llm
+      self.init_model = PromptedModel(llm, self.instructions, TimeData.formatted_context, tools=[ add_event, add_events, find_free_slots, find_group_slots ])
 
    def initialize(self, state: State):
       """Node for event initializer agent to craft function calls to add events"""
 
       # Invoke initialize node with `add_event` tool and system instructions attached to state messages
-      message = self.llm.bind_tools([ add_event ]).invoke(
-         [SystemMessage(content=self.get_instructions())] + state["messages"]
-      )
+      message = yield self.init_model.call(state["messages"])
       return {"messages": message} # return new 'messages' from invokation of llm on current 'messages' stored in state. Then our add_messages function automically appends
 
-   # Functions to generate time-aware instructions for the initialize node
-   get_instructions = lambda self: f"""
+   # Instructions for the initialize node; the current time is appended on each call (see `PromptedModel`)
+   instructions = """
          You are the Event Initializer agent for a time management AI figure called Indigo. 
-         You will take input detailing one or more events to insert, and make the appropriate call to `add_event`. For multiple events, simply make multiple calls to `add_event`.
+         You will take input detailing one or more events to insert, and make the appropriate call to `add_event`. For multiple events (e.g. a whole class schedule), make a single call to `add_events` with all of them instead; it reports back which were added and which failed.
 
          Make events an hour if duration or end time is not specified, but otherwise do not assume any default values. 
          Ex: 'Lunch at noon' -> add_event(..., startTime=<12pm>, endTime=<1pm>)
 
-         For context, right now the time is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone.
+         If you are asked to find time for something rather than given a time, call `find_free_slots` over the days in question instead of `add_event`, with any working hours, weekdays or breaks between events the user mentions. Indigo will offer the free times it returns to the user.
+         Ex: 'Find me 2 hours for studying this week, mornings only' -> find_free_slots(startDate=<today>, endDate=<end of week>, duration=120, workingHours=['07:00-12:00'])
+
+         If the time has to work for other people too, call `find_group_slots` with their email addresses instead. Put the people who must attend in `attendees` and anyone described as optional in `optionalAttendees`.
+         Ex: 'When can I meet with ana@example.com and raj@example.com next week, ideally late morning?' -> find_group_slots(attendees=['ana@example.com', 'raj@example.com'], startDate=<next Monday>, endDate=<next Friday>, preferredHours=['10:00-12:00'])
+
       """
 
 # TESTING
@@ -58,7 +62,7 @@ def main():
       google_api_key=os.getenv("GEMINI_API_KEY"),
       temperature=0.3
    )
-   tool_node = ToolNode([ add_event ])
+   tool_node = ToolNode([ add_event, add_events ])
 
    init = EventInitializer(llm, tool_node)
    print_state(init.invoke(
@@ -1,7 +1,13 @@
-from datatypes import State, TimeData, Agent, SelectOutput
-from tools import list_events, print_state, parseJSON, get_event, json, print_stream
+from datatypes import State, TimeData, Agent, SelectOutput, Call, node
+from tools import list_events, print_state, parseJSON, get_events, aget_events, json, print_stream, prefetch_listing
+from prompts import PromptedModel
+from router import answers_question
+from time_window import parse_window
 
-from langchain_core.messages import SystemMessage, AIMessage
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph
 
 class EventLookup(Agent):
@@ -12,9 +18,9 @@ class EventLookup(Agent):
       builder = StateGraph(State)
 
       # Add nodes
-      builder.add_node("query", self.query)
+      builder.add_node("query", node(self.query))
       builder.add_node("tool", tool_node)
-      builder.add_node("select", self.select)
+      builder.add_node("select", node(self.select))
 
       # Add edges to define flow
       builder.set_entry_point("query") # First generates query to retrieve candidate events
@@ -24,35 +30,78 @@ class EventLookup(Agent):
       # Set attributes
       self.graph = builder.compile()
       self.llm = llm
+      self.query_model = PromptedModel(llm, self.query_instructions, TimeData.formatted_context, tools=[ list_events ], tool_choice="list_events")
+      self.select_model = PromptedModel(llm, self.select_instructions, TimeData.formatted_context, schema=SelectOutput)
 
    def query(self, state: State):
       """Node for event lookup agent to craft a `list_events` query"""
 
-      # Invoke query node with `list_events` tool and system instructions attached to state messages
-      output = self.llm.bind_tools([ list_events ], tool_choice="list_events").invoke(
-         [SystemMessage(content=self.get_query_instructions())] + state["messages"]
-      )
+      # Query the window the user named if it parses locally, else invoke query node with `list_events` tool and system instructions attached to state messages
+      output = self.parsed_query(state) or (yield self.query_model.call(state["messages"]))
 
       # Return output to be appended to state
-      return {"messages": output}
+      return {"messages": self.compact(output)}
+
+   def speculate(self, state: State, config: RunnableConfig):
+      """Starts fetching the candidates for the window the user's message names, in case the turn comes to a lookup;
+      the `list_events` call the query node makes for that window picks them up"""
+
+      call = self.parsed_query(state)
+      if call is not None:
+         prefetch_listing(self.compact(call).tool_calls[0]["args"], config)
+
+   def parsed_query(self, state: State) -> AIMessage | None:
+      """The `list_events` call for the time window named in the user's latest message ("tomorrow", "this afternoon", ...),
+      parsed locally without the query model; None for messages naming no single window, or answering a question (e.g.
+      "tomorrow" to "When did you want to move it to?"), which the model is left to read with the conversation"""
 
-   def select(self, state: State):
+      if answers_question(state["messages"]):
+         return None
+      request = next((message for message in reversed(state["messages"]) if isinstance(message, HumanMessage)), None)
+      params = parse_window(str(request.content)) if request is not None else None
+      if params is None:
+         return None
+      return AIMessage(content="", tool_calls=[{"name": "list_events", "args": params, "id": uuid.uuid4().hex}])
+
+   def compact(self, output: AIMessage) -> AIMessage:
+      """Has `list_events` return a compact table unless the query asked otherwise; the select node needs no more than that"""
+
+      for call in output.tool_calls:
+         call["args"].setdefault("format", "compact")
+      return output
+
+   def select(self, state: State, config: RunnableConfig):
       """Node for event lookup agent to choose relevant events"""
 
       # Invoke select node with system instructions attached to state messages
-      output = self.llm.with_structured_output(SelectOutput).invoke(
-         [SystemMessage(content=self.get_select_instructions())] + state["messages"]
-      )
-      # Use list of IDs to get list of Event objects from Google Calendar API
+      output = yield self.select_model.call(state["messages"])
+      # Resolve selected IDs against the candidate events already in state, and fetch any others in a single batch
+      candidates = self.get_candidates(state)
+      missing = [id for id in output.selection if id not in candidates]
+      fetched = dict(zip(missing, (yield Call(get_events, aget_events, missing, config)))) if missing else {}
 
-      events = [get_event(id) for id in output.selection]
+      events = [candidates[id] if id in candidates else fetched[id] for id in output.selection]
       message = AIMessage(content=json.dumps(events))
 
       # Return output (either list of events or original unparseable output) to be appended to state
       return {"messages": message}
+
+   def get_candidates(self, state: State) -> dict:
+      """Maps event IDs, and the short references of a compact listing, to the candidate events returned by the most recent `list_events` call in state"""
+
+      for message in reversed(state["messages"]):
+         if isinstance(message, ToolMessage):
+            if isinstance(message.artifact, dict): # Compact listing, the artifact maps references to events
+               return {**{event["id"]: event for event in message.artifact.values() if "id" in event}, **message.artifact}
+            try:
+               events = json.loads(message.content)
+            except (ValueError, TypeError):
+               return {} # Tool call failed, nothing to resolve against
+            return {event["id"]: event for event in events if isinstance(event, dict) and "id" in event} if isinstance(events, list) else {}
+      return {}
    
-   # Functions to generate time-aware instructions for the nodes
-   get_query_instructions = lambda self: f"""
+   # Instructions for the nodes; the current time is appended on each call (see `PromptedModel`)
+   query_instructions = """
          You are the query node for the Event Lookup agent for a time management AI figure called Indigo. You will be given a user prompt that talks about one or more events, and you will generate a query to 'capture' the events referenced in the prompt. Then, the relevant events will be selected from the results of the query by the next node in the agent.
          
          Ex: 'What is my next upcoming event?' -> list_events(maxResults=1, timeMin=<current_time>, singleEvents=True, orderBy='startTime')
@@ -65,11 +114,10 @@ class EventLookup(Agent):
          Ex: 'Reschedule my gym sessions to 6pm' -> list_events(timeMin=<midnight last night>, timeMax=<midnight two weeks from now>)
          - In the above example, the time frame for the query is ambiguous, so the query is kept broad and singleEvents is left as False so as to appropriately capture potentially recurring events.
 
-         For context, right now the time is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone.
       """
    
-   get_select_instructions = lambda self: f"""
-         You are an agent in charge of selecting the relevant event(s) from the selection provided by the result of the Tool call. Produce a list of the IDs of the event(s) that the user is 'referencing' in their query. You may assume events are upcoming by default. 
+   select_instructions = """
+         You are an agent in charge of selecting the relevant event(s) from the selection provided by the result of the Tool call. Produce a list of the IDs of the event(s) that the user is 'referencing' in their query; when the events are listed as a table, their IDs are the references in its first column (e1, e2, ...). You may assume events are upcoming by default. 
          Select a recurrent event when the user mentions it.
          BE PRECISE ABOUT THIS. If the user mentions events which do not correspond to any of the options, output an empty list []. THIS IS THE DEFAULT BEHAVIOR, i.e. most input possibilities should NOT map to any of the possible options, and should lead you to output an empty list [].
 
@@ -81,7 +129,6 @@ class EventLookup(Agent):
          Ex: User: 'Push all my meetings this afternoon to tomorrow.', Tool: [<Meeting 1>, <Meeting 2>] -> Output: [<Meeting 1 ID>, <Meeting 2 ID>]
          - The above example shows that the options provided by the tool call *typically* reflect the user's specified time frame, so you don't usually have to worry about that.
 
-         For context, right now the time is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone.
       """
 
 # TESTING   
@@ -0,0 +1,359 @@
+import bisect
+import datetime
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+import tzlocal
+from googleapiclient.errors import HttpError
+
+from gcal_service import LIST_FIELDS
+from recurrence import Series
+
+class EventStore:
+    """Local mirror of a Google Calendar, kept current with incremental syncs
+
+    Does one full sync, then pulls deltas with the `nextSyncToken` from the previous sync. Events are held
+    in memory, indexed by ID and by start time, and persisted to a JSON snapshot so restarts resume from
+    the last sync token instead of re-downloading the calendar. Reads are served locally; writes made through
+    the tools are applied to the store as they go through to the API. Recurring series are expanded locally
+    for `singleEvents` queries, with the exceptions (moved or cancelled instances) the sync returns applied."""
+
+    def __init__(self, service, calendar_id: str = "primary", snapshot_path: str = "event_store.json", max_staleness: float = 30.0):
+        self.service = service
+        self.calendar_id = calendar_id
+        self.snapshot_path = snapshot_path
+        self.max_staleness = max_staleness # Seconds a sync is trusted before the next read pulls a delta
+
+        self.sync_token: str = None
+        self.version = 0 # Bumped on every change to the store's events, marks data derived from them as stale
+        self._events: dict[str, dict] = {} # Event ID -> event resource
+        self._index: list[tuple[float, str]] = [] # Sorted (start timestamp, event ID) for one-off events and exceptions
+        self._series: set[str] = set() # IDs of recurring series masters, which can span indefinitely
+        self._rules: dict[str, Series] = {} # Series master ID -> its parsed recurrence, parsed on first expansion
+        self._overrides: dict[str, set[float]] = {} # Series master ID -> original start timestamps of its exceptions
+        self._max_span = 0.0 # Longest indexed event, bounds how far back a window scan has to start
+        self._last_sync = 0.0
+        self._saved = None # (version, sync token) the snapshot was last written or read at
+        self._loaded = False # The snapshot is read on first use rather than at construction
+        self._lock = threading.RLock()
+
+    # Sync
+
+    def sync(self, force: bool = False):
+        """Brings the store up to date with the calendar, pulling a delta if the last sync is stale"""
+
+        with self._lock:
+            self._load_once()
+            if not force and time.monotonic() - self._last_sync < self.max_staleness:
+                return
+
+            if self.sync_token is None:
+                self._full_sync()
+            else:
+                try:
+                    self._apply(self._pull(syncToken=self.sync_token))
+                except HttpError as error:
+                    if error.resp.status != 410: # 410 GONE means the sync token expired
+                        raise
+                    self._full_sync()
+
+            self._last_sync = time.monotonic()
+            if self._saved != (self.version, self.sync_token): # A delta with no changes leaves the snapshot as it is
+                self.save()
+
+    @property
+    def stale(self) -> bool:
+        """Whether the next read will sync, and so may read the snapshot or call the API"""
+        return not self._loaded or time.monotonic() - self._last_sync >= self.max_staleness
+
+    def _full_sync(self):
+        self._events, self._index, self._series, self._max_span = {}, [], set(), 0.0
+        self._rules, self._overrides = {}, {}
+        self.version += 1
+        self._apply(self._pull())
+
+    def _pull(self, **params) -> list[dict]:
+        """Fetches every page of a list query, recording the sync token returned on the last page"""
+
+        items, page_token = [], None
+        while True:
+            result = self.service.events().list(
+                calendarId=self.calendar_id, maxResults=2500, pageToken=page_token, fields=LIST_FIELDS, **params
+            ).execute()
+            items.extend(result.get("items", []))
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                self.sync_token = result.get("nextSyncToken", self.sync_token)
+                return items
+
+    def _apply(self, items: list[dict]):
+        for event in items:
+            if event.get("status") == "cancelled" and not event.get("recurringEventId"):
+                self._discard(event["id"])
+            else:
+                self._put(event)
+
+    # Index maintenance
+
+    def _put(self, event: dict):
+        self._discard(event["id"])
+        self._events[event["id"]] = event
+        self.version += 1
+
+        if event.get("recurringEventId"): # An exception, which replaces an instance of its series
+            self._overrides.setdefault(event["recurringEventId"], set()).add(_original_start(event))
+            if event.get("status") == "cancelled":
+                return # Kept only to leave its instance out of expansions
+        if event.get("recurrence"):
+            self._series.add(event["id"])
+        else:
+            start, end = _bounds(event)
+            bisect.insort(self._index, (start, event["id"]))
+            self._max_span = max(self._max_span, end - start)
+
+    def _discard(self, event_id: str):
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+        self.version += 1
+        if event.get("recurringEventId"):
+            self._overrides.get(event["recurringEventId"], set()).discard(_original_start(event))
+        if event_id in self._series:
+            self._series.discard(event_id)
+            self._rules.pop(event_id, None)
+        elif event.get("status") != "cancelled":
+            key = (_bounds(event)[0], event_id)
+            i = bisect.bisect_left(self._index, key)
+            if i < len(self._index) and self._index[i] == key:
+                del self._index[i]
+
+    # Write-through
+
+    def upsert(self, event: dict):
+        """Records an event returned by an insert or update call"""
+        if isinstance(event, dict) and "id" in event:
+            with self._lock:
+                self._load_once()
+                self._apply([event])
+
+    def remove(self, event_id: str):
+        """Records a deleted event. Deleting an instance of a recurring event cancels just that instance"""
+        with self._lock:
+            self._load_once()
+            master_id = event_id.rpartition("_")[0]
+            if event_id not in self._events and master_id in self._series and self._expansion(master_id):
+                instance = self._rules[master_id].find(event_id)
+                if instance is not None: # As the next sync would return it
+                    self._put({**instance, "status": "cancelled"})
+                return
+            self._discard(event_id)
+
+    # Reads
+
+    def get(self, event_id: str) -> dict | None:
+        """Returns the event with the given ID, or None if the store doesn't hold it. Instances of recurring
+        events are expanded from their series"""
+
+        self.sync()
+        with self._lock:
+            event = self._events.get(event_id)
+            master_id = event_id.rpartition("_")[0]
+            if event is None and master_id in self._series:
+                series = self._expansion(master_id)
+                event = series.find(event_id) if series else None
+            return event
+
+    def list(self, params: dict) -> list[dict] | None:
+        """Answers a `list_events` query (ListQuery params) from the store
+
+        Returns None for queries the store can't answer faithfully, which callers should send to the API:
+        other calendars, series it can't expand, and expansions with no end (no timeMax nor maxResults)."""
+
+        if (params.get("calendarId") or "primary") != self.calendar_id:
+            return None
+
+        self.sync()
+        with self._lock:
+            time_min = _timestamp(params["timeMin"]) if params.get("timeMin") else float("-inf")
+            time_max = _timestamp(params["timeMax"]) if params.get("timeMax") else float("inf")
+
+            series = [self._events[i] for i in self._series if _bounds(self._events[i])[0] < time_max]
+            expand = params.get("singleEvents") and series
+            if expand and time_max == float("inf") and (not params.get("maxResults") or params.get("orderBy") == "updated"):
+                return None
+
+            # Scan the start index from the earliest start that could still overlap the window
+            lo = bisect.bisect_left(self._index, (time_min - self._max_span,))
+            hi = bisect.bisect_left(self._index, (time_max,))
+            events = []
+            for _, event_id in self._index[lo:hi]:
+                event = self._events[event_id]
+                if _bounds(event)[1] > time_min:
+                    events.append(event)
+
+            if expand:
+                expansions = [self._expansion(master["id"]) for master in series]
+                if None in expansions:
+                    return None
+                instances = [expansion.instances(time_min, time_max, self._overrides.get(expansion.master["id"], ())) for expansion in expansions]
+                merged = heapq.merge(events, *instances, key=lambda e: _bounds(e)[0])
+                # Ordered by updated time, every instance in the window is needed before any can be cut
+                limit = params.get("maxResults") if params.get("orderBy") != "updated" else None
+                events = list(itertools.islice(merged, limit))
+            elif not params.get("singleEvents"):
+                events = sorted(events + series, key=lambda e: _bounds(e)[0])
+            if params.get("orderBy") == "updated":
+                events.sort(key=lambda e: e.get("updated", ""))
+
+            return events[:params["maxResults"]] if params.get("maxResults") else events
+
+    def _expansion(self, master_id: str) -> Series | None:
+        """The parsed recurrence of a series master, or None if it can't be expanded locally"""
+
+        if master_id not in self._rules:
+            try:
+                self._rules[master_id] = Series(self._events[master_id])
+            except (ValueError, KeyError) as error: # Rules or time zones dateutil/zoneinfo can't handle
+                print(f"Can't expand series {master_id} locally: {error}")
+                self._rules[master_id] = None
+        return self._rules[master_id]
+
+    # Persistence
+
+    def save(self):
+        """Atomically writes the store to its snapshot file"""
+
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            snapshot = {"calendarId": self.calendar_id, "syncToken": self.sync_token, "events": list(self._events.values())}
+            self._saved = (self.version, self.sync_token)
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(temp_path, self.snapshot_path)
+
+    def load(self):
+        """Restores the store from its snapshot file, if one exists for this calendar"""
+
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return # A corrupt snapshot just means a full sync
+
+        if snapshot.get("calendarId") == self.calendar_id:
+            with self._lock:
+                self._apply(snapshot.get("events", []))
+                self.sync_token = snapshot.get("syncToken")
+                self._saved = (self.version, self.sync_token)
+
+    def _load_once(self):
+        if not self._loaded:
+            self._loaded = True
+            self.load()
+
+# Helpers
+
+def _timestamp(value: str) -> float:
+    """Converts an RFC3339 timestamp or all-day date to epoch seconds, all-day dates taken in local time"""
+
+    if len(value) == 10:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=tzlocal.get_localzone()).timestamp()
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tzlocal.get_localzone())
+    return parsed.timestamp()
+
+def _original_start(event: dict) -> float:
+    """Original start of an exception to a recurring series in epoch seconds, which identifies the instance it replaces"""
+
+    original = event.get("originalStartTime") or event.get("start", {})
+    return _timestamp(original.get("dateTime") or original.get("date") or "1970-01-01")
+
+def _bounds(event: dict) -> tuple[float, float]:
+    """Start and end of an event in epoch seconds"""
+
+    start, end = event.get("start", {}), event.get("end", {})
+    begin = _timestamp(start.get("dateTime") or start.get("date") or "1970-01-01")
+    finish = end.get("dateTime") or end.get("date")
+    return begin, _timestamp(finish) if finish else begin
+
+# TESTING
+
+def main():
+    """Benchmarks API calls and p50 latency per chat turn, direct API reads vs. the store, against a local fake"""
+
+    import statistics
+    import tempfile
+    from google.oauth2.credentials import Credentials
+    from gcal_service import GoogleCalendarService
+    from fake_calendar import FakeCalendar, make_events
+
+    def run_turns(fake, list_events, get_event, turns=20):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        latencies = []
+        fake.reset_calls()
+        for _ in range(turns):
+            began = time.perf_counter()
+            # A lookup-heavy turn: context fetch, candidate query, then hydrating the selection
+            list_events({"calendarId": "primary", "timeMin": now.isoformat(), "timeMax": (now + datetime.timedelta(days=10)).isoformat()})
+            candidates = list_events({"calendarId": "primary", "timeMin": now.isoformat(), "timeMax": (now + datetime.timedelta(days=1)).isoformat()})
+            for event in candidates[:3]:
+                get_event(event["id"])
+            latencies.append(time.perf_counter() - began)
+        return fake.round_trips / turns, statistics.median(latencies) * 1000
+
+    with FakeCalendar(latency=0.03) as fake:
+        fake.seed(make_events(500, days=60))
+        service = GoogleCalendarService(creds=Credentials(token="fake"), api_endpoint=fake.url)
+
+        direct = run_turns(
+            fake,
+            lambda params: service.events().list(**params).execute().get("items", []),
+            lambda event_id: service.events().get(calendarId="primary", eventId=event_id).execute(),
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = EventStore(service, snapshot_path=os.path.join(directory, "event_store.json"))
+            stored = run_turns(fake, store.list, store.get)
+            written = os.stat(store.snapshot_path).st_mtime_ns
+            store.sync(force=True)
+            assert os.stat(store.snapshot_path).st_mtime_ns == written, "A delta with no changes rewrote the snapshot"
+
+    print(f"Direct API: {direct[0]:.2f} calls/turn, p50 {direct[1]:.1f} ms/turn")
+    print(f"EventStore: {stored[0]:.2f} calls/turn, p50 {stored[1]:.1f} ms/turn")
+
+    # A weekday gym series with one instance moved and one cancelled, as a sync returns them
+    monday = datetime.datetime.now(datetime.timezone.utc).replace(hour=7, minute=0, second=0, microsecond=0)
+    monday -= datetime.timedelta(days=monday.weekday() + 7)
+    at = lambda days, hours=7: {"dateTime": (monday + datetime.timedelta(days=days, hours=hours - 7)).isoformat(), "timeZone": "UTC"}
+    stamp = lambda days: (monday + datetime.timedelta(days=days)).strftime("%Y%m%dT%H%M%SZ")
+    series = [
+        {"id": "gym", "summary": "Gym", "start": at(0), "end": at(0, 8), "recurrence": ["RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"]},
+        {"id": f"gym_{stamp(8)}", "summary": "Gym", "recurringEventId": "gym", "originalStartTime": at(8), "start": at(8, 18), "end": at(8, 19)},
+        {"id": f"gym_{stamp(9)}", "status": "cancelled", "recurringEventId": "gym", "originalStartTime": at(9)},
+    ]
+    with FakeCalendar() as fake:
+        fake.seed(series)
+        service = GoogleCalendarService(creds=Credentials(token="fake"), api_endpoint=fake.url)
+        store = EventStore(service, snapshot_path=None)
+        store.sync()
+        fake.reset_calls()
+        week = {"calendarId": "primary", "timeMin": (monday + datetime.timedelta(days=7)).isoformat(), "timeMax": (monday + datetime.timedelta(days=14)).isoformat(), "singleEvents": True}
+        instances = store.list(week)
+        assert [event["start"]["dateTime"][8:16] for event in instances] == [at(days, hours)["dateTime"][8:16] for days, hours in ((7, 7), (8, 18), (10, 7), (11, 7))], instances
+        assert store.get(f"gym_{stamp(10)}") == instances[2] and store.get(f"gym_{stamp(12)}") is None # No gym on Saturdays
+        assert len(store.list({**week, "timeMax": None, "maxResults": 500})) == 500
+        store.remove(f"gym_{stamp(10)}")
+        assert len(store.list(week)) == 3 and fake.round_trips == 0
+    print("Recurring series expanded locally, with the moved and cancelled instances applied, in no API calls")
+
+if __name__ == "__main__":
+    main()
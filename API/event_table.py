@@ -0,0 +1,90 @@
+import datetime
+
+from compactor import CHARS_PER_TOKEN
+
+SELECT_COLUMNS = ("start", "end", "summary", "recurrence", "location") # What the lookup needs to pick events out of a listing
+REPORT_COLUMNS = ("start", "end", "summary", "recurrence") # What the busy-times summarizer needs
+
+def encode_events(events: list[dict], columns: tuple = SELECT_COLUMNS, more: bool = False) -> tuple[str, dict]:
+    """Renders events as a compact table for the LLM: a header row, then one `|`-separated line per event
+
+    Each event gets a short reference (e1, e2, ...) in place of its ID; returns (table, dict of reference -> event)
+    for mapping the model's picks back to real events. Times are shown as `YYYY-MM-DD HH:MM`, with the UTC offset
+    stated once above the table when every event shares it, and ends that fall on the start's day as just `HH:MM`.
+    Set `more` if the events are only the first of a longer listing, so the table says so."""
+
+    events = [event for event in events if isinstance(event, dict)]
+    refs = {f"e{i}": event for i, event in enumerate(events, 1)}
+    offsets = {_offset(event.get(key, {}).get("dateTime")) for event in events for key in ("start", "end")} - {None}
+    offset = offsets.pop() if len(offsets) == 1 else None
+
+    header = f"{len(events)} events" + (" (more not shown, narrow the time window to see them)" if more else "")
+    lines = [header + (f", times at UTC{offset}" if offset else ""), "|".join(("ref",) + tuple(columns))]
+    lines += [_row(ref, event, columns, offset) for ref, event in refs.items()]
+    return "\n".join(lines), refs
+
+def row_tokens(event: dict, columns: tuple = SELECT_COLUMNS) -> int:
+    """Approximate tokens an event's line in the table takes, at most (as if its UTC offset had to be shown)"""
+    return len(_row("e0000", event, columns, None)) // CHARS_PER_TOKEN + 1
+
+def _row(ref: str, event: dict, columns: tuple, offset: str | None) -> str:
+    start = _time(event.get("start", {}), offset)
+    cells = [ref]
+    for column in columns:
+        if column == "start":
+            cells.append(start)
+        elif column == "end":
+            end = _time(event.get("end", {}), offset)
+            cells.append(end[11:] if end[:10] == start[:10] and len(end) > 10 else end)
+        elif column == "recurrence":
+            cells.append(" ".join(rule.removeprefix("RRULE:") for rule in event.get("recurrence") or []))
+        else:
+            cells.append(_cell(event.get(column)))
+    return "|".join(cells).rstrip("|")
+
+def _time(value: dict, offset: str | None) -> str:
+    if "date" in value:
+        return value["date"]
+    if "dateTime" not in value:
+        return ""
+    moment = datetime.datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+    text = moment.strftime("%Y-%m-%d %H:%M")
+    return text if _offset(value["dateTime"]) == offset else text + _offset(value["dateTime"])
+
+def _offset(value: str | None) -> str | None:
+    if not value:
+        return None
+    moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment.isoformat(timespec="seconds")[19:] if moment.tzinfo else None
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).replace("|", "/") # One line per event, and no stray column breaks
+
+# TESTING
+
+def main():
+    """Compares the size of a 200-event listing as the indented JSON `list_events` used to return, and as a table"""
+
+    import json
+    from fake_calendar import FakeCalendar, make_events
+    from compactor import approximate_tokens
+    from langchain_core.messages import ToolMessage
+    from tools import prune_events
+
+    with FakeCalendar() as fake:
+        events = [fake._insert(event) for event in make_events(200, days=10)] # As the API returns them
+
+    listings = {
+        "json, indented": json.dumps(prune_events(events), indent=3),
+        "json": json.dumps(prune_events(events)),
+        "table, lookup columns": encode_events(events)[0],
+        "table, report columns": encode_events(events, REPORT_COLUMNS)[0],
+    }
+    for name, listing in listings.items():
+        print(f"{name:>22}: {len(listing):>6} characters, ~{approximate_tokens([ToolMessage(content=listing, tool_call_id='')]):>5} tokens")
+    print(listings["table, lookup columns"][:300])
+
+if __name__ == "__main__":
+    main()
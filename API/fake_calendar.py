@@ -0,0 +1,449 @@
+import datetime
+import email
+import gzip
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+SERVER_FIELDS = {"kind", "id", "etag", "htmlLink", "iCalUID", "created", "updated", "creator", "organizer", "sequence", "_seq"} # Kept by a PUT
+
+class FakeCalendar:
+    """Local stand-in for the Google Calendar v3 REST API, used for offline benchmarks
+
+    Serves the subset of `events` endpoints the tools rely on from an in-memory calendar,
+    with configurable per-request latency and a counter of every call made against it.
+    Also stands in for the OAuth token endpoint: once credentials have been issued with
+    `issue_credentials`, requests need an unexpired access token, and are counted per user."""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1"):
+        self.latency = latency
+        self.lose_responses = 0.0 # Fraction of inserts applied but answered with a 503, as when a response is lost on the way back
+        self._rng = random.Random(0)
+        self.calls = Counter() # Calendar operations, by method
+        self.round_trips = 0 # HTTP requests, a batch counts once
+        self.connections = 0 # TCP connections accepted
+        self.bytes_sent = 0 # Response bodies, after compression
+        self._events: dict[str, dict] = {}
+        self._busy: dict[str, list[tuple[str, str]]] = {} # Calendar ID -> busy (start, end) for calendars other than primary
+        self._seq = 0
+        self._lock = threading.Lock()
+
+        self.requests_by_user = Counter() # Calendar requests per user, by the access token they carried
+        self._tokens: dict[str, tuple[str, float]] = {} # Access token -> (user, expiry epoch seconds)
+        self._refresh_tokens: dict[str, str] = {} # Refresh token -> user
+        self.token_lifetime = 3600 # Seconds, for tokens issued on refresh
+
+        self._server = _Server((host, 0), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to pass as the `api_endpoint` of a Calendar client"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/calendar/v3/"
+
+    @property
+    def token_url(self) -> str:
+        """URL to use as the `token_uri` of credentials issued by this server"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/token"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    __enter__ = lambda self: self.start()
+    __exit__ = lambda self, *exc: self.stop()
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+        self.round_trips = 0
+        self.bytes_sent = 0
+
+    # Calendar state
+
+    def seed(self, events: list[dict]):
+        """Insert events directly, without counting API calls"""
+        for event in events:
+            self._insert(dict(event))
+
+    def seed_busy(self, calendar_id: str, busy: list[tuple[str, str]]):
+        """Sets the busy times (RFC3339 start, end) that `freeBusy` reports for another user's calendar"""
+        self._busy[calendar_id] = list(busy)
+
+    def _stamp(self, event: dict) -> dict:
+        self._seq += 1
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+        event.setdefault("created", now)
+        event["updated"] = now
+        event["etag"] = f'"{self._seq}"'
+        event["_seq"] = self._seq
+        return event
+
+    def _insert(self, body: dict) -> dict:
+        with self._lock:
+            event_id = body.get("id") or uuid.uuid4().hex
+            if event_id in self._events and self._events[event_id]["status"] != "cancelled":
+                raise _HttpError(409, "The requested identifier already exists.")
+            event = {
+                "kind": "calendar#event",
+                "id": event_id,
+                "status": "confirmed",
+                "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+                "iCalUID": f"{event_id}@google.com",
+                "sequence": 0,
+                "creator": {"email": "user@example.com", "self": True},
+                "organizer": {"email": "user@example.com", "self": True},
+                "reminders": {"useDefault": True},
+                **body,
+            }
+            event["id"] = event_id
+            event["status"] = body.get("status", "confirmed")
+            self._events[event_id] = self._stamp(event)
+            return _public(event)
+
+    def _update(self, event_id: str, body: dict, replace: bool = False) -> dict:
+        """Changes an event: `body` merged into it as PATCH does, or replacing every property the server doesn't own as
+        PUT does, so properties left out of a PUT body are cleared. Either way, properties set to null are cleared"""
+
+        with self._lock:
+            current = self._events.get(event_id)
+            if current is None or current["status"] == "cancelled":
+                raise _HttpError(404, "Not Found")
+            kept = {key: value for key, value in current.items() if key in SERVER_FIELDS} if replace else current
+            event = {**kept, **body, "id": event_id, "status": body.get("status", current["status"]), "sequence": current["sequence"] + 1}
+            event = {key: value for key, value in event.items() if value is not None} # A null clears the property
+            self._events[event_id] = self._stamp(event)
+            return _public(event)
+
+    def _delete(self, event_id: str):
+        with self._lock:
+            current = self._events.get(event_id)
+            if current is None or current["status"] == "cancelled":
+                raise _HttpError(410 if current else 404, "Resource has been deleted" if current else "Not Found")
+            self._events[event_id] = self._stamp({**current, "status": "cancelled"})
+
+    def _get(self, event_id: str) -> dict:
+        event = self._events.get(event_id)
+        if event is None:
+            raise _HttpError(404, "Not Found")
+        return _public(event)
+
+    def _list(self, params: dict) -> dict:
+        with self._lock:
+            events = sorted(self._events.values(), key=lambda e: (_start(e), e["id"]))
+
+        sync_token = params.get("syncToken")
+        if sync_token is not None:
+            if not sync_token.isdigit() or int(sync_token) > self._seq:
+                raise _HttpError(410, "Sync token is no longer valid, a full sync is required.")
+            events = [e for e in events if e["_seq"] > int(sync_token)]
+        else:
+            if params.get("showDeleted") != "true": # The API still lists cancelled instances of a series when not expanding it
+                events = [e for e in events if e["status"] != "cancelled" or (e.get("recurringEventId") and params.get("singleEvents") != "true")]
+            if "timeMin" in params:
+                time_min = _parse(params["timeMin"])
+                events = [e for e in events if _end(e) > time_min]
+            if "timeMax" in params:
+                time_max = _parse(params["timeMax"])
+                events = [e for e in events if _start(e) < time_max]
+            if params.get("orderBy") == "updated":
+                events.sort(key=lambda e: e["updated"])
+
+        # Paginate
+        offset = int(params.get("pageToken", 0))
+        page_size = min(int(params.get("maxResults", 250)), 2500)
+        page = events[offset:offset + page_size]
+
+        result = {"kind": "calendar#events", "items": [_public(e) for e in page]}
+        if offset + page_size < len(events):
+            result["nextPageToken"] = str(offset + page_size)
+        else:
+            result["nextSyncToken"] = str(self._seq)
+        return result
+
+    def _freebusy(self, body: dict) -> dict:
+        time_min, time_max = _parse(body["timeMin"]), _parse(body["timeMax"])
+        calendars = {}
+        for item in body.get("items", []):
+            calendar_id = item["id"]
+            if calendar_id in ("primary", "user@example.com"):
+                with self._lock:
+                    busy = [(_start(e), _end(e)) for e in self._events.values() if e["status"] != "cancelled" and e.get("transparency") != "transparent"]
+            elif calendar_id in self._busy:
+                busy = [(_parse(start), _parse(end)) for start, end in self._busy[calendar_id]]
+            else:
+                calendars[calendar_id] = {"errors": [{"domain": "global", "reason": "notFound"}], "busy": []}
+                continue
+            calendars[calendar_id] = {"busy": [
+                {"start": _format(max(start, time_min)), "end": _format(min(end, time_max))}
+                for start, end in sorted(busy) if end > time_min and start < time_max
+            ]}
+        return {"kind": "calendar#freeBusy", "timeMin": body["timeMin"], "timeMax": body["timeMax"], "calendars": calendars}
+
+    # OAuth
+
+    def issue_credentials(self, user: str, expires_in: float = 3600) -> dict:
+        """Issues an access and refresh token for a user, as the authorization flow would; turns on token checks"""
+
+        with self._lock:
+            token, refresh_token = f"access-{uuid.uuid4().hex}", f"refresh-{uuid.uuid4().hex}"
+            self._tokens[token] = (user, time.time() + expires_in)
+            self._refresh_tokens[refresh_token] = user
+        expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(seconds=expires_in)
+        return {"token": token, "refresh_token": refresh_token, "expiry": expiry}
+
+    def handle_token(self, form: dict) -> tuple[int, dict]:
+        """Serves a refresh token grant, returns (status, payload)"""
+
+        time.sleep(self.latency)
+        with self._lock:
+            self.round_trips += 1
+            self.calls["oauth.refresh"] += 1
+            user = self._refresh_tokens.get(form.get("refresh_token"))
+            if form.get("grant_type") != "refresh_token" or user is None:
+                return 400, {"error": "invalid_grant"}
+            token = f"access-{uuid.uuid4().hex}"
+            self._tokens[token] = (user, time.time() + self.token_lifetime)
+        return 200, {"access_token": token, "expires_in": self.token_lifetime, "token_type": "Bearer"}
+
+    def authorize(self, authorization: str | None) -> bool:
+        """Checks a request's bearer token, if any credentials have been issued, and counts the request for its user"""
+
+        if not self._refresh_tokens:
+            return True
+        token = (authorization or "").removeprefix("Bearer ")
+        with self._lock:
+            user, expiry = self._tokens.get(token, (None, 0.0))
+            if user is None or expiry < time.time():
+                return False
+            self.requests_by_user[user] += 1
+        return True
+
+    # HTTP routing
+
+    def handle(self, method: str, path: str, params: dict, body: dict | None, authorization: str = None):
+        """Serves one HTTP request, returns (status, payload)"""
+
+        with self._lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+        if not self.authorize(authorization):
+            return 401, {"error": {"code": 401, "message": "Invalid Credentials"}}
+        return self.dispatch(method, path, params, body)
+
+    def handle_batch(self, content_type: str, raw: bytes, authorization: str = None) -> tuple[str, bytes]:
+        """Serves a multipart/mixed batch request in a single round-trip, returns (content type, body)"""
+
+        with self._lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+        if not self.authorize(authorization):
+            return None, None
+
+        message = email.message_from_bytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw)
+        boundary = uuid.uuid4().hex
+        out = []
+        for part in message.get_payload():
+            request = part.get_payload()
+            request_line, rest = request.split("\n", 1)
+            method, target, _ = request_line.split(" ")
+            headers, _, content = rest.replace("\r\n", "\n").partition("\n\n")
+            url = urlparse(target)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+            status, payload = self.dispatch(method, url.path, params, json.loads(content) if content.strip() else None)
+
+            content_id = part["Content-ID"].replace("\r\n", "").replace("\n", "").strip("<>") # Unfolded, as long IDs come folded
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{'' if payload is None else json.dumps(payload)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(out).encode()
+
+    def dispatch(self, method: str, path: str, params: dict, body: dict | None):
+        """Routes a request to the matching Calendar operation, returns (status, payload)"""
+
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        if parts == ["calendar", "v3", "freeBusy"] and method == "POST":
+            self.calls["freebusy.query"] += 1
+            return 200, self._freebusy(body or {})
+
+        # Expected shape: calendar/v3/calendars/{calendarId}/events[/{eventId}]
+        if parts[:3] != ["calendar", "v3", "calendars"] or len(parts) < 5 or parts[4] != "events":
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        event_id = parts[5] if len(parts) > 5 else None
+
+        try:
+            if method == "GET" and event_id is None:
+                self.calls["events.list"] += 1
+                return 200, _select(self._list(params), params.get("fields"))
+            if method == "GET":
+                self.calls["events.get"] += 1
+                return 200, _select(self._get(event_id), params.get("fields"))
+            if method == "POST" and event_id is None:
+                self.calls["events.insert"] += 1
+                event = self._insert(body or {})
+                if self._rng.random() < self.lose_responses:
+                    return 503, {"error": {"code": 503, "message": "Backend Error"}}
+                return 200, event
+            if method == "PUT":
+                self.calls["events.update"] += 1
+                return 200, self._update(event_id, body or {}, replace=True)
+            if method == "PATCH":
+                self.calls["events.patch"] += 1
+                return 200, self._update(event_id, body or {})
+            if method == "DELETE":
+                self.calls["events.delete"] += 1
+                self._delete(event_id)
+                return 204, None
+        except _HttpError as error:
+            return error.status, {"error": {"code": error.status, "message": error.message}}
+
+        return 405, {"error": {"code": 405, "message": "Method Not Allowed"}}
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # Many clients connecting at once, each keeping its connection open
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError): # Clients that hang up mid-response are expected, e.g. on a timeout
+            super().handle_error(request, client_address)
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        self.status = status
+        self.message = message
+
+def _make_handler(calendar: FakeCalendar):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with calendar._lock:
+                calendar.connections += 1
+
+        def _respond(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+
+            authorization = self.headers.get("Authorization")
+            if url.path == "/token":
+                status, payload = calendar.handle_token({k: v[-1] for k, v in parse_qs(raw.decode()).items()})
+                content_type, data = "application/json; charset=UTF-8", json.dumps(payload).encode()
+            elif url.path.startswith("/batch/"):
+                status = 200
+                content_type, data = calendar.handle_batch(self.headers["Content-Type"], raw, authorization)
+                if content_type is None:
+                    status, content_type, data = 401, "application/json; charset=UTF-8", b'{"error": {"code": 401, "message": "Invalid Credentials"}}'
+            else:
+                status, payload = calendar.handle(self.command, url.path, params, json.loads(raw) if raw else None, authorization)
+                content_type, data = "application/json; charset=UTF-8", b"" if payload is None else json.dumps(payload).encode()
+
+            compress = len(data) > 1024 and "gzip" in self.headers.get("Accept-Encoding", "")
+            if compress:
+                data = gzip.compress(data, compresslevel=5)
+            with calendar._lock:
+                calendar.bytes_sent += len(data)
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if compress:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+# Helpers
+
+def _public(event: dict) -> dict:
+    return {k: v for k, v in event.items() if not k.startswith("_")}
+
+def _select(payload, fields: str | None):
+    """Applies a partial-response `fields` selector (e.g. "nextPageToken,items(id,start)") to a response"""
+
+    if not fields:
+        return payload
+    tree, stack, name = {}, [], ""
+    for char in fields + ",":
+        if char not in ",()":
+            name += char
+            continue
+        name = name.strip()
+        if name:
+            tree[name] = {}
+        if char == "(":
+            stack.append(tree)
+            tree = tree[name]
+        elif char == ")":
+            tree = stack.pop()
+        name = ""
+    return _project(payload, tree)
+
+def _project(value, tree: dict):
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+def _parse(value: str) -> datetime.datetime:
+    if len(value) == 10: # All-day date
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _format(moment: datetime.datetime) -> str:
+    return moment.astimezone(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _start(event: dict) -> datetime.datetime:
+    start = event.get("start", {})
+    return _parse(start.get("dateTime") or start.get("date") or "1970-01-01")
+
+def _end(event: dict) -> datetime.datetime:
+    end = event.get("end", {})
+    return _parse(end.get("dateTime") or end.get("date") or "1970-01-01")
+
+def make_events(n: int, days: int = 30, start: datetime.datetime = None) -> list[dict]:
+    """Generates `n` synthetic hour-long events spread evenly across `days` days"""
+
+    start = start or datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    step = datetime.timedelta(days=days) / max(n, 1)
+    events = []
+    for i in range(n):
+        begin = start + step * i
+        events.append({
+            "id": f"evt{i:05d}",
+            "summary": f"Event {i}",
+            "start": {"dateTime": begin.isoformat(), "timeZone": "UTC"},
+            "end": {"dateTime": (begin + datetime.timedelta(hours=1)).isoformat(), "timeZone": "UTC"},
+        })
+    return events
@@ -0,0 +1,184 @@
+import asyncio
+import datetime
+import json
+import time
+import uuid
+from collections import Counter
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import Field
+
+SCHEMA_FIELDS = {"helper_agent": "IndigoOutput", "selection": "SelectOutput"} # A field only that schema has -> schema, for JSON output
+
+class FakeChatModel(BaseChatModel):
+    """Scripted stand-in for the Gemini chat model, used for offline benchmarks
+
+    Answers each agent's call with a plausible, deterministic response (routing, queries, selections, edits)
+    after a fixed latency, sleeping with `asyncio.sleep` on the async path so concurrency behaves like a real
+    network-bound model. Streamed calls send text a token at a time, and a tool call in one chunk once all its
+    arguments are generated, as Gemini's streaming API does. Calls asking for JSON output with a response schema (in
+    `generation_config`) get the reply as JSON text. Every call is counted by the tool or schema it was asked to produce."""
+
+    latency: float = 0.0
+    token_latency: float = 0.0 # Extra seconds per prompt token (about 4 characters), as longer prompts take longer to process
+    output_latency: float = 0.0 # Seconds per generated token, after the first arrives
+    calls: Counter = Field(default_factory=Counter)
+    prompt_bytes: int = 0 # Prompt sent with requests: messages, tools and tool choice
+    cached_bytes: int = 0 # Prompt served from cached content instead of being sent
+    caches: dict = Field(default_factory=dict) # Cached content name -> (system message, tools, tool choice)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], tool_choice=tool_choice, **kwargs)
+
+    def create_cached_content(self, contents: list[BaseMessage], *, tools=None, tool_choice=None, ttl=None, display_name=None) -> str:
+        """Stand-in for Gemini context caching: keeps the system message and tools, to be referenced by `cached_content`"""
+
+        name = f"cachedContents/{uuid.uuid4().hex}"
+        system = next((m for m in contents if isinstance(m, SystemMessage)), None)
+        self.caches[name] = (system, [convert_to_openai_tool(t) for t in tools or []], tool_choice)
+        return name
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.reply(messages, kwargs)
+        time.sleep(self.latency + self.token_latency * _size(messages) / 4 + self.output_latency * (_output_tokens(message) - 1))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.reply(messages, kwargs)
+        await asyncio.sleep(self.latency + self.token_latency * _size(messages) / 4 + self.output_latency * (_output_tokens(message) - 1))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs):
+        message = self.reply(messages, kwargs)
+        time.sleep(self.latency + self.token_latency * _size(messages) / 4)
+        for i, (tokens, chunk) in enumerate(_chunks(message)):
+            time.sleep(self.output_latency * (tokens if i else tokens - 1))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs):
+        message = self.reply(messages, kwargs)
+        await asyncio.sleep(self.latency + self.token_latency * _size(messages) / 4)
+        for i, (tokens, chunk) in enumerate(_chunks(message)):
+            await asyncio.sleep(self.output_latency * (tokens if i else tokens - 1))
+            yield ChatGenerationChunk(message=chunk)
+
+    def reply(self, messages: list[BaseMessage], kwargs: dict) -> AIMessage:
+        """The scripted reply to a request, as JSON text if it asked for output matching a response schema"""
+
+        messages, tools = self.resolve(messages, kwargs)
+        schema = (kwargs.get("generation_config") or {}).get("response_schema")
+        if schema is None:
+            return self.respond(messages, tools)
+        name = next(name for field, name in SCHEMA_FIELDS.items() if field in schema["properties"])
+        message = self.respond(messages, [{"function": {"name": name}}])
+        return AIMessage(content=json.dumps(message.tool_calls[0]["args"], sort_keys=True)) # Gemini orders a schema's properties alphabetically
+
+    def resolve(self, messages: list[BaseMessage], kwargs: dict) -> tuple[list[BaseMessage], list[dict]]:
+        """The full prompt and tools of a request, with any cached content filled back in. Counts bytes sent and cached"""
+
+        tools = kwargs.get("tools")
+        self.prompt_bytes += _size(messages) + len(json.dumps(tools or [])) + len(str(kwargs.get("tool_choice") or ""))
+        self.prompt_bytes += len(json.dumps(kwargs.get("generation_config") or {}))
+        if kwargs.get("cached_content"):
+            system, tools, tool_choice = self.caches[kwargs["cached_content"]]
+            self.cached_bytes += _size([system] if system else []) + len(json.dumps(tools)) + len(str(tool_choice or ""))
+            messages = ([system] if system else []) + messages
+        return messages, tools
+
+    def respond(self, messages: list[BaseMessage], tools: list[dict] = None) -> AIMessage:
+        """Produces the scripted reply for whichever agent node is calling"""
+
+        names = [t["function"]["name"] for t in tools or []]
+        self.calls[names[0] if names else "text"] += 1
+        request = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        if "IndigoOutput" in names:
+            # Route only on a fresh user message; once a helper agent has reported back, reply to the user
+            helper_agent = route(request) if isinstance(messages[-1], HumanMessage) else "none"
+            return _call("IndigoOutput", {"message": f"On it ({request})", "helper_agent": helper_agent}) # Never a question, so no reply reads as its answer
+
+        if "list_events" in names:
+            return _call("list_events", {
+                "timeMin": now.isoformat(), "timeMax": (now + datetime.timedelta(days=1)).isoformat(), "singleEvents": True
+            })
+
+        if "SelectOutput" in names:
+            candidates = [e["id"] for e in _last_json(messages, ToolMessage) if isinstance(e, dict)] or _last_refs(messages)
+            return _call("SelectOutput", {"selection": candidates[:2]})
+
+        if "add_event" in names:
+            start = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+            return _call("add_event", {
+                "summary": request[:40], "startTime": start.isoformat(),
+                "endTime": (start + datetime.timedelta(hours=1)).isoformat(), "timeZone": "UTC"
+            })
+
+        if "update_event" in names:
+            selected = _last_json(messages, AIMessage)
+            if not selected:
+                return _call("update_event", {})
+            return _call("update_event", {"event_body": json.dumps({**selected[0], "summary": "Moved"})})
+
+        return AIMessage(content="Busy Times, next 10 days (UTC timezone):\n\n* **12:00-13:00, 2025-02-09** (Lunch)")
+
+def route(request: str) -> str:
+    """Keyword routing used by the fake Indigo node"""
+
+    words = request.lower().split()
+    if any(w in words for w in ("add", "schedule", "book")):
+        return "event_initializer"
+    if any(w in words for w in ("move", "push", "delete", "cancel", "change", "reschedule")):
+        return "event_editor"
+    if any(w in words for w in ("what", "when", "show", "what's")):
+        return "event_lookup"
+    return "none"
+
+def _size(messages: list[BaseMessage]) -> int:
+    return sum(len(str(m.content)) + len(json.dumps(getattr(m, "tool_calls", None) or [])) for m in messages)
+
+def _chunks(message: AIMessage) -> list[tuple[int, AIMessageChunk]]:
+    """A reply as the chunks a streamed call sends, each with the tokens it took to generate: its text about 4 characters
+    at a time, or its tool call whole, once all its JSON arguments (about 4 characters a token) are generated"""
+
+    if not message.tool_calls:
+        text = str(message.content)
+        return [(1, AIMessageChunk(content=text[i:i + 4])) for i in range(0, len(text), 4)] or [(1, AIMessageChunk(content=""))]
+    call = message.tool_calls[0]
+    args = json.dumps(call["args"])
+    return [(max(1, -(-len(args) // 4)), AIMessageChunk(content="", tool_call_chunks=[{"name": call["name"], "args": args, "id": call["id"], "index": 0}]))]
+
+def _output_tokens(message: AIMessage) -> int:
+    return sum(tokens for tokens, _ in _chunks(message))
+
+def _call(name: str, args: dict[str, Any]) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": uuid.uuid4().hex}])
+
+def _last_refs(messages: list[BaseMessage]) -> list[str]:
+    """The event references in the most recent tool message, if it holds a compact table (see `event_table`)"""
+
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            lines = str(message.content).splitlines()
+            return [line.split("|", 1)[0] for line in lines[2:]] if len(lines) > 1 and lines[1].startswith("ref|") else []
+    return []
+
+def _last_json(messages: list[BaseMessage], kind: type) -> list:
+    """Parses the JSON list in the most recent message of the given type, empty if there isn't one"""
+
+    for message in reversed(messages):
+        if isinstance(message, kind) and message.content:
+            try:
+                parsed = json.loads(message.content)
+            except ValueError:
+                return []
+            return parsed if isinstance(parsed, list) else []
+    return []
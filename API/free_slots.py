@@ -0,0 +1,202 @@
+import datetime
+
+import numpy as np
+
+DAY = 86400
+
+def find_free_windows(busy_starts: np.ndarray, busy_ends: np.ndarray, first_day: datetime.date, days: int, timezone: datetime.tzinfo,
+                      hours: list[tuple[int, int]] = [(7 * 60, 22 * 60)], weekdays: set[int] = None, duration: int = 60,
+                      buffer: int = 0, granularity: int = 15) -> tuple[np.ndarray, np.ndarray]:
+    """Finds every free window long enough for a slot of `duration` minutes, across `days` days from `first_day`
+
+    `hours` are the working-hour windows of each day, as (start, end) minutes after local midnight, and `weekdays`
+    optionally limits the search to some days of the week (0 is Monday). Busy times (epoch seconds) are padded by
+    `buffer` minutes on both sides, and window starts are rounded up to the next multiple of `granularity` minutes on
+    the local clock. Returns the (start, end) epoch seconds of each free window, in order.
+
+    Everything after laying out the working windows is interval arithmetic on arrays, so the whole range is searched
+    at once rather than day by day."""
+
+    work_starts, work_ends, offsets = working_windows(first_day, days, timezone, hours, weekdays)
+    if not len(work_starts):
+        return np.empty(0), np.empty(0)
+    busy_starts, busy_ends = merge_intervals(np.asarray(busy_starts, dtype=np.float64) - buffer * 60, np.asarray(busy_ends, dtype=np.float64) + buffer * 60)
+
+    # Busy blocks overlapping each working window are [lo, hi), leaving hi - lo + 1 gaps around them
+    lo = np.searchsorted(busy_ends, work_starts, side="right")
+    hi = np.searchsorted(busy_starts, work_ends, side="left")
+    counts = hi - lo + 1
+    window = np.repeat(np.arange(len(work_starts)), counts)
+    gap = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) # Index of each gap within its window
+    block = lo[window] + gap
+
+    # A gap runs from the end of the block before it (or the window start) to the start of the block after it (or the window end)
+    last = max(len(busy_starts) - 1, 0)
+    previous_end = busy_ends[np.clip(block - 1, 0, last)] if len(busy_ends) else work_starts[window]
+    next_start = busy_starts[np.clip(block, 0, last)] if len(busy_starts) else work_ends[window]
+    starts = np.maximum(np.where(gap == 0, work_starts[window], previous_end), work_starts[window])
+    ends = np.minimum(np.where(gap == counts[window] - 1, work_ends[window], next_start), work_ends[window])
+
+    # Round starts up to the granularity on the local clock, then keep the windows a slot still fits in
+    step = granularity * 60
+    starts = np.ceil((starts + offsets[window]) / step) * step - offsets[window]
+    fits = starts + duration * 60 <= ends
+    return starts[fits], ends[fits]
+
+def candidate_slots(starts: np.ndarray, ends: np.ndarray, duration: int = 60, granularity: int = 15) -> np.ndarray:
+    """Every slot start, `granularity` minutes apart, at which `duration` minutes fit in one of the free windows"""
+
+    step = granularity * 60
+    counts = ((ends - starts - duration * 60) // step).astype(np.int64) + 1
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets * step
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Sorts intervals and merges the overlapping or touching ones"""
+
+    if not len(starts):
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, reach = starts[order], np.maximum.accumulate(ends[order])
+    first = np.empty(len(starts), dtype=bool)
+    first[0] = True
+    first[1:] = starts[1:] > reach[:-1]
+    last = np.append(np.flatnonzero(first)[1:] - 1, len(starts) - 1)
+    return starts[first], reach[last]
+
+def busy_intervals(events: list[dict], timezone: datetime.tzinfo) -> tuple[np.ndarray, np.ndarray]:
+    """Epoch second (start, end) arrays for the events that make the user busy. All-day events span their local days"""
+
+    starts, ends = [], []
+    for event in events:
+        if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+            continue
+        start, end = event.get("start", {}), event.get("end", {})
+        if "dateTime" in start:
+            starts.append(_timestamp(start["dateTime"]))
+            ends.append(_timestamp(end["dateTime"]))
+        elif "date" in start:
+            first = datetime.date.fromisoformat(start["date"])
+            last = datetime.date.fromisoformat(end["date"]) if "date" in end else first + datetime.timedelta(days=1)
+            starts.append(datetime.datetime.combine(first, datetime.time(), timezone).timestamp())
+            ends.append(datetime.datetime.combine(last, datetime.time(), timezone).timestamp())
+    return np.array(starts, dtype=np.float64), np.array(ends, dtype=np.float64)
+
+def working_windows(first_day: datetime.date, days: int, timezone, hours: list[tuple[int, int]], weekdays: set[int] = None):
+    """Epoch second (start, end) arrays of every working window in the range, with the local UTC offset of each"""
+
+    # One timezone lookup per day; days a clock change falls on have their windows placed exactly further down
+    dates = [first_day + datetime.timedelta(days=i) for i in range(days + 1)]
+    midnights = np.array([datetime.datetime.combine(date, datetime.time(), timezone).timestamp() for date in dates])
+    day_offsets = np.array([date.toordinal() - datetime.date(1970, 1, 1).toordinal() for date in dates]) * DAY - midnights
+
+    hours = np.array(sorted(hours), dtype=np.float64).reshape(-1, 2) * 60
+    keep = np.ones(days, dtype=bool) if weekdays is None else np.isin([date.weekday() for date in dates[:-1]], list(weekdays))
+    day = np.repeat(np.flatnonzero(keep), len(hours))
+    starts = midnights[day] + np.tile(hours[:, 0], keep.sum())
+    ends = midnights[day] + np.tile(hours[:, 1], keep.sum())
+    offsets = day_offsets[day]
+
+    for i in np.flatnonzero(day_offsets[day] != day_offsets[day + 1]).tolist():
+        date, (start, end) = dates[day[i]], hours[i % len(hours)]
+        starts[i] = (datetime.datetime.combine(date, datetime.time(), timezone) + datetime.timedelta(seconds=start)).timestamp()
+        ends[i] = (datetime.datetime.combine(date, datetime.time(), timezone) + datetime.timedelta(seconds=end)).timestamp()
+    return starts, ends, offsets
+
+def _timestamp(value: str) -> float:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+# TESTING
+
+def find_times_loop(busy: list[tuple], date: datetime.date, timezone, duration: int, start_time: float = 7.0, end_time: float = 22.0) -> list[tuple]:
+    """The single-day loop from `GcalScraper.find_times` (deprecated/gcal_scraper.py), on datetimes, as a reference"""
+
+    busy = sorted(busy, key=lambda x: x[0])
+    day = datetime.datetime.combine(date, datetime.time(), timezone)
+    work_start_time = day.replace(hour=int(start_time), minute=int((start_time - int(start_time)) * 60))
+    work_end_time = day.replace(hour=int(end_time), minute=int((end_time - int(end_time)) * 60))
+    duration_delta = datetime.timedelta(minutes=duration)
+
+    available_times = []
+    current_time = work_start_time
+    for busy_start, busy_end in busy:
+        if busy_start > current_time:
+            if busy_start - current_time >= duration_delta:
+                available_times.append((current_time, busy_start))
+        current_time = max(current_time, busy_end)
+    if work_end_time > current_time and work_end_time - current_time >= duration_delta:
+        available_times.append((current_time, work_end_time))
+    return available_times
+
+def main():
+    """Property checks against the old per-day loop, then timings for ranges of up to 365 days"""
+
+    import random
+    import time
+    import tzlocal
+    from zoneinfo import ZoneInfo
+
+    # Random calendars in a timezone with clock changes; whole-minute times and 1-minute granularity make the two comparable
+    timezone = ZoneInfo("America/New_York")
+    rng = random.Random(0)
+    first_day = datetime.date(2025, 2, 20) # The range covers the March clock change
+    for trial in range(300):
+        days = rng.randint(1, 30)
+        duration = rng.choice([15, 30, 45, 60, 90, 120])
+        start_time, end_time = rng.choice([(7.0, 22.0), (9.0, 17.0), (8.5, 18.25)])
+        busy = []
+        for _ in range(rng.randint(0, days * 8)):
+            day = datetime.datetime.combine(first_day + datetime.timedelta(days=rng.randrange(days)), datetime.time(), timezone)
+            start = day + datetime.timedelta(minutes=rng.randrange(0, 24 * 60 - 30))
+            busy.append((start, min(start + datetime.timedelta(minutes=rng.choice([15, 30, 60, 90, 180])), day + datetime.timedelta(days=1))))
+
+        starts, ends = find_free_windows(
+            np.array([s.timestamp() for s, _ in busy]), np.array([e.timestamp() for _, e in busy]), first_day, days, timezone,
+            hours=[(int(start_time * 60), int(end_time * 60))], duration=duration, granularity=1
+        )
+        found = list(zip(starts.tolist(), ends.tolist()))
+
+        expected = []
+        for i in range(days):
+            date = first_day + datetime.timedelta(days=i)
+            day_busy = [(s, e) for s, e in busy if s.date() == date]
+            work_end = datetime.datetime.combine(date, datetime.time(), timezone).replace(hour=int(end_time), minute=int((end_time % 1) * 60))
+            for start, end in find_times_loop(day_busy, date, timezone, duration, start_time, end_time):
+                end = min(end, work_end) # The loop lets a window run past the working day when the next event starts after it
+                if end - start >= datetime.timedelta(minutes=duration):
+                    expected.append((start.timestamp(), end.timestamp()))
+        assert found == expected, (trial, found, expected)
+    print("Matches the per-day loop on 300 random calendars")
+
+    # Buffers and granularity: no candidate slot may come within `buffer` of a busy time, and all start on the grid
+    for trial in range(100):
+        busy_starts = np.sort(np.random.default_rng(trial).uniform(0, 30 * DAY, 100)) + datetime.datetime(2025, 3, 1, tzinfo=timezone).timestamp()
+        busy_ends = busy_starts + np.random.default_rng(trial + 1).uniform(600, 7200, 100)
+        starts, ends = find_free_windows(busy_starts, busy_ends, datetime.date(2025, 3, 1), 30, timezone, duration=30, buffer=10, granularity=15)
+        slots = candidate_slots(starts, ends, duration=30, granularity=15)
+        local = np.array([datetime.datetime.fromtimestamp(s, timezone).minute for s in slots.tolist()])
+        assert np.all(local % 15 == 0)
+        clash = (slots[:, None] < busy_ends[None, :] + 600) & (slots[:, None] + 1800 > busy_starts[None, :] - 600)
+        assert not clash.any(), trial
+    print("Candidate slots respect buffers and granularity on 100 random calendars")
+
+    # Timings
+    timezone = tzlocal.get_localzone()
+    today = datetime.date.today()
+    print(f"{'days':>5} {'events':>7} {'windows':>8} {'slots':>7} {'time':>9} {'per day':>9}")
+    for days in (1, 7, 30, 90, 365):
+        rng = np.random.default_rng(days)
+        midnight = datetime.datetime.combine(today, datetime.time(), timezone).timestamp()
+        busy_starts = np.sort(rng.uniform(0, days * DAY, days * 8)) + midnight
+        busy_ends = busy_starts + rng.choice([1800, 3600, 5400], days * 8)
+        timings = []
+        for _ in range(200):
+            began = time.perf_counter()
+            starts, ends = find_free_windows(busy_starts, busy_ends, today, days, timezone, hours=[(9 * 60, 12 * 60), (13 * 60, 18 * 60)], buffer=10)
+            slots = candidate_slots(starts, ends)
+            timings.append(time.perf_counter() - began)
+        took = sorted(timings)[len(timings) // 2]
+        print(f"{days:>5} {days * 8:>7} {len(starts):>8} {len(slots):>7} {took * 1e6:>6.0f} us {took * 1e6 / days:>6.1f} us")
+
+if __name__ == "__main__":
+    main()
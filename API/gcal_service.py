@@ -1,56 +1,437 @@
+import asyncio
 import datetime
+import functools
+import json
 import os.path
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse, urlunparse
+import httplib2
+import orjson
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build, Resource
+from googleapiclient.discovery import build_from_document, Resource
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest, HttpRequest, MAX_URI_LENGTH
+from googleapiclient.model import JsonModel
+from transport import PooledHttp, async_session, token_session
 
 # Define the scope for Google Calendar API
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+BATCH_URI = "https://www.googleapis.com/batch/calendar/v3"
+MAX_BATCH_SIZE = 50 # Calendar API limit on requests per batch
+MAX_FREEBUSY_ITEMS = 50 # Calendar API limit on calendars per free/busy query
+INSERT_RETRIES = 3 # Times a bulk insert resends an event that failed transiently
+INSERT_CONCURRENCY = 10 # Inserts in flight at once from an async bulk insert
+PAGE_SIZE = 250 # Events per page when streaming a list query, the API's default
+_prefetcher = ThreadPoolExecutor(thread_name_prefix="calendar-prefetch") # Fetches the next page of `iter_events`, threads started on first use
+
+# Partial-response selector for event listings (and the store's syncs): the fields the tools, the store and the reports use,
+# and nothing `prune_events` would drop. Single-event reads get the whole resource, for anything that writes it back
+EVENT_FIELDS = "id,status,summary,description,location,colorId,start,end,recurrence,recurringEventId,originalStartTime,transparency,visibility,attendees,eventType,updated"
+LIST_FIELDS = f"nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
+
 class GoogleCalendarService:
-    """Wrapper class for building Google Calendar service"""
+    """Wrapper class for building Google Calendar service
+
+    Constructing one has no side effects: credentials are loaded (or the OAuth flow run) and the service built on
+    first use, so modules can create it at import time without touching the disk or the network. Requests go over
+    a connection pool shared by every service (see `transport`), so one service can be used from many threads."""
 
-    def __init__(self, creds=None):
+    def __init__(self, creds=None, api_endpoint: str = None, token_path: str = "token.json", pooled: bool = True):
         self.creds = creds
+        self.api_endpoint = api_endpoint # Overrides the Calendar API base URL, e.g. for a local fake server
+        self.token_path = token_path # Where credentials are loaded from and saved to, None if the caller keeps them
+        self.pooled = pooled # Send requests over the shared, thread-safe connection pool rather than a single httplib2 connection
         self._service: Resource = None
-        self.authenticate()
+        self._aio: AsyncCalendarService = None
+        self._lock = threading.Lock()
 
     def __getattr__(self, name):
         """Reroutes all other calls to Google service"""
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.service, name)
+
+    @property
+    def service(self) -> Resource:
+        """The Google service, authenticating and building it on first use"""
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    self.authenticate()
         if self._service is None:
             raise RuntimeError("Service not initialized. Make sure authentication succeeded.")
-        return getattr(self._service, name)
+        return self._service
+
+    @property
+    def aio(self) -> "AsyncCalendarService":
+        """Async version of this service, with the same surface"""
+        if self._aio is None:
+            self._aio = AsyncCalendarService(self)
+        return self._aio
 
     def authenticate(self):
         """Authenticates the user and initializes the Google Calendar API service."""
 
-        # The file token.json stores the user's access and refresh tokens.
-        if os.path.exists("token.json"):
-            self.creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+        self.creds = load_credentials(self.creds, self.token_path)
 
-        # If credentials are invalid or not present, prompt user for login
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-                self.creds = flow.run_local_server(port=0)
-            
-            # Save credentials in "token.json" for future use
-            with open("token.json", "w") as token:
-                token.write(self.creds.to_json())
-
-        # Instantiate service
+        # Instantiate service from the discovery document bundled with the client library, never fetched over the network
         try:
-            self._service = build("calendar", "v3", credentials=self.creds)
+            client_options = {"api_endpoint": self.api_endpoint} if self.api_endpoint else None
+            if self.pooled:
+                self._service = build_from_document(discovery_document(), http=PooledHttp(self.creds), model=FastJsonModel(), client_options=client_options)
+            else:
+                self._service = build_from_document(discovery_document(), credentials=self.creds, model=FastJsonModel(), client_options=client_options)
         except HttpError as error:
             print(f"An error occurred: {error}")
 
+    def new_batch_http_request(self, callback=None) -> BatchHttpRequest:
+        """Creates a batch request against this service's endpoint (the discovery document's batch URI ignores `api_endpoint`)"""
+        batch_uri = urljoin(self.api_endpoint, "/batch/calendar/v3") if self.api_endpoint else BATCH_URI
+        return BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+
+    def get_events(self, event_ids: list, calendar_id: str = "primary") -> dict:
+        """Fetches many events in one batched round-trip per 50 IDs. Returns a dict of event ID -> event, or the HttpError for that ID"""
+
+        results = {}
+        def collect(request_id, response, exception):
+            results[request_id] = exception if exception is not None else response
+
+        unique_ids = list(dict.fromkeys(event_ids))
+        for i in range(0, len(unique_ids), MAX_BATCH_SIZE):
+            batch = self.new_batch_http_request(callback=collect)
+            for event_id in unique_ids[i:i + MAX_BATCH_SIZE]:
+                batch.add(self.events().get(calendarId=calendar_id, eventId=event_id), request_id=event_id)
+            batch.execute()
+        return results
+
+    def iter_events(self, params: dict, page_size: int = PAGE_SIZE):
+        """Yields the events matching a list query (ListQuery params) a page at a time, fetching the next page while the
+        current one is consumed. `maxResults` caps the events yielded in all; stop iterating to stop fetching"""
+
+        params, remaining = {**params}, params.get("maxResults")
+        params.pop("maxResults", None)
+        fetch = lambda page_token, size: self.events().list(**params, maxResults=size, pageToken=page_token, fields=LIST_FIELDS).execute()
+
+        page = _prefetcher.submit(fetch, None, min(page_size, remaining or page_size))
+        try:
+            while page is not None:
+                result = page.result()
+                items = result.get("items", [])[:remaining]
+                if remaining is not None:
+                    remaining -= len(items)
+                page_token = result.get("nextPageToken")
+                page = _prefetcher.submit(fetch, page_token, min(page_size, remaining or page_size)) if page_token and remaining != 0 else None
+                yield from items
+        finally:
+            if page is not None:
+                page.cancel() # The consumer stopped early; a page already in flight is dropped when it arrives
+
+    def get_busy(self, calendar_ids: list, time_min: str, time_max: str, time_zone: str = None) -> dict:
+        """Fetches free/busy for many calendars, 50 per query and every query in one batched round-trip per 50 queries.
+        Returns a dict of calendar ID -> list of busy {start, end} periods, or the error for a calendar that couldn't be read"""
+
+        results = {}
+        def collect(request_id, response, exception):
+            for calendar_id, calendar in (response or {}).get("calendars", {}).items():
+                errors = calendar.get("errors")
+                results[calendar_id] = LookupError(", ".join(e.get("reason", "") for e in errors)) if errors else calendar.get("busy", [])
+            if exception is not None:
+                results.update({calendar_id: exception for calendar_id in queries[request_id]})
+
+        unique_ids = list(dict.fromkeys(calendar_ids))
+        queries = {str(i): unique_ids[i:i + MAX_FREEBUSY_ITEMS] for i in range(0, len(unique_ids), MAX_FREEBUSY_ITEMS)}
+        query_ids = list(queries)
+        for i in range(0, len(query_ids), MAX_BATCH_SIZE):
+            batch = self.new_batch_http_request(callback=collect)
+            for query_id in query_ids[i:i + MAX_BATCH_SIZE]:
+                body = {"timeMin": time_min, "timeMax": time_max, "items": [{"id": calendar_id} for calendar_id in queries[query_id]]}
+                if time_zone:
+                    body["timeZone"] = time_zone
+                batch.add(self.freebusy().query(body=body), request_id=query_id)
+            batch.execute()
+        return results
+
+    def insert_events(self, bodies: list[dict], calendar_id: str = "primary", retries: int = INSERT_RETRIES) -> dict:
+        """Inserts many events, in one batched round-trip per 50. Each body needs a client-generated `id` (see `new_event_id`),
+        so events that failed transiently are resent without risk of duplicates. Returns a dict of event ID -> event, or its error"""
+
+        results, pending = {}, {body["id"]: body for body in bodies}
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff(attempt))
+            failed, inserted = {}, [] # Retried later, and found already inserted by an attempt whose response was lost
+            def collect(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = response
+                elif attempt and isinstance(exception, HttpError) and exception.resp.status == 409:
+                    inserted.append(request_id)
+                elif attempt < retries and transient(exception):
+                    failed[request_id] = pending[request_id]
+                else:
+                    results[request_id] = exception
+
+            event_ids = list(pending)
+            for i in range(0, len(event_ids), MAX_BATCH_SIZE):
+                batch = self.new_batch_http_request(callback=collect)
+                for event_id in event_ids[i:i + MAX_BATCH_SIZE]:
+                    batch.add(self.events().insert(calendarId=calendar_id, body=pending[event_id]), request_id=event_id)
+                try:
+                    batch.execute()
+                except Exception as error: # The whole batch failed, e.g. a dropped connection
+                    for event_id in event_ids[i:i + MAX_BATCH_SIZE]:
+                        collect(event_id, None, error)
+
+            if inserted:
+                results.update(self.get_events(inserted, calendar_id))
+            pending = failed
+            if not pending:
+                break
+        return results
+
+class AsyncCalendarService:
+    """Async counterpart of a `GoogleCalendarService`: `await service.events().list(...).execute()`
+
+    Requests are built by the sync service's resources, which do no I/O, and sent with aiohttp over the running
+    loop's connection pool (see `transport.async_session`), so many calls can be awaited at once without threads."""
+
+    def __init__(self, sync: GoogleCalendarService):
+        self.sync = sync
+        self._refresh_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        """Reroutes all other calls to the sync service, wrapping the requests they build"""
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _AsyncResource(getattr(self.sync, name), self)
+
+    async def send(self, request: HttpRequest, retry: bool = True):
+        """Sends a request built by the sync service, returns its parsed response or raises HttpError as `execute` does"""
+
+        method, uri, body, headers = request.method, request.uri, request.body, dict(request.headers)
+        if len(uri) > MAX_URI_LENGTH and method == "GET": # Too long for a GET, sent as a POST as googleapiclient does
+            parsed = urlparse(uri)
+            method, uri, body = "POST", urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, None, None)), parsed.query
+            headers.update({"x-http-method-override": "GET", "content-type": "application/x-www-form-urlencoded"})
+
+        creds = self.sync.creds
+        if not creds.valid:
+            await asyncio.to_thread(self.refresh)
+        creds.apply(headers)
+
+        async with async_session().request(method, uri, data=body, headers=headers) as response:
+            content = await response.read()
+            info = {key.lower(): value for key, value in response.headers.items()}
+            info["status"] = str(response.status)
+
+        if response.status == 401 and retry and creds.refresh_token:
+            await asyncio.to_thread(self.refresh, True)
+            return await self.send(request, retry=False)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        if resp.status >= 300:
+            raise HttpError(resp, content, uri=uri)
+        return request.postproc(resp, content)
+
+    def refresh(self, force: bool = False):
+        """Refreshes the access token, once for all the calls that found it stale"""
+
+        with self._refresh_lock:
+            if force or not self.sync.creds.valid:
+                self.sync.creds.refresh(Request(token_session()))
+
+    async def iter_events(self, params: dict, page_size: int = PAGE_SIZE):
+        """Async version of `iter_events`; close the generator (e.g. with `contextlib.aclosing`) to stop fetching early"""
+
+        params, remaining = {**params}, params.get("maxResults")
+        params.pop("maxResults", None)
+        fetch = lambda page_token, size: self.events().list(**params, maxResults=size, pageToken=page_token, fields=LIST_FIELDS).execute()
+
+        page = asyncio.ensure_future(fetch(None, min(page_size, remaining or page_size)))
+        try:
+            while page is not None:
+                result = await page
+                items = result.get("items", [])[:remaining]
+                if remaining is not None:
+                    remaining -= len(items)
+                page_token = result.get("nextPageToken")
+                page = asyncio.ensure_future(fetch(page_token, min(page_size, remaining or page_size))) if page_token and remaining != 0 else None
+                for item in items:
+                    yield item
+        finally:
+            if page is not None:
+                page.cancel()
+
+    async def get_events(self, event_ids: list, calendar_id: str = "primary") -> dict:
+        """Fetches many events at once. Returns a dict of event ID -> event, or the error for that ID"""
+
+        unique_ids = list(dict.fromkeys(event_ids))
+        results = await asyncio.gather(
+            *(self.events().get(calendarId=calendar_id, eventId=event_id).execute() for event_id in unique_ids), return_exceptions=True
+        )
+        return dict(zip(unique_ids, results))
+
+    async def get_busy(self, calendar_ids: list, time_min: str, time_max: str, time_zone: str = None) -> dict:
+        """Fetches free/busy for many calendars, 50 per query and the queries at once.
+        Returns a dict of calendar ID -> list of busy {start, end} periods, or the error for a calendar that couldn't be read"""
+
+        unique_ids = list(dict.fromkeys(calendar_ids))
+        queries = [unique_ids[i:i + MAX_FREEBUSY_ITEMS] for i in range(0, len(unique_ids), MAX_FREEBUSY_ITEMS)]
+        def body(query):
+            body = {"timeMin": time_min, "timeMax": time_max, "items": [{"id": calendar_id} for calendar_id in query]}
+            return {**body, "timeZone": time_zone} if time_zone else body
+        responses = await asyncio.gather(*(self.freebusy().query(body=body(query)).execute() for query in queries), return_exceptions=True)
+
+        results = {}
+        for query, response in zip(queries, responses):
+            if isinstance(response, Exception):
+                results.update({calendar_id: response for calendar_id in query})
+                continue
+            for calendar_id, calendar in response.get("calendars", {}).items():
+                errors = calendar.get("errors")
+                results[calendar_id] = LookupError(", ".join(e.get("reason", "") for e in errors)) if errors else calendar.get("busy", [])
+        return results
+
+    async def insert_events(self, bodies: list[dict], calendar_id: str = "primary", retries: int = INSERT_RETRIES,
+                            concurrency: int = INSERT_CONCURRENCY) -> dict:
+        """Inserts many events, `concurrency` at a time, resending those that fail transiently under the same client-generated ID.
+        Returns a dict of event ID -> event, or its error"""
+
+        import aiohttp
+
+        semaphore = asyncio.Semaphore(concurrency)
+        async def insert(body):
+            async with semaphore:
+                for attempt in range(retries + 1):
+                    if attempt:
+                        await asyncio.sleep(backoff(attempt))
+                    try:
+                        return await self.events().insert(calendarId=calendar_id, body=body).execute()
+                    except Exception as error:
+                        if attempt and isinstance(error, HttpError) and error.resp.status == 409: # An earlier attempt went through
+                            return await self.events().get(calendarId=calendar_id, eventId=body["id"]).execute()
+                        if attempt == retries or not (transient(error) or isinstance(error, aiohttp.ClientConnectionError)):
+                            return error
+
+        results = await asyncio.gather(*(insert(body) for body in bodies), return_exceptions=True)
+        return {body["id"]: result for body, result in zip(bodies, results)}
+
+class _AsyncResource:
+    """A googleapiclient resource, or one of its methods, whose requests are sent by an `AsyncCalendarService`"""
+
+    def __init__(self, target, client: AsyncCalendarService):
+        self._target = target
+        self._client = client
+
+    def __getattr__(self, name):
+        return _AsyncResource(getattr(self._target, name), self._client)
+
+    def __call__(self, *args, **kwargs):
+        result = self._target(*args, **kwargs)
+        return _AsyncRequest(result, self._client) if isinstance(result, HttpRequest) else _AsyncResource(result, self._client)
+
+class _AsyncRequest:
+    def __init__(self, request: HttpRequest, client: AsyncCalendarService):
+        self.request = request
+        self._client = client
+
+    async def execute(self):
+        return await self._client.send(self.request)
+
+class FastJsonModel(JsonModel):
+    """googleapiclient's JSON model, parsing responses with orjson straight from the bytes received"""
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return content.decode("utf-8") if isinstance(content, bytes) else content
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
+
+def new_event_id() -> str:
+    """A client-generated event ID. Hex digits are valid base32hex, the alphabet Calendar requires"""
+    return uuid.uuid4().hex
+
+def transient(error: Exception) -> bool:
+    """Whether a failed request may go through if sent again: server errors, rate limits and dropped connections"""
+
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        return status >= 500 or status == 429 or (status == 403 and b"ratelimitexceeded" in (error.content or b"").lower())
+    return isinstance(error, (OSError, TimeoutError))
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before a retry, exponential with full jitter"""
+    return random.uniform(0, 0.25 * 2 ** attempt)
+
+def load_credentials(creds: Credentials = None, token_path: str = "token.json") -> Credentials:
+    """Loads credentials from `token_path` unless given, refreshing them or running the login flow if they aren't valid"""
+
+    # The file token.json stores the user's access and refresh tokens. Explicitly passed credentials take precedence.
+    if creds is None and token_path and os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+
+    # If credentials are invalid or not present, prompt user for login
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request(token_session()))
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+            creds = flow.run_local_server(port=0)
+
+        # Save credentials in "token.json" for future use
+        if token_path:
+            with open(token_path, "w") as token:
+                token.write(creds.to_json())
+    return creds
+
+@functools.cache
+def discovery_document() -> dict:
+    """The Calendar API discovery document shipped with google-api-python-client, parsed once per process"""
+    return json.loads(get_static_doc("calendar", "v3"))
+
+def benchmark_hydration():
+    """Compares sequential `events.get` calls against one batched fetch as the selection grows, against a local fake"""
+
+    import time
+    from fake_calendar import FakeCalendar, make_events
+
+    with FakeCalendar(latency=0.02) as fake:
+        fake.seed(make_events(200))
+        service = GoogleCalendarService(creds=Credentials(token="fake"), api_endpoint=fake.url)
+
+        print(f"{'selected':>8} {'sequential ms':>14} {'batched ms':>11}")
+        for size in (1, 5, 10, 20, 50):
+            ids = [f"evt{i:05d}" for i in range(size)]
+
+            began = time.perf_counter()
+            for event_id in ids:
+                service.events().get(calendarId="primary", eventId=event_id).execute()
+            sequential = time.perf_counter() - began
+
+            began = time.perf_counter()
+            service.get_events(ids)
+            batched = time.perf_counter() - began
+
+            print(f"{size:>8} {sequential * 1000:>14.1f} {batched * 1000:>11.1f}")
+
 # Testing
 if __name__ == "__main__":
 
+    if "--bench" in sys.argv:
+        benchmark_hydration()
+        sys.exit()
+
     # Instatiate service and query for all events
     calendar_service = GoogleCalendarService()
     events = calendar_service.events().list(calendarId='primary').execute() 
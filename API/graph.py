@@ -1,33 +1,54 @@
 from datatypes import State, Agent
-from tools import tools, print_state, print_stream
+from tools import tools, print_state, print_stream, speculation
 
 from event_initializer import EventInitializer
 from event_lookup import EventLookup
 from event_editor import EventEditor
 from indigo import Indigo
 from contextualizer import Contextualizer
+from compactor import Compactor
+from router import IntentRouter
+from speculation import thread_of
+from checkpointer import SqliteSaver
 
 import os
+import threading
 from dotenv import load_dotenv
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, END, START
 from langgraph.prebuilt import ToolNode
+from langchain_core.runnables import RunnableConfig
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 
 class Graph(Agent):
-    """Main graph for Indigo, incorporates all agents"""
-    def __init__(self):
+    """Main graph for Indigo, incorporates all agents. LLMs, the checkpointer and the intent router can be passed in to override the defaults
+
+    The LLM clients, agents and checkpointer are built, and the graph compiled, on first use of `graph` rather than
+    on construction, so importing the server stays cheap and works offline."""
+    def __init__(self, llm=None, chat_llm=None, checkpointer=None, router=None):
+        self.llm = llm
+        self.chat_llm = chat_llm
+        self.checkpointer = checkpointer
+        self.router = router
+        self._graph = None
+        self._lock = threading.Lock()
+
+    @property
+    def graph(self):
+        """The compiled graph, built on first use"""
+        if self._graph is None:
+            with self._lock:
+                if self._graph is None:
+                    self._graph = self.build()
+        return self._graph
+
+    def build(self):
+        """Builds the LLM clients and agents and compiles the graph"""
 
         # Define LLM for automation agents (low temperature)
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash", 
-            google_api_key=GOOGLE_API_KEY,
-            temperature=0.3
-        )
+        llm = self.llm or gemini(temperature=0.3)
 
         # Define tool node to be used in various agent flows
         tool_node = ToolNode(tools)
@@ -37,16 +58,26 @@ class Graph(Agent):
         event_lookup = EventLookup(llm, tool_node)
         event_editor = EventEditor(llm, tool_node, event_lookup)
         contextualizer = Contextualizer(llm)
+        compactor = Compactor(llm)
 
         
         # Define LLM for user-facing agent (high temperature)
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            google_api_key=GOOGLE_API_KEY,
-        )
+        llm = self.chat_llm or gemini()
         # Initialize Indigo
         indigo = Indigo(llm)
 
+        # Sends obvious commands straight to their helper agent, saving Indigo's routing call
+        router = self.router or IntentRouter()
+
+        def start_turn(state: State, config: RunnableConfig):
+            """Router node; Starts the Calendar fetches the turn may need (the first turn's report, and the candidates for a
+            lookup of the window the message names), then picks the next agent while they run"""
+
+            speculation.clear(thread_of(config)) # Whatever the previous turn didn't use
+            if "context" not in state:
+                contextualizer.speculate(config)
+            event_lookup.speculate(state, config)
+            return router.node(state)
         
         # Initialize graph
         builder = StateGraph(State)
@@ -57,20 +88,37 @@ class Graph(Agent):
         builder.add_node("event_initializer", event_initializer)
         builder.add_node("contextualizer", contextualizer)
         builder.add_node("indigo", indigo)
-
-        # Define flow
-        builder.add_conditional_edges(START, lambda state: "indigo" if "context" in state else "contextualizer") # Router determines whether user's use case is covered by a specialized agent
+        builder.add_node("compactor", compactor.node)
+        builder.add_node("router", start_turn)
+
+        # Define flow. On a thread's first turn the contextualizer's report is built while the router's pick runs, and
+        # waited for before Indigo, the only agent that reads it
+        needs_context = lambda state: "indigo" if "context" in state else "contextualizer"
+        builder.add_edge(START, "router")
+        builder.add_conditional_edges("router", lambda state: needs_context(state) if state["helper_agent"] == "indigo" else state["helper_agent"]) # Router determines whether user's use case is covered by a specialized agent, else Indigo decides
         builder.add_edge("contextualizer", "indigo")
-        builder.add_conditional_edges("indigo", lambda state: END if state["helper_agent"] == "none" else state["helper_agent"]) # Flow is routed accordingly
+        builder.add_conditional_edges("indigo", lambda state: "compactor" if state["helper_agent"] == "none" else state["helper_agent"]) # Flow is routed accordingly
+        builder.add_edge("compactor", END) # Turn ends by compacting the conversation history if it has outgrown its budget
 
         # All specialized agents route to Indigo for final user-facing output
-        builder.add_edge("event_lookup", "indigo")
-        builder.add_edge("event_editor", "indigo")
-        builder.add_edge("event_initializer", "indigo")
+        builder.add_conditional_edges("event_lookup", needs_context)
+        builder.add_conditional_edges("event_editor", needs_context)
+        builder.add_conditional_edges("event_initializer", needs_context)
+
+
+        # Persist threads in SQLite, pruning old checkpoints and expiring threads per the retention policy
+        checkpointer = self.checkpointer or SqliteSaver(
+            os.getenv("CHECKPOINT_DB", "checkpoints.db"),
+            max_age=float(os.getenv("CHECKPOINT_MAX_AGE", 30 * 24 * 3600)),
+            max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", 100_000)),
+        )
+        return builder.compile(checkpointer=checkpointer)
 
+def gemini(**kwargs):
+    """Default Gemini client. Its import is heavy, so it is only made when an LLM isn't passed in"""
 
-        checkpointer = MemorySaver()
-        self.graph = builder.compile(checkpointer=checkpointer)
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=GOOGLE_API_KEY, **kwargs)
 
 # TESTING
 
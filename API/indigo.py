@@ -1,7 +1,9 @@
-from datatypes import State, TimeData, Agent, IndigoOutput
+from datatypes import State, TimeData, Agent, IndigoOutput, Call, node
 from tools import print_state
+from prompts import PromptedModel
 
-from langchain_core.messages import SystemMessage, AIMessage
+from langchain_core.messages import AIMessage
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph
 
 class Indigo(Agent):
@@ -12,20 +14,20 @@ class Indigo(Agent):
         builder = StateGraph(State)
 
         # Add node
-        builder.add_node("indigo", self.indigo)
+        builder.add_node("indigo", node(self.indigo))
         builder.set_entry_point("indigo")
 
         # Set attributes
         self.graph = builder.compile()
         self.llm = llm
+        self.indigo_model = PromptedModel(llm, self.instructions, self.get_context, schema=IndigoOutput)
 
     def indigo(self, state: State):
-        """Main node for Indigo"""
+        """Main node for Indigo. On the async path its message is streamed as it's generated, see `delta_writer`"""
 
         # Invoke indigo node with state messages attached to a system message with Indigo's instructions, including context from Contextualizer agent.
-        output = self.llm.with_structured_output(IndigoOutput).invoke(
-            [SystemMessage(content=self.get_instructions(context=state["context"]))] + state["messages"]
-        )
+        model = self.indigo_model
+        output = yield Call(model.output, model.aoutput, state["messages"], self.delta_writer(), context=state["context"])
 
         # Since Indigo node returns structured output, we have to construct a message from to output to update the state
         message = AIMessage(content=output.message)
@@ -35,8 +37,35 @@ class Indigo(Agent):
             "helper_agent": output.helper_agent
         }
 
-    # Functions to generate time-aware instructions for the indigo node
-    get_instructions = lambda self, context="": f"""
+    @staticmethod
+    def stream_writer():
+        """The graph's custom stream writer, or a no-op when the run streams no custom events (e.g. a sync `stream`)"""
+
+        try:
+            return get_stream_writer()
+        except KeyError:
+            return lambda _: None
+
+    def delta_writer(self):
+        """Callback for Indigo's partial outputs that streams the text its message gains with each, as a custom stream event
+        `{"message_delta": text}`. Gemini generates a response schema's fields in alphabetical order, so `helper_agent` (a
+        few tokens) comes before the message, which then streams as it's generated"""
+
+        write, sent = self.stream_writer(), ""
+        def on_fields(fields: dict):
+            nonlocal sent
+            message = fields.get("message", "")
+            if not isinstance(message, str):
+                return
+            if len(message) > len(sent) and message.startswith(sent):
+                write({"message_delta": message[len(sent):]})
+            sent = message
+        return on_fields
+
+    # Instructions for the indigo node, followed on each call by context from Contextualizer agent and the current time (see `PromptedModel`)
+    get_context = lambda self, context="": ("\nContext from User's Google Calendar:\n" + context + "\n" if context else "") + TimeData.formatted_context()
+
+    instructions = """
     You are Indigo, the AI figure for a time management platform called TimeSpace. The key insight behind TimeSpace, and your job as Indigo, is that the problem of time management deserves a solution where the experience is tailored to the user. 
     
     The TimeSpace vibe is all about empowering users to conquer their time. It's futuristic yet approachable, encouraging exploration and personalization. Imagine a blend of sleek, minimalist design with bursts of energy and motivation. It's not just about rigid scheduling, but about understanding your personal flow and achieving a state of effortless productivity. Have an engaged, insightful conversation with the user, introducing them to TimeSpace and aiming to motivate and help them as best you can. Be excited! This is a great opportunity to get to know how you can use your power to help this person out!
@@ -50,8 +79,6 @@ class Indigo(Agent):
     
     Be as helpful as possible for the user, even when they ask for things that aren't related to time management. Tap into your general LLM knowldege.
 
-    {"\nContext from User's Google Calendar:\n" + context if context else ""}
-    For context it is {TimeData.formatted_time()} in {TimeData.formatted_timezone()} timezone.
     """
 
 # TESTING
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from datatypes import Call
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_core.utils.json import parse_partial_json
+from pydantic import ValidationError
+
+CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", 32768)) # Smallest prefix Gemini 1.5 will cache explicitly
+CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", 3600))
+
+class PromptedModel:
+    """An agent node's model call: the LLM bound to the node's tools or output schema once, and its system prompt
+
+    The prompt is split into a static part (instructions and examples), fixed when the agent is built, and a dynamic
+    part rendered on each call (the current time, the calendar report) that goes after it. Every request from a node
+    then starts with the same bytes, which providers that cache prefixes can reuse from one request to the next.
+
+    If the model supports explicit context caching (`create_cached_content`, as Gemini does) and the static prompt with
+    its tools is at least `min_cache_tokens` long, they are cached on first use and refreshed before `ttl` runs out.
+    Calls then send only the dynamic part, as the first message, and the conversation."""
+
+    def __init__(self, llm, static: str, dynamic=lambda: "", tools: list = None, tool_choice=None, schema=None,
+                 min_cache_tokens: int = None, ttl: int = None):
+        self.llm = llm
+        self.static = static
+        self.dynamic = dynamic
+        self.schema = schema
+        self.tools = [schema] if schema else tools or []
+        self.tool_choice = schema.__name__ if schema else tool_choice
+        self.ttl = ttl or CACHE_TTL
+
+        # Built once here rather than on every call
+        if schema:
+            self.runnable = llm.with_structured_output(schema)
+            # JSON text for `aoutput`: Gemini sends a function call in one piece once it's complete, but text as it's generated
+            self.json_mode = {"response_mime_type": "application/json", "response_schema": response_schema(schema)}
+            self.streaming = llm.bind(generation_config=self.json_mode)
+        elif tools:
+            self.runnable = llm.bind_tools(tools, tool_choice=tool_choice)
+        else:
+            self.runnable = llm
+
+        size = len(static) + len(json.dumps([convert_to_openai_tool(tool) for tool in self.tools]))
+        min_tokens = CACHE_MIN_TOKENS if min_cache_tokens is None else min_cache_tokens
+        self.cacheable = hasattr(llm, "create_cached_content") and size // 4 >= min_tokens
+        self.json_cacheable = self.cacheable and len(static) // 4 >= min_tokens # The static prompt alone, without the tools
+        self._caches = {} # Whether for JSON output -> (cached content name, time to refresh it)
+        self._lock = threading.Lock()
+
+    def messages(self, history: list[BaseMessage], **kwargs) -> list[BaseMessage]:
+        """The whole prompt for a call, with the static prompt first and the dynamic part after it"""
+
+        return [SystemMessage(content=self.static + self.dynamic(**kwargs))] + history
+
+    def invoke(self, history: list[BaseMessage], **kwargs):
+        """Calls the model on the conversation; `kwargs` are passed to the dynamic part of the prompt"""
+
+        if not self.cacheable:
+            return self.runnable.invoke(self.messages(history, **kwargs))
+        message = self.llm.invoke(self.get_cached_messages(history, **kwargs), cached_content=self.get_cache())
+        return self.parse(message)
+
+    async def ainvoke(self, history: list[BaseMessage], **kwargs):
+        """Async version of `invoke`"""
+
+        if not self.cacheable:
+            return await self.runnable.ainvoke(self.messages(history, **kwargs))
+        message = await self.llm.ainvoke(self.get_cached_messages(history, **kwargs), cached_content=await self.aget_cache())
+        return self.parse(message)
+
+    def call(self, history: list[BaseMessage], **kwargs) -> Call:
+        """The model call for a node body to yield (see `datatypes.node`)"""
+        return Call(self.invoke, self.ainvoke, history, **kwargs)
+
+    def output(self, history: list[BaseMessage], on_fields, **kwargs):
+        """A schema node's output, from a structured-output call (see `invoke`); `on_fields` gets partial outputs only
+        on the async path, see `aoutput`"""
+        return self.invoke(history, **kwargs)
+
+    async def aoutput(self, history: list[BaseMessage], on_fields, **kwargs):
+        """A schema node's output, streamed: the model answers in JSON mode, and `on_fields` gets a dict of the fields
+        parsed so far (the last possibly cut short) each time a chunk changes them. A reply that doesn't validate against
+        the schema (cut short, malformed or missing a field) is asked for again with a structured-output call
+
+        Cached content for JSON mode holds the static prompt alone, as Gemini won't combine it with tools."""
+
+        if not self.json_cacheable:
+            chunks = self.streaming.astream(self.messages(history, **kwargs))
+        else:
+            chunks = self.llm.astream(self.get_cached_messages(history, **kwargs), cached_content=await self.aget_cache(json_mode=True), generation_config=self.json_mode)
+        message, fields = None, {}
+        async for chunk in chunks:
+            message = chunk if message is None else message + chunk
+            if (parsed := partial_fields(message)) and parsed != fields:
+                fields = parsed
+                on_fields(fields)
+        try:
+            return self.schema.model_validate_json(message.content if message is not None and isinstance(message.content, str) else "")
+        except ValidationError as error:
+            print(f"{self.schema.__name__} JSON reply didn't validate, asking again with a structured-output call: {error}")
+            return await self.ainvoke(history, **kwargs)
+
+    def get_cached_messages(self, history: list[BaseMessage], **kwargs) -> list[BaseMessage]:
+        # Only the first message may be a system message, and cached content already holds it, so the dynamic part goes in as the user's
+        dynamic = self.dynamic(**kwargs)
+        return ([HumanMessage(content=dynamic)] if dynamic else []) + history
+
+    def get_cache(self, json_mode: bool = False) -> str:
+        """Name of the cached content holding the static prompt and tools (or the prompt alone, for JSON output), creating
+        or refreshing it as needed"""
+
+        with self._lock:
+            cache = self._caches.get(json_mode)
+            if cache is None or time.time() >= cache[1]:
+                tools = None if json_mode else self.tools or None
+                name = self.llm.create_cached_content(
+                    [SystemMessage(content=self.static)], tools=tools, tool_choice=tools and self.tool_choice, ttl=self.ttl
+                )
+                cache = self._caches[json_mode] = (name, time.time() + self.ttl - 60) # Refresh a minute early so no call references an expired cache
+            return cache[0]
+
+    async def aget_cache(self, json_mode: bool = False) -> str:
+        """`get_cache`, creating or refreshing the cache off the event loop"""
+
+        cache = self._caches.get(json_mode)
+        return cache[0] if cache and time.time() < cache[1] else await asyncio.to_thread(self.get_cache, json_mode)
+
+    def parse(self, message):
+        """Output of a cached call, parsed the way `with_structured_output` would if the node has a schema"""
+
+        if not self.schema:
+            return message
+        return self.schema(**message.tool_calls[0]["args"]) if message.tool_calls else None
+
+def partial_fields(message) -> dict:
+    """Fields of a partly streamed JSON reply, parsed from however much of it has arrived"""
+
+    fields = parse_partial_json(message.content) if isinstance(message.content, str) and message.content else None
+    return fields if isinstance(fields, dict) else {}
+
+def response_schema(schema) -> dict:
+    """Gemini's response schema for a pydantic model: its fields with their types and descriptions, and the choices of
+    its `Literal` ones. Gemini generates the fields in alphabetical order, not the model's"""
+
+    def convert(field: dict) -> dict:
+        converted = {"type_": field["type"].upper()}
+        if "description" in field:
+            converted["description"] = field["description"]
+        if "enum" in field:
+            converted.update(format_="enum", enum=field["enum"])
+        if "items" in field:
+            converted["items"] = convert(field["items"])
+        return converted
+
+    json_schema = schema.model_json_schema()
+    return {
+        "type_": "OBJECT",
+        "properties": {name: convert(field) for name, field in json_schema["properties"].items()},
+        "required": json_schema.get("required", []),
+    }
@@ -0,0 +1,243 @@
+import datetime
+import re
+from typing import Iterator
+from zoneinfo import ZoneInfo
+
+import tzlocal
+from dateutil import rrule
+
+class Series:
+    """A recurring event's `recurrence` lines (RRULE, EXRULE, RDATE and EXDATE), parsed once and expanded into
+    instances over any window the way the Calendar API's `singleEvents` expansion does
+
+    Rules are expanded in the wall-clock time of the event's `timeZone` (the local time zone if it has none), so
+    instances keep their local time across DST changes. Instances are built from the series master as the API returns
+    them: `id` of `<master ID>_<original start>`, `recurringEventId`, `originalStartTime`, and no `recurrence`."""
+
+    def __init__(self, master: dict):
+        self.master = master
+        start, end = master["start"], master.get("end", master["start"])
+        self.all_day = "date" in start
+        if self.all_day:
+            self.zone = tzlocal.get_localzone() # As the store takes all-day dates
+            self.dtstart = datetime.datetime.fromisoformat(start["date"])
+            self.duration = datetime.datetime.fromisoformat(end.get("date", start["date"])) - self.dtstart
+        else:
+            moment = _parse_moment(start["dateTime"])
+            self.zone = _zone(start.get("timeZone"), moment)
+            self.dtstart = _wall(moment, self.zone)
+            self.duration = _parse_moment(end.get("dateTime", start["dateTime"])) - moment
+
+        self.rules = rrule.rruleset(cache=True) # Later windows over the same series walk the instances already generated
+        self.rules.rdate(self.dtstart) # DTSTART is always the first instance, matching the rules or not (RFC 5545 3.8.5.3)
+        for line in master["recurrence"]:
+            name, _, value = line.partition(":")
+            name, *params = name.split(";")
+            name = name.upper()
+            if name in ("RRULE", "EXRULE"):
+                rule = rrule.rrulestr(_floating_until(value, self.zone), dtstart=self.dtstart, ignoretz=True)
+                self.rules.rrule(rule) if name == "RRULE" else self.rules.exrule(rule)
+            elif name in ("RDATE", "EXDATE"):
+                for moment in self._dates(params, value):
+                    self.rules.rdate(moment) if name == "RDATE" else self.rules.exdate(moment)
+            else:
+                raise ValueError(f"Unsupported recurrence line: {line}")
+
+    def instances(self, time_min: float, time_max: float, skip: set = frozenset()) -> Iterator[dict]:
+        """Yields the instances overlapping the window [time_min, time_max) (epoch seconds, either infinite) in start
+        order, leaving out those whose original start (epoch seconds) is in `skip`, e.g. exceptions held separately"""
+
+        after = self.dtstart - datetime.timedelta(seconds=1)
+        if time_min != float("-inf"):
+            after = max(after, self._local(time_min) - self.duration)
+        before = self._local(time_max) if time_max != float("inf") else None
+
+        for start in self.rules.xafter(after): # Instances that start after it end after time_min
+            if before is not None and start >= before:
+                return
+            if self._aware(start).timestamp() not in skip:
+                yield self.instance(start)
+
+    def instance(self, start: datetime.datetime) -> dict:
+        """The instance starting at `start` (in the series' wall-clock time), as the API returns it"""
+
+        begin, end = self._time(start), self._time(start + self.duration)
+        if self.all_day:
+            stamp = start.strftime("%Y%m%d")
+        else:
+            stamp = self._aware(start).astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        instance = {key: value for key, value in self.master.items() if key not in ("id", "recurrence")}
+        instance.update({
+            "id": f"{self.master['id']}_{stamp}", "recurringEventId": self.master["id"],
+            "originalStartTime": begin, "start": begin, "end": end,
+        })
+        return instance
+
+    def find(self, event_id: str) -> dict | None:
+        """The instance with the given API instance ID, if the series has one"""
+
+        prefix, _, stamp = event_id.rpartition("_")
+        if prefix != self.master["id"]:
+            return None
+        try:
+            if self.all_day:
+                start = datetime.datetime.strptime(stamp, "%Y%m%d")
+            else:
+                moment = datetime.datetime.strptime(stamp, "%Y%m%dT%H%M%SZ").replace(tzinfo=datetime.timezone.utc)
+                start = _wall(moment, self.zone)
+        except ValueError:
+            return None
+        found = self.rules.after(start, inc=True)
+        return self.instance(start) if found == start else None
+
+    def _dates(self, params: list[str], value: str) -> list[datetime.datetime]:
+        """RDATE/EXDATE values in the series' wall-clock time; a date alone stands for the series' time on that day"""
+
+        params = {key.upper(): value for key, _, value in (param.partition("=") for param in params)}
+        zone = ZoneInfo(params["TZID"]) if "TZID" in params else None
+        moments = []
+        for text in value.split(","):
+            if "/" in text:
+                text = text.split("/")[0] # Only the start of a period matters; its length is the series'
+            if len(text) == 8:
+                moments.append(datetime.datetime.combine(datetime.datetime.strptime(text, "%Y%m%d").date(), self.dtstart.time()))
+                continue
+            moment = datetime.datetime.strptime(text.rstrip("Z"), "%Y%m%dT%H%M%S")
+            if text.endswith("Z"):
+                moment = moment.replace(tzinfo=datetime.timezone.utc)
+            elif zone is not None:
+                moment = moment.replace(tzinfo=zone)
+            moments.append(_wall(moment, self.zone) if moment.tzinfo else moment)
+        return moments
+
+    def _local(self, timestamp: float) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(timestamp, self.zone).replace(tzinfo=None)
+
+    def _aware(self, start: datetime.datetime) -> datetime.datetime:
+        return start.replace(tzinfo=self.zone)
+
+    def _time(self, moment: datetime.datetime) -> dict:
+        if self.all_day:
+            return {"date": moment.date().isoformat()}
+        time = {"dateTime": self._aware(moment).isoformat()}
+        if "timeZone" in self.master["start"]:
+            time["timeZone"] = self.master["start"]["timeZone"]
+        return time
+
+# Helpers
+
+def _parse_moment(value: str) -> datetime.datetime:
+    moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.replace(tzinfo=tzlocal.get_localzone())
+
+def _zone(name: str | None, moment: datetime.datetime) -> datetime.tzinfo:
+    """The zone a series recurs in: its `timeZone`, else the local zone if it agrees with the start's offset, else that offset"""
+
+    if name:
+        return ZoneInfo(name)
+    local = tzlocal.get_localzone()
+    return local if moment.astimezone(local).utcoffset() == moment.utcoffset() else moment.tzinfo
+
+def _wall(moment: datetime.datetime, zone: datetime.tzinfo) -> datetime.datetime:
+    """An aware datetime as naive wall-clock time in `zone`"""
+    return moment.astimezone(zone).replace(tzinfo=None)
+
+def _floating_until(rule: str, zone: datetime.tzinfo) -> str:
+    """Rewrites a UTC `UNTIL` as wall-clock time in `zone`, since the rule is expanded in floating time"""
+
+    def local(match: re.Match) -> str:
+        moment = datetime.datetime.strptime(match[1], "%Y%m%dT%H%M%S").replace(tzinfo=datetime.timezone.utc)
+        return "UNTIL=" + _wall(moment, zone).strftime("%Y%m%dT%H%M%S")
+
+    return re.sub(r"UNTIL=(\d{8}T\d{6})Z", local, rule, flags=re.IGNORECASE)
+
+# TESTING
+
+# RFC 5545 3.8.5.3's worked examples, which the Calendar API follows: (DTSTART in America/New_York, recurrence lines,
+# expected instance dates, in order). Each starts at 09:00 local time; open-ended rules are checked up to their last listed date.
+CORPUS = [
+    ("19970902T090000", ["RRULE:FREQ=DAILY;COUNT=10"],
+     ["1997-09-02", "1997-09-03", "1997-09-04", "1997-09-05", "1997-09-06", "1997-09-07", "1997-09-08", "1997-09-09", "1997-09-10", "1997-09-11"]),
+    ("19970902T090000", ["RRULE:FREQ=DAILY;INTERVAL=10;COUNT=5"],
+     ["1997-09-02", "1997-09-12", "1997-09-22", "1997-10-02", "1997-10-12"]),
+    ("19970902T090000", ["RRULE:FREQ=WEEKLY;COUNT=10"],
+     ["1997-09-02", "1997-09-09", "1997-09-16", "1997-09-23", "1997-09-30", "1997-10-07", "1997-10-14", "1997-10-21", "1997-10-28", "1997-11-04"]),
+    ("19970902T090000", ["RRULE:FREQ=WEEKLY;UNTIL=19971007T000000Z;WKST=SU;BYDAY=TU,TH"],
+     ["1997-09-02", "1997-09-04", "1997-09-09", "1997-09-11", "1997-09-16", "1997-09-18", "1997-09-23", "1997-09-25", "1997-09-30", "1997-10-02"]),
+    ("19970901T090000", ["RRULE:FREQ=WEEKLY;INTERVAL=2;UNTIL=19971224T000000Z;WKST=SU;BYDAY=MO,WE,FR"],
+     ["1997-09-01", "1997-09-03", "1997-09-05", "1997-09-15", "1997-09-17", "1997-09-19", "1997-09-29", "1997-10-01", "1997-10-03",
+      "1997-10-13", "1997-10-15", "1997-10-17", "1997-10-27", "1997-10-29", "1997-10-31", "1997-11-10", "1997-11-12", "1997-11-14",
+      "1997-11-24", "1997-11-26", "1997-11-28", "1997-12-08", "1997-12-10", "1997-12-12", "1997-12-22"]),
+    ("19970905T090000", ["RRULE:FREQ=MONTHLY;COUNT=10;BYDAY=1FR"],
+     ["1997-09-05", "1997-10-03", "1997-11-07", "1997-12-05", "1998-01-02", "1998-02-06", "1998-03-06", "1998-04-03", "1998-05-01", "1998-06-05"]),
+    ("19970922T090000", ["RRULE:FREQ=MONTHLY;COUNT=6;BYDAY=-2MO"],
+     ["1997-09-22", "1997-10-20", "1997-11-17", "1997-12-22", "1998-01-19", "1998-02-16"]),
+    ("19970928T090000", ["RRULE:FREQ=MONTHLY;BYMONTHDAY=-3"],
+     ["1997-09-28", "1997-10-29", "1997-11-28", "1997-12-29", "1998-01-29", "1998-02-26"]),
+    ("19970610T090000", ["RRULE:FREQ=YEARLY;COUNT=10;BYMONTH=6,7"],
+     ["1997-06-10", "1997-07-10", "1998-06-10", "1998-07-10", "1999-06-10", "1999-07-10", "2000-06-10", "2000-07-10", "2001-06-10", "2001-07-10"]),
+    ("19970902T090000", ["EXDATE;TZID=America/New_York:19970902T090000", "RRULE:FREQ=MONTHLY;BYDAY=FR;BYMONTHDAY=13"],
+     ["1998-02-13", "1998-03-13", "1998-11-13", "1999-08-13", "2000-10-13"]),
+    ("19970930T090000", ["RRULE:FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1"],
+     ["1997-09-30", "1997-10-31", "1997-11-28", "1997-12-31", "1998-01-30", "1998-02-27", "1998-03-31"]),
+    ("20070115T090000", ["RRULE:FREQ=MONTHLY;BYMONTHDAY=15,30;COUNT=5"],
+     ["2007-01-15", "2007-01-30", "2007-02-15", "2007-03-15", "2007-03-30"]),
+    ("19970902T090000", ["RRULE:FREQ=DAILY;COUNT=5", "EXDATE:19970903T130000Z,19970905T130000Z", "RDATE;TZID=America/New_York:19970910T090000"],
+     ["1997-09-02", "1997-09-04", "1997-09-06", "1997-09-10"]),
+]
+
+def main():
+    """Checks the expansion against the RFC 5545 examples, DST and the API's instance IDs, then times multi-year daily series"""
+
+    import time
+
+    zone = ZoneInfo("America/New_York")
+    for dtstart, recurrence, expected in CORPUS:
+        start = datetime.datetime.strptime(dtstart, "%Y%m%dT%H%M%S").replace(tzinfo=zone)
+        series = Series({
+            "id": "series", "recurrence": recurrence,
+            "start": {"dateTime": start.isoformat(), "timeZone": "America/New_York"},
+            "end": {"dateTime": (start + datetime.timedelta(hours=1)).isoformat(), "timeZone": "America/New_York"},
+        })
+        until = datetime.datetime.fromisoformat(expected[-1]).replace(tzinfo=zone) + datetime.timedelta(days=1)
+        instances = list(series.instances(float("-inf"), until.timestamp()))
+        assert [instance["start"]["dateTime"][:10] for instance in instances] == expected, (recurrence, instances)
+        assert all(instance["start"]["dateTime"][11:19] == "09:00:00" for instance in instances), recurrence # Across DST changes
+        assert all(series.find(instance["id"]) == instance for instance in instances)
+    print(f"{len(CORPUS)} RFC 5545 examples expand as specified")
+
+    series = Series({
+        "id": "gym", "summary": "Gym", "recurrence": ["RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"],
+        "start": {"dateTime": "2025-03-07T07:00:00-05:00", "timeZone": "America/New_York"},
+        "end": {"dateTime": "2025-03-07T08:00:00-05:00", "timeZone": "America/New_York"},
+    })
+    week = [instance for instance in series.instances(datetime.datetime(2025, 3, 7, tzinfo=zone).timestamp(), datetime.datetime(2025, 3, 14, tzinfo=zone).timestamp())]
+    assert [instance["id"] for instance in week] == ["gym_20250307T120000Z", "gym_20250310T110000Z", "gym_20250311T110000Z", "gym_20250312T110000Z", "gym_20250313T110000Z"], week
+    assert week[1]["start"] == {"dateTime": "2025-03-10T07:00:00-04:00", "timeZone": "America/New_York"} and "recurrence" not in week[1]
+    all_day = Series({"id": "bins", "recurrence": ["RRULE:FREQ=WEEKLY;COUNT=3", "EXDATE;VALUE=DATE:20250110"], "start": {"date": "2025-01-03"}, "end": {"date": "2025-01-04"}})
+    assert [instance["id"] for instance in all_day.instances(float("-inf"), float("inf"))] == ["bins_20250103", "bins_20250117"]
+    print("Instance IDs, times across DST and all-day series match the API's")
+
+    for years in (1, 3, 10):
+        start = datetime.datetime(2020, 1, 1, 9, tzinfo=zone)
+        until = start.replace(year=2020 + years)
+        master = {
+            "id": "daily", "recurrence": [f"RRULE:FREQ=DAILY;UNTIL={until.astimezone(datetime.timezone.utc):%Y%m%dT%H%M%SZ}"],
+            "start": {"dateTime": start.isoformat(), "timeZone": "America/New_York"},
+            "end": {"dateTime": (start + datetime.timedelta(minutes=30)).isoformat(), "timeZone": "America/New_York"},
+        }
+        began = time.perf_counter()
+        series = Series(master)
+        count = sum(1 for _ in series.instances(float("-inf"), float("inf")))
+        everything = time.perf_counter() - began
+        last_week = (until - datetime.timedelta(days=7)).timestamp(), until.timestamp()
+        windows = []
+        for series in (Series(master), series): # Newly parsed, then with the instances already generated
+            began = time.perf_counter()
+            week = list(series.instances(*last_week))
+            windows.append(time.perf_counter() - began)
+        print(f"Daily for {years:>2} years: {count:>5} instances in {everything * 1000:5.1f} ms, "
+              f"its last week ({len(week)}) in {windows[0] * 1000:4.1f} ms newly parsed, {windows[1] * 1000:4.1f} ms cached")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+REPLAY_EVENTS = int(os.getenv("REPLAY_EVENTS", 1024)) # Events kept per thread for clients resuming a stream
+REPLAY_THREADS = int(os.getenv("REPLAY_THREADS", 1000)) # Threads whose events are kept, least recently used dropped first
+
+class EventLog:
+    """A thread's streamed events, numbered and kept in a ring buffer of the last `size`, so a client whose connection
+    drops can reconnect with the last ID it saw and resume without the turn being run again
+
+    Turns run as tasks that `publish` to the log whether or not anyone is connected, one at a time per thread. IDs increase
+    across all the thread's turns, starting from the time the log was created (in milliseconds), so IDs a restarted server
+    hands out are newer than those its previous run did."""
+
+    def __init__(self, size: int = REPLAY_EVENTS): # Create on the event loop its turns run on
+        self.events = deque(maxlen=size) # (id, turn, SSE text)
+        self.next_id = time.time_ns() // 1_000_000
+        self.turns = 0
+        self.finished = 0 # Last turn to have published its final event
+        self.task = None # The running turn
+        self.loop = asyncio.get_running_loop()
+        self._changed = asyncio.Condition()
+        self._lock = asyncio.Lock() # Held by the running turn
+
+    def start(self, run) -> int:
+        """Starts a turn, which runs `run(publish)` once the thread's previous turn is done; returns the turn number"""
+
+        self.turns += 1
+        turn = self.turns
+
+        async def publish(event: str, data: dict):
+            async with self._changed:
+                self.events.append((self.next_id, turn, f"id: {self.next_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"))
+                self.next_id += 1
+                self._changed.notify_all()
+
+        async def task():
+            async with self._lock:
+                try:
+                    await run(publish)
+                    await publish("end", {"turn": turn})
+                except Exception as e:
+                    await publish("error", {"turn": turn, "error": str(e)})
+                finally:
+                    async with self._changed:
+                        self.finished = turn
+                        self._changed.notify_all()
+
+        self.task = asyncio.create_task(task())
+        return turn
+
+    def turn_of(self, event_id: int) -> int | None:
+        """The turn an event belongs to, None if the event isn't in the buffer (too old, or from another server run)"""
+        return next((turn for id, turn, _ in self.events if id == event_id), None)
+
+    async def subscribe(self, turn: int, after: int = 0):
+        """Yields the turn's events with IDs after `after`, the buffered ones first, then each as it's published, until
+        the turn is finished. Leaving early (e.g. the client disconnecting) doesn't affect the turn"""
+
+        while True:
+            async with self._changed:
+                pending = [text for id, t, text in self.events if t == turn and id > after]
+                if not pending:
+                    if self.finished >= turn:
+                        return
+                    await self._changed.wait()
+                    continue
+                after = next(id for id, t, _ in reversed(self.events) if t == turn)
+            for text in pending:
+                yield text
+
+class EventLogs:
+    """Event logs by thread, for the `REPLAY_THREADS` threads streamed to most recently; logs of threads with a turn
+    running are never dropped"""
+
+    def __init__(self, threads: int = REPLAY_THREADS, size: int = REPLAY_EVENTS):
+        self.threads = threads
+        self.size = size
+        self._logs: OrderedDict[str, EventLog] = OrderedDict()
+
+    def get(self, thread_id: str, create: bool = True) -> EventLog | None:
+        """The thread's log, created if there isn't one and `create` is set. Call from the event loop serving streams"""
+
+        log = self._logs.get(thread_id)
+        if log is not None and log.loop is not asyncio.get_running_loop():
+            log = None # Left by a loop that has since closed (e.g. one `asyncio.run` per benchmark); its turns can't resume
+        if log is None and create:
+            log = self._logs[thread_id] = EventLog(self.size)
+            idle = [key for key, other in self._logs.items() if key != thread_id and (other.task is None or other.task.done())]
+            for key in idle[:max(len(self._logs) - self.threads, 0)]:
+                del self._logs[key]
+        if log is not None:
+            self._logs.move_to_end(thread_id)
+        return log
+
+def message_data(message) -> dict:
+    """JSON payload for a message in a node's update: its type, content and, for an AI message, its tool calls"""
+
+    data = {"type": message.type, "content": message.content, "id": message.id}
+    if getattr(message, "tool_calls", None):
+        data["tool_calls"] = [{"name": call["name"], "args": call["args"], "id": call["id"]} for call in message.tool_calls]
+    if getattr(message, "name", None):
+        data["name"] = message.name
+    return data
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+class ReportCache:
+    """Cache of generated context reports, with single-flight generation
+
+    Keys start with the user they belong to and should include a version marker of the data the report was
+    built from, so a changed calendar is a miss rather than a stale hit. Concurrent requests for a key that is
+    being generated wait for that one generation instead of starting their own, from threads or coroutines alike.
+    If the generating request is cancelled rather than failing (e.g. its client disconnected), one of those waiting
+    takes over the generation."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.stats = Counter() # Hits, misses and waits on an in-flight generation
+        self._entries: OrderedDict[tuple, str] = OrderedDict() # Least recently used first
+        self._flights: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, generate) -> str:
+        """Returns the report for `key`, calling `generate()` to build it on a miss"""
+
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except _Abandoned:
+                continue # Claim again, and generate it if no other waiter has yet
+
+        try:
+            report = generate()
+        except Exception as error:
+            self._settle(key, future, error=error)
+            raise
+        except BaseException:
+            self._settle(key, future, error=_Abandoned())
+            raise
+        self._settle(key, future, report)
+        return report
+
+    async def aget(self, key: tuple, agenerate) -> str:
+        """Async version of `get`, awaiting `agenerate()` on a miss"""
+
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            waited = asyncio.wrap_future(future)
+            waited.add_done_callback(lambda done: done.cancelled() or done.exception()) # Retrieved, even if no one is left waiting
+            try:
+                return await asyncio.shield(waited) # A waiter being cancelled mustn't cancel the generation
+            except _Abandoned:
+                continue
+
+        try:
+            report = await agenerate()
+        except Exception as error:
+            self._settle(key, future, error=error)
+            raise
+        except BaseException: # Cancelled
+            self._settle(key, future, error=_Abandoned())
+            raise
+        self._settle(key, future, report)
+        return report
+
+    def invalidate(self, user=None):
+        """Drops cached reports for a user, or for everyone if no user is given"""
+
+        with self._lock:
+            for key in [key for key in self._entries if user is None or key[0] == user]:
+                del self._entries[key]
+
+    def _claim(self, key: tuple) -> tuple[Future, bool]:
+        """Returns (future for the report, whether the caller has to generate it)"""
+
+        with self._lock:
+            if key in self._entries:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                future = Future()
+                future.set_result(self._entries[key])
+                return future, False
+            if key in self._flights:
+                self.stats["waits"] += 1
+                return self._flights[key], False
+
+            self.stats["misses"] += 1
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _settle(self, key: tuple, future: Future, report: str = None, error: BaseException = None):
+        with self._lock:
+            del self._flights[key]
+            if error is None:
+                self._entries[key] = report
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        # Failures aren't cached, but requests already waiting on this generation get the error too
+        future.set_exception(error) if error is not None else future.set_result(report)
+
+class _Abandoned(Exception):
+    """Settles a generation whose leader was cancelled, so a waiting request claims the key again"""
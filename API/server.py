@@ -1,13 +1,29 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Header, Query
 from fastapi.responses import StreamingResponse
 import asyncio
+import functools
+import json
+import os
 import uuid
-from graph import Graph
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from tools import format_namespace
+from replay import EventLogs, message_data
+
+# Bounded pool for the synchronous work left in the graph (event store syncs, sync-only nodes), so it never blocks the event loop
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("EXECUTOR_WORKERS", 32)), thread_name_prefix="graph")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+   asyncio.get_running_loop().set_default_executor(executor)
+   executor.submit(lambda: get_graph().graph) # Build the graph in the background so startup doesn't wait for it, but the first request rarely does
+   yield
+   from transport import close_async_sessions
+   await close_async_sessions() # The async tools' Calendar connections
+   executor.shutdown(wait=False)
 
 # Initialize the FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure Cross-Origin Resource Sharing (CORS) Middleware
 # This configuration allows requests from any origin, with any method, and any header.
@@ -19,34 +35,95 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-graph = Graph()
+@functools.cache
+def get_graph():
+   """The graph, its module (with the agents, tools and their libraries) imported on first use rather than with the
+   server's, and compiled on first use of `Graph.graph`. Call off the event loop the first time"""
+
+   from graph import Graph
+   return Graph()
+
+def resolve_user(config: dict) -> str:
+   """`CredentialStore.user` for the tools' credentials, importing them on first use. Call off the event loop"""
+
+   from tools import credentials
+   return credentials.user(config)
 
 state = {
    "messages": [("user", "Onboard")],
    "helper_agent": "",
 }
 
-# Define a generator to stream output from the LangGraph graph
-async def stream_graph_output(message: str, thread_id: str):   
+event_logs = EventLogs() # Each thread's recent events, for clients resuming a dropped stream
+
+# Define a generator to stream output from the LangGraph graph, as Server-Sent Events with JSON data and increasing IDs:
+# - "update": a node's update, {"node", "namespace", "message", "helper_agent"} (the last two if the node changed them)
+# - "delta": text Indigo's reply gained as it's generated, {"node", "namespace", "text"}; its "update" has the whole reply
+# - "end" or "error": the turn is over, {"turn"} or {"turn", "error"}
+# A turn runs to the end even if the client disconnects. Reconnecting with the last event ID seen (`Last-Event-ID`, as
+# EventSource sends) resumes the turn from the thread's buffered events, without running it again. A thread belongs to
+# the first user to run it (`X-User-ID`, as set by the authenticating proxy, or the default user without one); requests
+# from anyone else, with or without the header, get an "error"
+async def stream_graph_output(message: str, thread_id: str, last_event_id: str | None = None, user_id: str | None = None):
+   try:
+      await asyncio.to_thread(resolve_user, {"configurable": {"thread_id": thread_id, "user_id": user_id}}) # Links the thread, or refuses another user's
+   except PermissionError as e:
+      yield f"""event: error\ndata: {json.dumps({"error": str(e)})}\n\n"""
+      return
+
+   if last_event_id is not None:
+      log = event_logs.get(thread_id, create=False)
+      turn = log.turn_of(int(last_event_id)) if log is not None and last_event_id.isdigit() else None
+      if turn is None: # Never run again on a reconnect, as that would repeat the turn's changes to the calendar
+         yield f"""event: error\ndata: {json.dumps({"error": f"Can't resume after event {last_event_id}, it's no longer buffered"})}\n\n"""
+         return
+      async for event in log.subscribe(turn, after=int(last_event_id)):
+         yield event
+      return
+
+   log = event_logs.get(thread_id)
+   turn = log.start(lambda publish: run_turn(message, thread_id, publish, user_id))
+   async for event in log.subscribe(turn):
+      yield event
+
+async def run_turn(message: str, thread_id: str, publish, user_id: str | None = None):
+   """Runs one turn of the graph, publishing its events (see `stream_graph_output`)"""
+
    input = {
       "messages": [("user", message)],
    }
-   stream = graph.stream(input, {"configurable": {"thread_id": thread_id}}, stream_mode="updates", subgraphs=True)
-   for namespace, chunk in stream:
+   graph = await asyncio.to_thread(lambda: get_graph().graph) # Imported and built off the event loop, or waited for if still being built
+   from langchain_core.messages import BaseMessage
+   from tools import format_namespace
+   configurable = {"thread_id": thread_id, "user_id": user_id} if user_id else {"thread_id": thread_id}
+   stream = graph.astream(input, {"configurable": configurable}, stream_mode=["updates", "custom"], subgraphs=True)
+   async for namespace, mode, chunk in stream:
+      if mode == "custom":
+         if "message_delta" in chunk:
+            await publish("delta", {"node": "indigo", "namespace": list(namespace), "text": chunk["message_delta"]})
+         continue
       node_name = list(chunk.keys())[0]
       print(
          f"\n---------- Update from {node_name} node in {format_namespace(namespace)} ---------\n"
       )
-      messages = chunk[node_name]["messages"] if "messages" in chunk[node_name] else ""
-      message = messages if not isinstance(messages, list) else messages[-1]
-      message.pretty_print() if not isinstance(message, (tuple, str)) else message
-      
-      yield f"""data: {message}\n\n"""  # Format as Server-Sent Events (SSE)
+      update = chunk[node_name] or {} # Nodes with nothing to change (e.g. the compactor) stream an empty update
+      messages = update.get("messages")
+      message = messages[-1] if isinstance(messages, list) and messages else messages
+      data = {"node": node_name, "namespace": list(namespace)}
+      if isinstance(message, BaseMessage):
+         message.pretty_print()
+         data["message"] = message_data(message)
+      if "helper_agent" in update:
+         data["helper_agent"] = update["helper_agent"]
+
+      await publish("update", data)
 
 # API endpoint to stream output
 @app.get("/stream")
 async def stream(
    thread_id: str = Query("1", title="Thread ID"), 
-   message: str = Query("Onboard", title="User message")
+   message: str = Query("Onboard", title="User message"),
+   last_event_id: str | None = Header(None, title="Last event ID seen, to resume a dropped stream"),
+   x_user_id: str | None = Header(None, title="User the turn acts for, set by the authenticating proxy in front of the server")
 ):
-   return StreamingResponse(stream_graph_output(message, thread_id), media_type="text/event-stream")
\ No newline at end of file
+   return StreamingResponse(stream_graph_output(message, thread_id, last_event_id, x_user_id), media_type="text/event-stream")
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", 16)) # Speculative fetches in flight at once, across all threads
+
+class Speculator:
+    """Work started before it is known to be needed, such as Calendar fetches run while an LLM decides whether to use them
+
+    `start` runs a function in the background under a key whose first item is the conversation thread; the node that
+    turns out to need the result claims it with `take`. Whatever a turn doesn't claim is dropped when the thread's next
+    turn starts (`clear`), or after `max_age` seconds. `stats` counts the work started, used and wasted."""
+
+    def __init__(self, max_age: float = 60.0, workers: int = SPECULATION_WORKERS):
+        self.max_age = max_age
+        self.stats = Counter()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculation")
+        self._pending: dict[tuple, tuple[float, Future]] = {} # Key -> (monotonic start time, future)
+        self._lock = threading.Lock()
+
+    def start(self, key: tuple, fn, *args, **kwargs) -> Future:
+        """Starts `fn(*args, **kwargs)` in the background under `key`, unless work under that key is already pending"""
+
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, (started, _) in self._pending.items() if now - started > self.max_age]:
+                self._drop(stale)
+            if key not in self._pending:
+                self._pending[key] = (now, self._executor.submit(fn, *args, **kwargs))
+                self.stats["started"] += 1
+            return self._pending[key][1]
+
+    def take(self, key: tuple) -> Future | None:
+        """Claims the work started under `key`, if any and started no more than `max_age` seconds ago; the caller waits
+        on the future for its result"""
+
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.max_age:
+                self._drop(key)
+                return None
+            del self._pending[key]
+            self.stats["used"] += 1
+        return entry[1]
+
+    def clear(self, thread_id: str):
+        """Drops the unclaimed work of a thread, e.g. when its next turn starts"""
+
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == thread_id]:
+                self._drop(key)
+
+    def _drop(self, key: tuple):
+        _, future = self._pending.pop(key)
+        future.cancel() # Only stops work that hasn't started; anything running finishes and is ignored
+        self.stats["wasted"] += 1
+
+def thread_of(config: dict) -> str | None:
+    """The conversation thread a run belongs to; speculation is keyed by it, so runs without one don't speculate"""
+    return ((config or {}).get("configurable") or {}).get("thread_id")
@@ -0,0 +1,222 @@
+import datetime
+import functools
+import re
+
+import tzlocal
+
+PARTS = {"morning": (5, 12), "afternoon": (12, 17), "evening": (17, 21), "night": (17, 24)} # Hours of each part of a day
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "couple of": 2, "few": 3}
+UNITS = {"hour": datetime.timedelta(hours=1), "day": datetime.timedelta(days=1), "week": datetime.timedelta(weeks=1)}
+
+_PART = r"(?: (morning|afternoon|evening|night))?"
+_DAY = r"(\d{1,2})(?:st|nd|rd|th)?"
+_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_COUNT = r"(?:(\d+|" + "|".join(NUMBERS) + r") )?"
+_SERIES = re.compile(r"\b(every|each|weekly|daily|recurring|series|all future)\b") # Likely about a recurring event, best found unexpanded
+_TARGET = re.compile(r"\b(to|until|till|into|onto|by|than|instead of)( the| next| this)? ?$") # Precedes where an event is going, not where it is
+
+def parse_window(text: str, now: datetime.datetime = None, zone: datetime.tzinfo = None) -> dict | None:
+    """Turns the time window a message names ("tomorrow", "this afternoon", "next two weeks", "Friday", "March 4")
+    into `list_events` params (ListQuery) in the user's time zone, or None if it names none, or more than one, or
+    seems to be about a recurring series
+
+    Days run from midnight to midnight in `zone` (the local zone by default), so they are 23 or 25 hours long across
+    DST changes. Expressions saying where an event is going ("move it to Friday") are ignored. Windows are cached
+    per message, minute and zone."""
+
+    zone = zone or tzlocal.get_localzone()
+    now = (now or datetime.datetime.now(zone)).astimezone(zone).replace(second=0, microsecond=0)
+    params = _parse(" ".join(text.lower().replace("’", "'").replace("'s ", " ").split()), now, zone)
+    return dict(params) if params else None
+
+@functools.lru_cache(maxsize=4096)
+def _parse(text: str, now: datetime.datetime, zone: datetime.tzinfo) -> tuple | None:
+    if _SERIES.search(text):
+        return None
+    spans, windows = [], set()
+    for match, handler in sorted(_matches(text), key=lambda found: (-len(found[0][0]), found[0].start())): # Longest first
+        if any(match.start() < end and start < match.end() for start, end in spans):
+            continue # Part of a longer expression already read
+        spans.append(match.span())
+        if not _TARGET.search(text[:match.start()]):
+            windows.add(handler(match, now))
+    windows.discard(None)
+    if len(windows) != 1:
+        return None
+
+    start, end = windows.pop()
+    params = {"timeMin": start.isoformat(), "timeMax": end.isoformat(), "singleEvents": True}
+    if getattr(zone, "key", None):
+        params["timeZone"] = zone.key
+    return tuple(params.items())
+
+def _matches(text: str):
+    for pattern, handler in EXPRESSIONS:
+        for match in pattern.finditer(text):
+            yield match, handler
+
+# Windows, as (start, end) aware datetimes
+
+def _day(day: datetime.date, now: datetime.datetime, part: str = None) -> tuple:
+    first, last = PARTS[part] if part else (0, 24)
+    return _at(day, first, now.tzinfo), _at(day, last, now.tzinfo)
+
+def _at(day: datetime.date, hour: int, zone: datetime.tzinfo) -> datetime.datetime:
+    """`hour` o'clock on `day` in `zone`, with hour 24 as the next midnight"""
+    return datetime.datetime.combine(day + datetime.timedelta(days=hour // 24), datetime.time(hour % 24), tzinfo=zone)
+
+def _relative_day(match: re.Match, now: datetime.datetime) -> tuple:
+    offset = {"today": 0, "tonight": 0, "tomorrow": 1, "yesterday": -1}[match[1]]
+    part = "night" if match[1] == "tonight" else match[2]
+    return _day(now.date() + datetime.timedelta(days=offset), now, part)
+
+def _this_part(match: re.Match, now: datetime.datetime) -> tuple:
+    return _day(now.date(), now, match[1])
+
+def _rest_of(match: re.Match, now: datetime.datetime) -> tuple:
+    if match[1] == "week":
+        return now, _at(now.date() + datetime.timedelta(days=7 - now.weekday()), 0, now.tzinfo)
+    return now, _at(now.date(), 24, now.tzinfo)
+
+def _weekday(match: re.Match, now: datetime.datetime) -> tuple:
+    """`Friday` and `this Friday` are the next Friday (today if it is one), `next Friday` is the one in next week"""
+
+    ahead = (WEEKDAYS.index(match[2]) - now.weekday()) % 7
+    if match[1] == "next":
+        ahead = 7 - now.weekday() + WEEKDAYS.index(match[2])
+    elif match[1] == "last":
+        ahead = -((now.weekday() - WEEKDAYS.index(match[2])) % 7 or 7)
+    return _day(now.date() + datetime.timedelta(days=ahead), now, match[3])
+
+def _period(match: re.Match, now: datetime.datetime) -> tuple:
+    """This/next/last week (Monday to Monday), weekend (Saturday to Monday) or month; this one starts today"""
+
+    which, period = match[1] or "this", match[2]
+    shift = {"this": 0, "next": 1, "last": -1}[which]
+    today = now.date()
+    if period == "month":
+        month = today.month - 1 + shift
+        first = datetime.date(today.year + month // 12, month % 12 + 1, 1)
+        following = datetime.date(first.year + first.month // 12, first.month % 12 + 1, 1)
+        return _at(max(first, today) if shift == 0 else first, 0, now.tzinfo), _at(following, 0, now.tzinfo)
+    monday = today - datetime.timedelta(days=today.weekday()) + datetime.timedelta(weeks=shift)
+    first = monday + datetime.timedelta(days=5) if period == "weekend" else monday
+    if shift == 0:
+        first = max(first, today)
+    return _at(first, 0, now.tzinfo), _at(monday + datetime.timedelta(days=7), 0, now.tzinfo)
+
+def _coming(match: re.Match, now: datetime.datetime) -> tuple:
+    """The next N hours, days or weeks from now"""
+
+    count = match[1] or "1"
+    count = int(count) if count.isdigit() else NUMBERS[count]
+    if not 0 < count <= 366:
+        return None
+    end = now.astimezone(datetime.timezone.utc) + UNITS[match[2]] * count # Elapsed time, whatever the clocks do
+    return now, end.astimezone(now.tzinfo)
+
+def _date(match: re.Match, now: datetime.datetime) -> tuple | None:
+    """A day of a month, this year or, once it has passed by more than a week, next year"""
+
+    groups = [group for group in match.groups() if group]
+    month = next(MONTHS.index(group[:3]) + 1 for group in groups if not group.isdigit())
+    day = int(next(group for group in groups if group.isdigit()))
+    for year in (now.year, now.year + 1):
+        try:
+            date = datetime.date(year, month, day)
+        except ValueError:
+            return None
+        if date >= now.date() - datetime.timedelta(days=7):
+            return _day(date, now)
+    return None
+
+def _day_of_month(match: re.Match, now: datetime.datetime) -> tuple | None:
+    """`the 15th`: this month's, or next month's once it has passed"""
+
+    day, today = int(match[1]), now.date()
+    for month in (today.month, today.month + 1):
+        try:
+            date = datetime.date(today.year + (month - 1) // 12, (month - 1) % 12 + 1, day)
+        except ValueError:
+            continue
+        if date >= today:
+            return _day(date, now)
+    return None
+
+EXPRESSIONS = [ # (pattern, handler returning the window of a match)
+    (re.compile(r"\b(today|tonight|tomorrow|yesterday)" + _PART + r"\b"), _relative_day),
+    (re.compile(r"\b(?:later|rest of) (?:the |this )?(day|today|week)\b"), _rest_of),
+    (re.compile(r"\bthis (morning|afternoon|evening)\b"), _this_part),
+    (re.compile(r"\b(?:(this|next|last|on|coming) )?(" + "|".join(WEEKDAYS) + r")(?!s)" + _PART + r"\b"), _weekday),
+    (re.compile(r"\b(?:(this|next|last) |the |my )(week|weekend|month)\b"), _period),
+    (re.compile(r"\b(?:(?:the )?(?:next|coming|upcoming|following) )" + _COUNT + r"(hour|day|week)s?\b"), _coming),
+    (re.compile(r"\b" + _MONTH + " " + _DAY + r"\b"), _date),
+    (re.compile(r"\b" + _DAY + r" (?:of )?" + _MONTH + r"(?=\W|$)"), _date),
+    (re.compile(r"\bthe (\d{1,2})(?:st|nd|rd|th)\b"), _day_of_month),
+]
+
+# TESTING
+
+# (message, reference time, expected timeMin, timeMax), in America/New_York; clocks went forward on Sunday 2025-03-09
+# and back on Sunday 2025-11-02
+CORPUS = [
+    ("What's on my calendar tomorrow?", "2025-03-08T10:00", "2025-03-09T00:00:00-05:00", "2025-03-10T00:00:00-04:00"),
+    ("what do i have today", "2025-03-09T10:00", "2025-03-09T00:00:00-05:00", "2025-03-10T00:00:00-04:00"),
+    ("Delete my haircut tomorrow", "2025-11-01T20:00", "2025-11-02T00:00:00-04:00", "2025-11-03T00:00:00-05:00"),
+    ("Push all my meetings this afternoon to tomorrow", "2025-03-09T09:00", "2025-03-09T12:00:00-04:00", "2025-03-09T17:00:00-04:00"),
+    ("What's my schedule for the rest of the day?", "2025-11-02T00:30", "2025-11-02T00:30:00-04:00", "2025-11-03T00:00:00-05:00"),
+    ("anything tonight?", "2025-03-09T08:00", "2025-03-09T17:00:00-04:00", "2025-03-10T00:00:00-04:00"),
+    ("show me tomorrow morning", "2025-03-08T22:00", "2025-03-09T05:00:00-04:00", "2025-03-09T12:00:00-04:00"),
+    ("What do I have on Sunday?", "2025-03-06T12:00", "2025-03-09T00:00:00-05:00", "2025-03-10T00:00:00-04:00"),
+    ("cancel my friday dinner", "2025-03-07T08:00", "2025-03-07T00:00:00-05:00", "2025-03-08T00:00:00-05:00"),
+    ("Reschedule next Monday's standup to Tuesday", "2025-03-05T12:00", "2025-03-10T00:00:00-04:00", "2025-03-11T00:00:00-04:00"),
+    ("Show me this weekend", "2025-03-06T12:00", "2025-03-08T00:00:00-05:00", "2025-03-10T00:00:00-04:00"),
+    ("what's on this week", "2025-10-29T12:00", "2025-10-29T00:00:00-04:00", "2025-11-03T00:00:00-05:00"),
+    ("How does my week look?", "2025-10-29T12:00", "2025-10-29T00:00:00-04:00", "2025-11-03T00:00:00-05:00"),
+    ("List next week", "2025-10-29T12:00", "2025-11-03T00:00:00-05:00", "2025-11-10T00:00:00-05:00"),
+    ("What's coming up in the next two weeks?", "2025-03-01T12:00", "2025-03-01T12:00:00-05:00", "2025-03-15T13:00:00-04:00"),
+    ("Anything in the next 3 hours?", "2025-03-09T00:30", "2025-03-09T00:30:00-05:00", "2025-03-09T04:30:00-04:00"),
+    ("do I have anything the next 24 hours", "2025-11-01T12:00", "2025-11-01T12:00:00-04:00", "2025-11-02T11:00:00-05:00"),
+    ("what's on march 9", "2025-03-01T12:00", "2025-03-09T00:00:00-05:00", "2025-03-10T00:00:00-04:00"),
+    ("when's my thing on the 2nd of November", "2025-10-20T12:00", "2025-11-02T00:00:00-04:00", "2025-11-03T00:00:00-05:00"),
+    ("What's on Jan 5?", "2025-11-20T12:00", "2026-01-05T00:00:00-05:00", "2026-01-06T00:00:00-05:00"),
+    ("show me the 15th", "2025-10-20T12:00", "2025-11-15T00:00:00-05:00", "2025-11-16T00:00:00-05:00"),
+    ("what do I have this month", "2025-11-20T12:00", "2025-11-20T00:00:00-05:00", "2025-12-01T00:00:00-05:00"),
+    ("Show me next month", "2025-12-20T12:00", "2026-01-01T00:00:00-05:00", "2026-02-01T00:00:00-05:00"),
+    ("what did I have yesterday evening", "2025-03-10T12:00", "2025-03-09T17:00:00-04:00", "2025-03-09T21:00:00-04:00"),
+    ("Make my lunch break today 30 minutes", "2025-11-02T09:00", "2025-11-02T00:00:00-04:00", "2025-11-03T00:00:00-05:00"),
+    ("Move my dentist appointment to Thursday", "2025-03-05T12:00", None, None), # Only says where it's going
+    ("Reschedule my gym sessions to 6pm", "2025-03-05T12:00", None, None),
+    ("move my monday call to friday", "2025-03-05T12:00", "2025-03-10T00:00:00-04:00", "2025-03-11T00:00:00-04:00"),
+    ("What is my next upcoming event?", "2025-03-05T12:00", None, None),
+    ("Cancel gym on mondays", "2025-03-05T12:00", None, None), # A series, best found unexpanded
+    ("Move gym every Monday to 7pm", "2025-03-05T12:00", None, None),
+    ("Compare tomorrow with Friday", "2025-03-05T12:00", None, None), # Two windows
+    ("May I move things around?", "2025-03-05T12:00", None, None),
+]
+
+def main():
+    """Checks the corpus of phrasings around both 2025 DST changes, and times parsing"""
+
+    import time
+    from zoneinfo import ZoneInfo
+
+    zone = ZoneInfo("America/New_York")
+    for text, now, time_min, time_max in CORPUS:
+        params = parse_window(text, datetime.datetime.fromisoformat(now).replace(tzinfo=zone), zone)
+        found = (params["timeMin"], params["timeMax"]) if params else (None, None)
+        assert found == (time_min, time_max), (text, now, found)
+    print(f"{len(CORPUS)} phrasings parse as expected across DST changes")
+
+    now = datetime.datetime.now(zone)
+    for cached in (False, True):
+        began = time.perf_counter()
+        for text, *_ in CORPUS:
+            parse_window(text, now, zone)
+        took = (time.perf_counter() - began) / len(CORPUS)
+        print(f"{'Cached' if cached else 'Parsed'}: {took * 1e6:.0f} µs per message")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
-from gcal_service import GoogleCalendarService
-from datatypes import EventBody, ListQuery, State
+from accounts import CredentialStore, ServicePool, Clients, DEFAULT_USER
+from report_cache import ReportCache
+from datatypes import EventBody, EventBatch, ListQuery, SlotQuery, GroupSlotQuery, State
+from free_slots import find_free_windows, busy_intervals
+from gcal_service import EVENT_FIELDS, new_event_id
+from compactor import CHARS_PER_TOKEN
+from event_table import encode_events, row_tokens
+from group_slots import GroupAvailability, parse_busy
+from speculation import Speculator, thread_of
 from langgraph.types import Command, interrupt
+from typing import AsyncIterator, Iterable
+from zoneinfo import ZoneInfo
+import asyncio
+import contextlib
+import datetime
 import json
+import os
+import tzlocal
 
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
-service = GoogleCalendarService()
+# Calendar credentials per user, and the user each thread acts for (the local user of token.json unless configured otherwise)
+credentials = CredentialStore(
+    directory=os.getenv("TOKEN_DIR", "tokens"), default_user=os.getenv("DEFAULT_CALENDAR_USER", DEFAULT_USER) or None,
+    max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", 100_000)), # Links last as long as the threads' checkpoints
+)
+# Calendar client and local, incrementally synced copy of the primary calendar per user, picked by the run's config
+pool = ServicePool(credentials, max_clients=int(os.getenv("CALENDAR_CLIENTS", 256)))
+reports = ReportCache() # Contextualizer's busy-times reports, dropped for a user whenever a write of theirs goes through the tools
+LISTING_TOKENS = int(os.getenv("LISTING_TOKENS", 8000)) # Most tokens of events a `list_events` result holds
+speculation = Speculator() # Fetches started ahead of the agents that may need them, e.g. while Indigo picks a helper
 
 def parseJSON(json_str: str) -> object:
     """Helper function to convert unpredictable AI JSON output to proper Python object"""
@@ -14,6 +38,20 @@ def parseJSON(json_str: str) -> object:
     
     return json.loads(stripped)
 
+def coroutine(sync_tool):
+    """Registers the decorated function as a tool's async implementation, which `ainvoke` and the async graph await"""
+
+    def register(func):
+        sync_tool.coroutine = func
+        return func
+    return register
+
+async def sync_store(store):
+    """Brings a store up to date before an async read, off the event loop, if the read would otherwise sync it on the loop"""
+
+    if store.stale:
+        await asyncio.to_thread(store.sync)
+
 def prune_events(obj: object):
     """Filters out non-identifying properties for more concise representation"""
 
@@ -36,35 +74,330 @@ def prune_events(obj: object):
         return [prune_events(event) for event in obj]
     return obj
 
+# Properties listings show that an edit can remove by leaving them out of the event body; the rest are read-only or required
+CLEARABLE_FIELDS = set(EVENT_FIELDS.split(",")) - {"id", "status", "start", "end", "recurringEventId", "originalStartTime", "eventType", "updated"}
+
 @tool(args_schema=EventBody)
-def add_event(**kwargs):
+def add_event(config: RunnableConfig, **kwargs):
     """Method to insert event into Google Calendar using API."""
 
     try:
         event_body = EventBody(**kwargs).model_dump(exclude={"startTime", "endTime"})
 
+        user, service, store = pool.get(config)
         event = service.events().insert(calendarId='primary', body=event_body).execute()  # Insert event
+        store.upsert(event)
+        reports.invalidate(user)
         #webbrowser.open(event.get('htmlLink')) # Open event in Google Calendar UI
         return event
     
     except Exception as e:
         return e
 
-@tool(args_schema=ListQuery)
-def list_events(**kwargs):
+@coroutine(add_event)
+async def aadd_event(config: RunnableConfig, **kwargs):
+    try:
+        event_body = EventBody(**kwargs).model_dump(exclude={"startTime", "endTime"})
+
+        user, service, store = await pool.aget(config)
+        event = await service.aio.events().insert(calendarId='primary', body=event_body).execute()
+        store.upsert(event)
+        reports.invalidate(user)
+        return event
+    except Exception as e:
+        return e
+
+@tool(args_schema=EventBatch)
+def add_events(config: RunnableConfig, **kwargs):
+    """Method to insert many events into Google Calendar at once, e.g. a whole schedule. Returns which events were added and which failed."""
+
+    try:
+        bodies = event_bodies(kwargs)
+        user, service, store = pool.get(config)
+        return insert_summary(bodies, service.insert_events(bodies), user, store)
+    except Exception as e:
+        return e
+
+@coroutine(add_events)
+async def aadd_events(config: RunnableConfig, **kwargs):
+    try:
+        bodies = event_bodies(kwargs)
+        user, service, store = await pool.aget(config)
+        return insert_summary(bodies, await service.aio.insert_events(bodies), user, store)
+    except Exception as e:
+        return e
+
+def event_bodies(kwargs: dict) -> list[dict]:
+    """Helper function to validate every event of a bulk insert before any is sent, and give each a client-generated ID"""
+
+    batch = EventBatch(**kwargs)
+    return [{"id": new_event_id(), **event.model_dump(exclude={"startTime", "endTime"})} for event in batch.events]
+
+def insert_summary(bodies: list[dict], results: dict, user: str, store) -> str:
+    """Helper function to record the events a bulk insert added, and summarize what happened to each one"""
+
+    added = [result for result in results.values() if isinstance(result, dict)]
+    for event in added:
+        store.upsert(event)
+    if added:
+        reports.invalidate(user)
+
+    summary = []
+    for body in bodies:
+        result = results.get(body["id"])
+        entry = {"summary": body.get("summary"), "start": body["start"]["dateTime"]}
+        if isinstance(result, dict):
+            summary.append({**entry, "id": result["id"]})
+        else:
+            summary.append({**entry, "error": getattr(result, "reason", None) or str(result)})
+    return json.dumps({"added": len(added), "failed": len(bodies) - len(added), "events": summary})
+
+@tool(args_schema=ListQuery, response_format="content_and_artifact")
+def list_events(config: RunnableConfig, **kwargs):
     """Method to list events based on query, a string of JSON with appropriate query params as detailed in system prompt."""
     try:
         params = ListQuery(**kwargs).model_dump()
-        events_result = service.events().list(
-            **params
-        ).execute()
-        events = events_result.get("items", [])
-        return json.dumps(prune_events(events), indent=3)
+        prefetched = speculation.take(listing_key(params, config))
+        if prefetched is not None:
+            with contextlib.suppress(Exception): # A prefetch that failed is run again below
+                result, version = prefetched.result()
+                if version == pool.get(config).store.version: # Nothing has changed since it was fetched
+                    return result
+        return listing(params, config)
+    except Exception as e:
+        return e, None
+
+@coroutine(list_events)
+async def alist_events(config: RunnableConfig, **kwargs):
+    try:
+        params = ListQuery(**kwargs).model_dump()
+        prefetched = speculation.take(listing_key(params, config))
+        if prefetched is not None:
+            with contextlib.suppress(Exception):
+                result, version = await asyncio.wrap_future(prefetched)
+                if version == (await pool.aget(config)).store.version:
+                    return result
+        format = params.pop("format")
+        user, service, store = await pool.aget(config)
+        await sync_store(store)
+        events = store.list(params)
+        if events is None:
+            return await aformat_events(service.aio.iter_events(params), format)
+        return format_events(events, format)
+    except Exception as e:
+        return e, None
+
+def listing(params: dict, config: RunnableConfig) -> tuple:
+    """Runs a `list_events` query (ListQuery params), returns (content, artifact) for the tool message"""
+
+    params = {**params}
+    format = params.pop("format")
+    user, service, store = pool.get(config)
+    events = store.list(params)
+    if events is None: # Store can't answer this query, stream it from the API a page at a time
+        events = service.iter_events(params)
+    return format_events(events, format)
+
+def prefetch_listing(params: dict, config: RunnableConfig):
+    """Starts a `list_events` query in the background, for a `list_events` call with the same params later in the turn
+    to pick up, so the fetch overlaps whatever runs in between"""
+
+    if thread_of(config) is None:
+        return
+    params = ListQuery(**params).model_dump()
+    def fetch():
+        version = pool.get(config).store.version # Read first, so a write while listing makes the result stale, not current
+        return listing(params, config), version
+    speculation.start(listing_key(params, config), fetch)
+
+def listing_key(params: dict, config: RunnableConfig) -> tuple:
+    return (thread_of(config), "list_events", json.dumps(params, sort_keys=True))
+
+def format_events(events: Iterable, format: str) -> tuple:
+    """Helper function to render a listing for the model, returns (content, artifact) for the tool message
+
+    A compact listing refers to events by short references, so its artifact maps each one back to the (pruned) event.
+    A JSON listing has the (pruned) events themselves. Either stops at the first `LISTING_TOKENS` tokens of events, and
+    says there were more (after the array, for JSON); streamed events after those are never fetched. Code that needs
+    every event in a window uses `list_all`."""
+
+    shown, tokens = [], 0
+    for event in events:
+        event = prune_events(event) if format != "compact" else event
+        tokens += event_tokens(event, format)
+        if tokens > LISTING_TOKENS:
+            return render_events(shown, format, more=True)
+        shown.append(event)
+    return render_events(shown, format)
+
+async def aformat_events(events: AsyncIterator, format: str) -> tuple:
+    """Async version of `format_events`, for events streamed from the API"""
+
+    shown, tokens = [], 0
+    async with contextlib.aclosing(events):
+        async for event in events:
+            event = prune_events(event) if format != "compact" else event
+            tokens += event_tokens(event, format)
+            if tokens > LISTING_TOKENS:
+                return render_events(shown, format, more=True)
+            shown.append(event)
+    return render_events(shown, format)
+
+def event_tokens(event: dict, format: str) -> int:
+    """Approximate tokens an event takes in a listing: its table row, or its JSON (pruned already)"""
+    return row_tokens(event) if format == "compact" else len(json.dumps(event)) // CHARS_PER_TOKEN + 1
+
+def render_events(events: list, format: str, more: bool = False) -> tuple:
+    """(content, artifact) for the events a listing shows, saying there were more if `more` is set; JSON events are pruned already"""
+
+    if format == "compact":
+        return encode_events(prune_events(events), more=more)
+    content = json.dumps(events)
+    return (content + "\n(more events not shown, narrow the time window to see them)" if more else content), None
+
+@tool(args_schema=SlotQuery)
+def find_free_slots(config: RunnableConfig, **kwargs):
+    """Method to find free time in the user's calendar across a range of days, as detailed in system prompt. Returns the free windows that fit the requested duration, each starting at the earliest slot in it."""
+    try:
+        query = SlotQuery(**kwargs)
+        return free_slots(query, list_all(busy_query(query), pool.get(config)))
     except Exception as e:
         return e
 
+@coroutine(find_free_slots)
+async def afind_free_slots(config: RunnableConfig, **kwargs):
+    try:
+        query = SlotQuery(**kwargs)
+        return free_slots(query, await alist_all(busy_query(query), await pool.aget(config)))
+    except Exception as e:
+        return e
+
+@tool(args_schema=GroupSlotQuery)
+def find_group_slots(config: RunnableConfig, **kwargs):
+    """Method to find meeting times when the user and other people are all free, from their calendars' free/busy information, as detailed in system prompt."""
+    try:
+        query = GroupSlotQuery(**kwargs)
+        return group_slots(query, pool.get(config).service.get_busy(*freebusy_query(query)))
+    except Exception as e:
+        return e
+
+@coroutine(find_group_slots)
+async def afind_group_slots(config: RunnableConfig, **kwargs):
+    try:
+        query = GroupSlotQuery(**kwargs)
+        user, service, store = await pool.aget(config)
+        return group_slots(query, await service.aio.get_busy(*freebusy_query(query)))
+    except Exception as e:
+        return e
+
+def slot_range(query: SlotQuery | GroupSlotQuery) -> tuple:
+    """Helper function to get the timezone, first day and number of days a slot query covers"""
+
+    timezone = ZoneInfo(query.timeZone) if query.timeZone else tzlocal.get_localzone()
+    first_day = datetime.date.fromisoformat(query.startDate)
+    days = (datetime.date.fromisoformat(query.endDate or query.startDate) - first_day).days + 1
+    return timezone, first_day, days
+
+def busy_query(query: SlotQuery) -> dict:
+    """Helper function to build the list query for the busy times across a free slot query's whole range"""
+
+    timezone, first_day, days = slot_range(query)
+
+    # Padded by the buffer so events just outside the range still count
+    time_min = datetime.datetime.combine(first_day, datetime.time(), timezone) - datetime.timedelta(minutes=query.buffer)
+    time_max = datetime.datetime.combine(first_day + datetime.timedelta(days=days), datetime.time(), timezone) + datetime.timedelta(minutes=query.buffer)
+    return {"calendarId": "primary", "timeMin": time_min.isoformat(), "timeMax": time_max.isoformat(), "singleEvents": True}
+
+def free_slots(query: SlotQuery, events: list) -> str:
+    """Helper function to find the free windows for a free slot query among the events in its range"""
+
+    timezone, first_day, days = slot_range(query)
+    busy_starts, busy_ends = busy_intervals(events, timezone)
+
+    starts, ends = find_free_windows(
+        busy_starts, busy_ends, first_day, days, timezone, hours=parse_hours(query.workingHours), weekdays=parse_weekdays(query.weekdays),
+        duration=query.duration, buffer=query.buffer, granularity=query.granularity,
+    )
+    return json.dumps([
+        {"start": datetime.datetime.fromtimestamp(start, timezone).isoformat(), "end": datetime.datetime.fromtimestamp(end, timezone).isoformat()}
+        for start, end in zip(starts[:query.maxResults].tolist(), ends[:query.maxResults].tolist())
+    ], indent=3)
+
+def group_calendars(query: GroupSlotQuery) -> tuple[list, list]:
+    """Helper function to get the required (the user's first) and optional calendars of a group slot query"""
+
+    required = list(dict.fromkeys(["primary"] + query.attendees))
+    optional = [calendar for calendar in dict.fromkeys(query.optionalAttendees or []) if calendar not in required]
+    return required, optional
+
+def freebusy_query(query: GroupSlotQuery) -> tuple[list, str, str]:
+    """Helper function to get the calendars and time range to read free/busy for, as `get_busy` arguments"""
+
+    timezone, first_day, days = slot_range(query)
+    time_min = datetime.datetime.combine(first_day, datetime.time(), timezone)
+    time_max = datetime.datetime.combine(first_day + datetime.timedelta(days=days), datetime.time(), timezone)
+    required, optional = group_calendars(query)
+    return required + optional, time_min.isoformat(), time_max.isoformat()
+
+def group_slots(query: GroupSlotQuery, busy: dict) -> str:
+    """Helper function to rank the meeting times for a group slot query from its calendars' free/busy"""
+
+    timezone, first_day, days = slot_range(query)
+    required, optional = group_calendars(query)
+
+    # Calendars whose free/busy can't be read (not shared, or not found) are left out and reported back
+    unreadable = [calendar for calendar in required + optional if not isinstance(busy.get(calendar), list)]
+    readable = {calendar: periods for calendar, periods in busy.items() if calendar not in unreadable}
+    parsed = parse_busy(readable)
+    if query.buffer:
+        parsed = {calendar: (starts - query.buffer * 60, ends + query.buffer * 60) for calendar, (starts, ends) in parsed.items()}
+
+    availability = GroupAvailability(parsed, first_day, days, timezone)
+    slots = availability.rank(
+        [calendar for calendar in required if calendar in readable], [calendar for calendar in optional if calendar in readable],
+        duration=query.duration, granularity=query.granularity, hours=parse_hours(query.workingHours), weekdays=parse_weekdays(query.weekdays),
+        preferred=parse_hours(query.preferredHours) if query.preferredHours else None, max_results=query.maxResults,
+    )
+    return json.dumps({
+        "slots": [{
+            "start": datetime.datetime.fromtimestamp(start, timezone).isoformat(),
+            "end": datetime.datetime.fromtimestamp(end, timezone).isoformat(),
+            "optionalAttendeesFree": free,
+        } for start, end, free in slots],
+        "unreadableCalendars": unreadable,
+    }, indent=3)
+
+def parse_hours(windows: list) -> list:
+    """Helper function to convert 'HH:MM-HH:MM' windows to (start, end) minutes after midnight"""
+
+    return [tuple(int(h) * 60 + int(m) for h, m in (t.split(":") for t in window.split("-"))) for window in windows]
+
+def parse_weekdays(weekdays: list) -> set | None:
+    """Helper function to convert weekday names to numbers, Monday being 0"""
+
+    return {["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"].index(day) for day in weekdays} if weekdays else None
+
+def list_all(params: dict, clients: Clients) -> list:
+    """Method to get every event matching a list query, from the store if it can answer it, otherwise every page from the API"""
+
+    user, service, store = clients
+    events = store.list(params)
+    if events is None:
+        events = list(service.iter_events(params, page_size=2500))
+    return events
+
+async def alist_all(params: dict, clients: Clients) -> list:
+    """Async version of `list_all`"""
+
+    user, service, store = clients
+    await sync_store(store)
+    events = store.list(params)
+    if events is None:
+        events = [event async for event in service.aio.iter_events(params, page_size=2500)]
+    return events
+
 @tool#(args_schema=EventBody)
-def update_event(event_body: str = ""):
+def update_event(config: RunnableConfig, event_body: str = ""):
     """Method to update an event based on an updated set of params, a string of JSON as detailed in system prompt."""
 
     if not event_body:
@@ -72,34 +405,133 @@ def update_event(event_body: str = ""):
 
     try: 
         event_body = parseJSON(event_body)
-        event = service.events().update(calendarId='primary', eventId=event_body['id'], body=event_body).execute() # Update event
+        user, service, store = pool.get(config)
+        changes = changed_fields(event_body, store.get(event_body['id']))
+        event = service.events().patch(calendarId='primary', eventId=event_body['id'], body=changes).execute() # Update event
+        store.upsert(event)
+        reports.invalidate(user)
         return event   
     except Exception as e:
         return e
     #webbrowser.open(event.get('htmlLink'))  # Open event in Google Calendar UI
 
+@coroutine(update_event)
+async def aupdate_event(config: RunnableConfig, event_body: str = ""):
+    if not event_body:
+        return "Found nothing to update."
+
+    try:
+        event_body = parseJSON(event_body)
+        user, service, store = await pool.aget(config)
+        await sync_store(store)
+        changes = changed_fields(event_body, store.get(event_body['id']))
+        event = await service.aio.events().patch(calendarId='primary', eventId=event_body['id'], body=changes).execute()
+        store.upsert(event)
+        reports.invalidate(user)
+        return event
+    except Exception as e:
+        return e
+
+def changed_fields(event_body: dict, current: dict | None) -> dict:
+    """Helper function to get the properties of an updated event body that differ from the event as last seen, to patch.
+    Properties a listing shows that the body leaves out are cleared (sent as None), so the editor can remove them;
+    those listings leave out (see `prune_events` and `gcal_service.EVENT_FIELDS`) are left as they are on the event"""
+
+    changes = {key: value for key, value in event_body.items() if key != "id" and (current is None or current.get(key) != value)}
+    removed = {key: None for key in CLEARABLE_FIELDS if key not in event_body and current is not None and key in current}
+    return {**removed, **changes}
+
 @tool
-def delete_event(event_id: str = ""):
+def delete_event(config: RunnableConfig, event_id: str = ""):
     """Method to delete an event based on the event's ID string."""
 
     if not event_id:
         return "Found nothing to update."
     
     try:
+        user, service, store = pool.get(config)
         event = service.events().delete(calendarId='primary', eventId=event_id).execute()
+        store.remove(event_id)
+        reports.invalidate(user)
         return event
     except Exception as e:
         return e
 
+@coroutine(delete_event)
+async def adelete_event(config: RunnableConfig, event_id: str = ""):
+    if not event_id:
+        return "Found nothing to update."
 
-def get_event(event_id: str):
-    """Method to delete an event based on the event's ID"""
+    try:
+        user, service, store = await pool.aget(config)
+        event = await service.aio.events().delete(calendarId='primary', eventId=event_id).execute()
+        store.remove(event_id)
+        reports.invalidate(user)
+        return event
+    except Exception as e:
+        return e
+
+
+def get_event(event_id: str, config: RunnableConfig = None):
+    """Method to get an event based on the event's ID"""
     try: 
-        event = service.events().get(calendarId='primary', eventId=event_id).execute()
+        user, service, store = pool.get(config)
+        event = store.get(event_id)
+        if event is None: # Not held locally (e.g. an instance of a series the store can't expand)
+            event = service.events().get(calendarId='primary', eventId=event_id).execute()
+        return event
+    except Exception as e:
+        return e
+
+async def aget_event(event_id: str, config: RunnableConfig = None):
+    """Async version of `get_event`"""
+    try:
+        user, service, store = await pool.aget(config)
+        await sync_store(store)
+        event = store.get(event_id)
+        if event is None:
+            event = await service.aio.events().get(calendarId='primary', eventId=event_id).execute()
         return event
     except Exception as e:
         return e
 
+def get_events(event_ids: list, config: RunnableConfig = None) -> list:
+    """Method to get many events by ID at once. Serves what it can from the store and fetches the rest in one batch request.
+    Returns events in the order of `event_ids`, with an error string in place of any event that couldn't be fetched"""
+
+    try:
+        user, service, store = pool.get(config)
+        events = {event_id: store.get(event_id) for event_id in event_ids}
+    except Exception as e:
+        return [str(e)] * len(event_ids)
+    missing = [event_id for event_id, event in events.items() if event is None]
+    
+    try:
+        if missing:
+            events.update(service.get_events(missing))
+    except Exception as e:
+        events.update({event_id: e for event_id in missing})
+
+    return [event if isinstance(event, dict) else str(event) for event in (events[event_id] for event_id in event_ids)]
+
+async def aget_events(event_ids: list, config: RunnableConfig = None) -> list:
+    """Async version of `get_events`, fetching the events the store doesn't hold at once rather than in a batch request"""
+
+    try:
+        user, service, store = await pool.aget(config)
+        await sync_store(store)
+        events = {event_id: store.get(event_id) for event_id in event_ids}
+    except Exception as e:
+        return [str(e)] * len(event_ids)
+    missing = [event_id for event_id, event in events.items() if event is None]
+
+    try:
+        if missing:
+            events.update(await service.aio.get_events(missing))
+    except Exception as e:
+        events.update({event_id: e for event_id in missing})
+
+    return [event if isinstance(event, dict) else str(event) for event in (events[event_id] for event_id in event_ids)]
 
 
 def format_namespace(namespace):
@@ -115,9 +547,9 @@ def print_stream(stream):
         print(
             f"\n---------- Update from {node_name} node in {format_namespace(namespace)} ---------\n"
         )
-        messages = chunk[node_name]["messages"]
+        messages = (chunk[node_name] or {}).get("messages", "")
         message = messages if not isinstance(messages, list) else messages[-1]
-        message.pretty_print() if not isinstance(message, tuple) else print(message)
+        message.pretty_print() if not isinstance(message, (tuple, str)) else print(message)
         print()
         
 
@@ -127,4 +559,4 @@ def print_state(state: State):
     print("Helper Agent:", state["helper_agent"])
     print("Context:", state["context"])
 
-tools = [add_event, list_events, update_event, delete_event]
\ No newline at end of file
+tools = [add_event, add_events, list_events, find_free_slots, find_group_slots, update_event, delete_event]
\ No newline at end of file
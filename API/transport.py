@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import os
+import weakref
+
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+POOL_HOSTS = int(os.getenv("CALENDAR_POOL_HOSTS", 8)) # Hosts to keep connection pools for (the API, the token endpoint, ...)
+POOL_SIZE = int(os.getenv("CALENDAR_POOL_SIZE", 64)) # Connections kept open per host, and the most requests in flight to one host
+TIMEOUT = float(os.getenv("CALENDAR_TIMEOUT", 60)) # Seconds, as googleapiclient's httplib2 default
+
+class PooledHttp:
+    """Thread-safe stand-in for the `httplib2.Http` a googleapiclient service sends its requests through
+
+    Requests go through a `requests` session authorized with the user's credentials (refreshed before they expire, and
+    on a 401), over a connection pool shared by every client in the process. Any number of threads can then use one
+    service at once, each call taking an open keep-alive connection from the pool, or waiting for one once `POOL_SIZE`
+    requests are in flight to the same host. Responses are gzip-compressed, as the client asks for, and decompressed here."""
+
+    def __init__(self, credentials, adapter: HTTPAdapter = None, timeout: float = TIMEOUT):
+        # Not exposed as `credentials`, which googleapiclient would refresh over a new httplib2 connection before each batch
+        self.session = AuthorizedSession(credentials)
+        self.timeout = timeout
+        adapter = adapter or shared_adapter()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        """Sends a request, returns (response, content) as `httplib2.Http.request` does"""
+
+        response = self.session.request(method, uri, data=body, headers=headers, timeout=self.timeout, allow_redirects=redirections > 0)
+        info = {key.lower(): value for key, value in response.headers.items()}
+        if "content-encoding" in info:
+            info["-content-encoding"] = info.pop("content-encoding") # The content is already decoded, marked the way httplib2 marks it
+        info["status"] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        """Nothing to close; the connections belong to the shared pool"""
+
+@functools.cache
+def shared_adapter() -> HTTPAdapter:
+    """The process-wide connection pool, `POOL_SIZE` connections per host"""
+    return HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, pool_block=True)
+
+@functools.cache
+def token_session() -> requests.Session:
+    """A session over the shared pool for token refreshes, so they reuse open connections to the token endpoint"""
+
+    session = requests.Session()
+    session.mount("https://", shared_adapter())
+    session.mount("http://", shared_adapter())
+    return session
+
+_sessions = weakref.WeakKeyDictionary() # Event loop -> its aiohttp session
+
+def async_session():
+    """The aiohttp session for the running event loop, `POOL_SIZE` connections per host, created on first use
+
+    aiohttp sessions belong to the loop they were made on, so each loop gets its own; close them with `close_async_sessions`."""
+
+    import aiohttp # Not imported at startup, only the async tools need it
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_HOSTS * POOL_SIZE, limit_per_host=POOL_SIZE)
+        session = _sessions[loop] = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=TIMEOUT))
+    return session
+
+async def close_async_sessions():
+    """Closes the running loop's aiohttp session, if it has one"""
+
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+# TESTING
+
+def main():
+    """Checks that concurrent calls on one service neither fail nor open more connections than they need"""
+
+    from concurrent.futures import ThreadPoolExecutor
+    from google.oauth2.credentials import Credentials
+    from fake_calendar import FakeCalendar, make_events
+    from gcal_service import GoogleCalendarService
+
+    with FakeCalendar(latency=0.02) as fake:
+        fake.seed(make_events(200))
+        service = GoogleCalendarService(creds=Credentials(token="fake"), api_endpoint=fake.url, token_path=None)
+        list_events = lambda _: len(service.events().list(calendarId="primary").execute()["items"])
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            for _ in range(3):
+                assert list(executor.map(list_events, range(50))) == [200] * 50
+        print(f"150 concurrent lists on one service over {fake.connections} connections")
+
+if __name__ == "__main__":
+    main()